@@ -26,6 +26,7 @@
 #include "deca_device_api.h"
 #include "deca_regs.h"
 #include "port_platform.h"
+#include "app_uart.h"
 
 #include "min.h"
 
@@ -35,6 +36,10 @@
 /* Inter-ranging delay period, in milliseconds. */
 #define RNG_DELAY_MS 100
 
+/* MIN framing on the UART: 1 sends the raw frame bytes, 0 prints every byte as ASCII hex ("AA AA AA ... 55") followed by
+ * a newline. Has to match MIN_BINARY_FRAMING in raspi-car/base_scripts/listen.py. */
+#define MIN_BINARY_FRAMING 0
+
 /* Frames used in the ranging process. See NOTE 1,2 below. */
 /* IDs Here! */
 /* Poller IDs should be set in the range of 100-200! */
@@ -375,7 +380,9 @@ void min_tx_start(uint8_t port)
 void min_tx_finished(uint8_t port)
 {
   //printf("Call: min_tx_finished\r\n");
+#if !MIN_BINARY_FRAMING
   printf("\n");
+#endif
 }
 
 
@@ -386,7 +393,12 @@ void min_tx_finished(uint8_t port)
 void min_tx_byte(uint8_t port, uint8_t byte)
 {
   // printf("Call: min_tx_byte\r\n");
+#if MIN_BINARY_FRAMING
+  /* Wait for space in the UART TX FIFO, the frame must not lose bytes */
+  while (app_uart_put(byte) == NRF_ERROR_NO_MEM);
+#else
   printf("%02X ", byte);
+#endif
 }
 
 
@@ -0,0 +1,80 @@
+"""
+Anchor Registry, maps the short address of every Anchor to a fixed Slot and its known Position
+"""
+
+import numpy as np
+
+
+# Number of responder_locations lists as_registry keeps a Registry for, the oldest is dropped first
+MAX_CACHED_REGISTRIES = 16
+
+# Registry of every responder_locations list: id of the list -> (list, copy of its contents, AnchorRegistry)
+_registries = {}
+
+class AnchorRegistry:
+    """
+    Built once at startup from a responder_locations list, e.g. [{8192: (0, 0, 0)}, {8193: (0, 100, 0)}].
+    Every Anchor gets a Slot in the order of the list, lookups by address are O(1).
+    """
+
+    def __init__(self, responder_locations):
+        """
+        :param responder_locations: list of dicts {short address: (x, y, z)} in CentiMeters
+        """
+        self.slots = {}
+        self.addresses = []
+        self.locations = []
+        for responder in responder_locations:
+            for address, location in responder.items():
+                if address in self.slots:
+                    raise ValueError('Anchor %d is defined twice' % address)
+                self.slots[address] = len(self.addresses)
+                self.addresses.append(address)
+                self.locations.append(tuple(location))
+
+        # Names used by the localization package
+        self.names = [str(address) for address in self.addresses]
+        self.positions = np.array(self.locations, dtype=np.float64).reshape(-1, 3)
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def __contains__(self, address):
+        return address in self.slots
+
+    def slot(self, address):
+        """
+        :param address: short address of the Anchor
+        :return: Slot of the Anchor, None if it is unknown
+        """
+        return self.slots.get(address)
+
+    def location(self, address):
+        """
+        :param address: short address of the Anchor
+        :return: (x, y, z) of the Anchor
+        """
+        return self.locations[self.slots[address]]
+
+
+def as_registry(responder_locations):
+    """
+    Returns responder_locations as AnchorRegistry. For a list the Registry is built once and reused while the list is
+    unchanged, so the Multilaterator of listen keeps its precomputed Matrices and its last Position between two Fixes
+    :param responder_locations: AnchorRegistry or list of dicts {short address: (x, y, z)}
+    :return:
+    """
+    if isinstance(responder_locations, AnchorRegistry):
+        return responder_locations
+    # The cached list is kept alive, so its id is not reused by another list
+    cached = _registries.get(id(responder_locations))
+    if cached is not None:
+        cached_list, contents, registry = cached
+        if cached_list is responder_locations and contents == responder_locations:
+            return registry
+    registry = AnchorRegistry(responder_locations)
+    if len(_registries) >= MAX_CACHED_REGISTRIES:
+        del _registries[next(iter(_registries))]
+    _registries[id(responder_locations)] = (responder_locations, [dict(responder) for responder in responder_locations],
+                                            registry)
+    return registry
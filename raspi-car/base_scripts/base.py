@@ -1,6 +1,8 @@
-import pigpio
-import time,sys, tty, termios, os, readchar
-from threading import Thread
+import time,sys
+from threading import Lock
+
+from base_scripts import logs
+from base_scripts import tracing
 
 #
 # pigpio uses BROADCOM PIN NUMBERING !!!
@@ -8,11 +10,7 @@ from threading import Thread
 MotLeft = 18 # Physical Pin #12
 MotRight = 19 # Pysical Pin #35
 
-GPIO = pigpio.pi()
-
-# Set the GPIO-Mode to ALT5 for HW-PWM
-GPIO.set_mode(MotLeft, pigpio.ALT5)
-GPIO.set_mode(MotRight, pigpio.ALT5)
+log = logs.get_logger('car')
 
 # Der Servo-Motor wird ueber die Impulslaenge gesteuert.
 # Der Motor erwartet Impulse von 700us bis 2300us bei 50 Hz
@@ -41,29 +39,148 @@ GPIO.set_mode(MotRight, pigpio.ALT5)
 
 
 
-# We allow speeds from -1.0 to 1.0 for each tire
-def set_speed(l, r):
-    # hertz
-    hertz = 50
-
-    r *= -1 # flip the right side
-
-
-    # clamp values to valid ranges
-    l = max(-1.0, min(1.0, l))
-    r = max(-1.0, min(1.0, r))
-
-    # duty length in milli seconds, e.g. 20ms for 50 hertz
-    full_duty_length = (1000.0/hertz)
-    min_duty_ratio = 1.0 / full_duty_length # the min duty ratio in percent
-    max_duty_ratio = 2.0 / full_duty_length # the max duty ratio in percent
+# hertz
+HERTZ = 50
+
+# duty length in milli seconds, e.g. 20ms for 50 hertz
+FULL_DUTY_LENGTH = (1000.0/HERTZ)
+MIN_DUTY_RATIO = 1.0 / FULL_DUTY_LENGTH # the min duty ratio in percent
+MAX_DUTY_RATIO = 2.0 / FULL_DUTY_LENGTH # the max duty ratio in percent
+DUTY_RATIO_RANGE = MAX_DUTY_RATIO - MIN_DUTY_RATIO
+
+# pigpio Script setting both Motors with one call, p0 and p1 are the duty cycles
+SPEED_SCRIPT = ('hp %d %d p0 hp %d %d p1' % (MotLeft, HERTZ, MotRight, HERTZ)).encode()
+
+
+def duty_cycle(speed):
+    """
+    :param speed: speed of a tire from -1.0 to 1.0, clamped
+    :return: duty cycle for GPIO.hardware_PWM in millionths
+    """
+    speed = max(-1.0, min(1.0, speed))
+    return (int)((MIN_DUTY_RATIO + DUTY_RATIO_RANGE*(0.5*(speed+1.0)))*1000000.0)
+
+
+class MotorOutput:
+    """
+    Writes the duty cycles of both Motors to the pigpio daemon.
+    Unchanged duty cycles are not sent again, changed ones are sent with one call of a stored pigpio Script.
+    If the Script can not be used it falls back to two hardware_PWM calls.
+    """
+
+    def __init__(self, pi=None, use_script=True):
+        """
+        :param pi: connected pigpio.pi (or a stub with the same methods), connects to the local daemon if None
+        :param use_script: set both Motors with one Script call instead of two hardware_PWM calls
+        """
+        if pi is None:
+            import pigpio
+            pi = pigpio.pi()
+            # Set the GPIO-Mode to ALT5 for HW-PWM
+            pi.set_mode(MotLeft, pigpio.ALT5)
+            pi.set_mode(MotRight, pigpio.ALT5)
+        self.pi = pi
+        self.script_id = None
+        self.duty_left = None
+        self.duty_right = None
+        self.number_of_writes = 0
+        self.number_of_skipped_writes = 0
+        self._lock = Lock()
+        if use_script:
+            self.script_id = self._store_script()
+
+    def _store_script(self):
+        try:
+            script_id = self.pi.store_script(SPEED_SCRIPT)
+            # The daemon checks the Script in the background
+            for i in range(100):
+                status, params = self.pi.script_status(script_id)
+                if status != 0:  # PI_SCRIPT_INITING
+                    break
+                time.sleep(0.001)
+            if script_id < 0 or status != 1:  # PI_SCRIPT_HALTED, ready to run
+                log.warning('Motor Output: pigpio Script not ready (status %d), using hardware_PWM', status)
+                return None
+            return script_id
+        except Exception as e:
+            # pigpio.error, e.g. a daemon without Script support
+            log.warning('Motor Output: can not store pigpio Script: %s', e)
+            return None
+
+    def set_speed(self, l, r):
+        """
+        :param l: speed of the left tire from -1.0 to 1.0
+        :param r: speed of the right tire from -1.0 to 1.0
+        :return: True if the duty cycles were sent, False if they did not change
+        """
+        r *= -1 # flip the right side
+        duty_left = duty_cycle(l)
+        duty_right = duty_cycle(r)
+
+        with self._lock:
+            if duty_left == self.duty_left and duty_right == self.duty_right:
+                self.number_of_skipped_writes += 1
+                return False
+            if self.script_id is not None:
+                try:
+                    self.pi.run_script(self.script_id, [duty_left, duty_right])
+                except Exception as e:
+                    log.warning('Motor Output: pigpio Script failed: %s, using hardware_PWM', e)
+                    self.script_id = None
+            if self.script_id is None:
+                self.pi.hardware_PWM(MotLeft, HERTZ, duty_left)
+                self.pi.hardware_PWM(MotRight, HERTZ, duty_right)
+            self.duty_left = duty_left
+            self.duty_right = duty_right
+            self.number_of_writes += 1
+            return True
+
+    def close(self):
+        with self._lock:
+            if self.script_id is not None:
+                try:
+                    self.pi.delete_script(self.script_id)
+                except Exception:
+                    pass
+                self.script_id = None
+
+
+_output = None
+_output_lock = Lock()
+
+
+def get_output():
+    """
+    Returns the MotorOutput of the Car, connects to pigpio on the first call
+    :return:
+    """
+    global _output
+    if _output is None:
+        with _output_lock:
+            if _output is None:
+                _output = MotorOutput()
+    return _output
+
+
+def set_output(output):
+    """
+    Replaces the MotorOutput, e.g. by one with a stub pi for benchmarks and simulations
+    :param output: MotorOutput or any object with set_speed(l, r), None to connect to pigpio on the next call
+    :return: the previous MotorOutput, None if none was set, pass it to set_output to restore it
+    """
+    global _output
+    with _output_lock:
+        previous = _output
+        _output = output
+    return previous
 
-    duty_ratio_l = min_duty_ratio + (max_duty_ratio-min_duty_ratio)*(0.5*(l+1.0))
-    duty_ratio_r = min_duty_ratio + (max_duty_ratio-min_duty_ratio)*(0.5*(r+1.0))
 
-    GPIO.hardware_PWM(MotLeft, hertz, (int)(duty_ratio_l*1000000.0))
-    GPIO.hardware_PWM(MotRight, hertz, (int)(duty_ratio_r*1000000.0))
+# We allow speeds from -1.0 to 1.0 for each tire
+def set_speed(l, r):
+    start = tracing.begin()
+    get_output().set_speed(l, r)
+    tracing.end(tracing.PWM, start)
 
 
 if __name__ == '__main__':
-    set_speed(float(sys.argv[1]), float(sys.argv[2]))
\ No newline at end of file
+    set_speed(float(sys.argv[1]), float(sys.argv[2]))
@@ -1,9 +1,21 @@
 import time
 import math
-import logging
 import numpy as np
-from threading import Lock, Thread
+from collections import namedtuple
+from threading import Condition, Lock, Thread
 from base_scripts import base
+from base_scripts import heading_controller as heading_control
+from base_scripts import logs
+
+
+log = logs.get_logger('car')
+
+# Immutable estimation of the Car, a new Pose replaces the old one with a single reference swap.
+# heading in radians (None if unknown), covariance of (x, y), velocity (vx, vy), timestamp of time.monotonic(),
+# seq counts the published Poses
+Pose = namedtuple('Pose', ['x', 'y', 'heading', 'covariance', 'timestamp', 'seq', 'velocity'])
+
+INITIAL_POSE = Pose(0, 0, None, None, None, 0, None)
 
 class Car:
 
@@ -16,8 +28,7 @@ class Car:
             self.speed = speed
 
     def get_number_of_estimations(self):
-        with self.lock:
-            return self.number_of_estimations
+        return self.pose.seq
 
     def get_number_of_read_estimations(self):
         with self.lock:
@@ -27,19 +38,54 @@ class Car:
         with self.lock:
             self.number_of_read_estimations += 1
 
+    def get_pose(self):
+        """
+        Latest Pose, x and y always belong to the same estimation. Needs no Lock, the Pose is never changed.
+        :return: Pose
+        """
+        return self.pose
+
     def get_current_estimation_x(self):
-        with self.lock:
-            return self.current_estimation_x
+        return self.pose.x
 
     def get_current_estimation_y(self):
-        with self.lock:
-            return self.current_estimation_y
+        return self.pose.y
 
     def set_current_estimation_x_y(self, new_estimation_x, new_estimation_y):
+        self.publish_pose(new_estimation_x, new_estimation_y)
+
+    def publish_pose(self, x, y, heading=None, covariance=None, velocity=None, timestamp=None):
+        """
+        Publishes a new estimation and wakes up the Threads waiting for it
+        :param x:
+        :param y:
+        :param heading: heading in radians, None if unknown
+        :param covariance: 2x2 covariance of (x, y)
+        :param velocity: (vx, vy)
+        :param timestamp: time.monotonic() of the estimation, now if None
+        :return: the published Pose
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
         with self.lock:
-            self.current_estimation_x = new_estimation_x
-            self.current_estimation_y = new_estimation_y
-            self.number_of_estimations += 1
+            # Only the sequence number needs the Lock, Readers see either the old or the new Pose
+            pose = Pose(x, y, heading, covariance, timestamp, self.pose.seq + 1, velocity)
+            self.pose = pose
+            self.estimation_changed.notify_all()
+        return pose
+
+    def wait_for_estimation(self, number_of_seen_estimations, timeout=None):
+        """
+        Blocks until there is a newer estimation than the caller has seen or the destination is reached
+        :param number_of_seen_estimations: number of estimations the caller has already handled
+        :param timeout: seconds to wait at most, None to wait forever
+        :return: the current number of estimations
+        """
+        with self.estimation_changed:
+            self.estimation_changed.wait_for(
+                lambda: self.pose.seq > number_of_seen_estimations or self.is_reached_destination,
+                timeout=timeout)
+            return self.pose.seq
 
     def get_is_reached_destination(self):
         with self.lock:
@@ -48,6 +94,7 @@ class Car:
     def set_is_reached_destination(self):
         with self.lock:
             self.is_reached_destination = True
+            self.estimation_changed.notify_all()
 
 
     def PID2(self, estimation_x, estimation_y, acceptable_error):
@@ -62,42 +109,45 @@ class Car:
         #calculate current direction from current estimation and previous estimation
         current_direction_x = estimation_x - self.previous_pos_x
         current_direction_y = estimation_y - self.previous_pos_y
-        logging.info('PID: previous_pos(x,y): (%d, %d)' % (self.previous_pos_x, self.previous_pos_y))
-        logging.info('PID: current_direction(x,y): (%d, %d)' % (current_direction_x, current_direction_y))
+        log.info('PID: previous_pos(x,y): (%d, %d)', self.previous_pos_x, self.previous_pos_y)
+        log.info('PID: current_direction(x,y): (%d, %d)', current_direction_x, current_direction_y)
 
         # save current estimations for next round
         self.previous_pos_x = estimation_x
         self.previous_pos_y = estimation_y
-        logging.info('PID: estimation(x,y): (%d, %d)' % (estimation_x, estimation_y))
+        log.info('PID: estimation(x,y): (%d, %d)', estimation_x, estimation_y)
 
         # calculate goal direction from goal position and current estimation
         goal_direction_x = self.goal_pos_x - estimation_x
         goal_direction_y = self.goal_pos_y - estimation_y
-        logging.info('PID: goal_direction(x,y): (%d, %d)' % (goal_direction_x, goal_direction_y))
+        log.info('PID: goal_direction(x,y): (%d, %d)', goal_direction_x, goal_direction_y)
         
         # calculate error rates for goal position
         error_x = abs(estimation_x - self.goal_pos_x)
         error_y = abs(estimation_y - self.goal_pos_y)
-        logging.info('PID: error(x,y): (%d, %d)' % (error_x, error_y))
+        log.info('PID: error(x,y): (%d, %d)', error_x, error_y)
 
         # angle is always between 0.0 and 180.0
         angle = np.degrees(self.angle_between((current_direction_x, current_direction_y), (goal_direction_x, goal_direction_y)))
-        logging.info('PID: angle to goal: %d' % angle)
+        log.info('PID: angle to goal: %d', angle)
 
         distance = math.sqrt((goal_direction_x - current_direction_x) * (goal_direction_x - current_direction_x) + \
                              (goal_direction_y - current_direction_y) * (goal_direction_y - current_direction_y))
-        logging.info('PID: distance to goal: %d' % distance)
+        log.info('PID: distance to goal: %d', distance)
 
         if distance < acceptable_error:
             # Position achieved
-            base.set_speed(0.0, 0.0)
+            if self.scheduler is not None:
+                self.scheduler.post_stop()
+            else:
+                base.set_speed(0.0, 0.0)
             self.speed = 0
-            logging.info('PID: Arrived at Goal Destination, distance: %d' % distance)
+            log.info('PID: Arrived at Goal Destination, distance: %d', distance)
             return True
         elif goal_direction_x - current_direction_x > 0:
             # Turn right
             hold_time = 0.7
-            logging.info('PID: turning RIGHT with angle: %f and hold_time: %d' % (angle, hold_time))
+            log.info('PID: turning RIGHT with angle: %f and hold_time: %d', angle, hold_time)
             if(self.continous_drive_mode):
                 self.drive_continuous(speed=0.3, change=(angle/180))
             else:
@@ -108,7 +158,7 @@ class Car:
         elif goal_direction_x - current_direction_x < 0:
             # Turn left
             hold_time = 0.7
-            logging.info('PID: turning LEFT with angle: %f and hold_time: %d' % (angle, hold_time))
+            log.info('PID: turning LEFT with angle: %f and hold_time: %d', angle, hold_time)
             if(self.continous_drive_mode):
                 self.drive_continuous(speed=0.3, change=(-1)*(angle/180))
             else:
@@ -118,6 +168,35 @@ class Car:
 
 
 
+    def steer(self, estimation_x, estimation_y, heading, acceptable_error, dt):
+        """
+        PID controller on the heading error, the heading comes from the Kalman Filter velocity.
+        Drives continuously, with a Motor Scheduler it returns at once.
+        :param estimation_x:
+        :param estimation_y:
+        :param heading: heading in radians, None if unknown
+        :param acceptable_error: in CentiMeters
+        :param dt: seconds since the last call
+        :return: True if the Goal is reached
+        """
+        speed, change, distance = self.heading_controller.update(estimation_x, estimation_y, heading,
+                                                                 self.goal_pos_x, self.goal_pos_y, dt)
+        log.debug('PID: estimation(x,y): (%d, %d), distance to goal: %d, speed: %f, change: %f',
+                  estimation_x, estimation_y, distance, speed, change)
+
+        if distance < acceptable_error:
+            if self.scheduler is not None:
+                self.scheduler.post_stop()
+            else:
+                base.set_speed(0.0, 0.0)
+            self.speed = 0
+            self.heading_controller.reset()
+            log.info('PID: Arrived at Goal Destination, distance: %d', distance)
+            return True
+
+        self.drive_continuous(speed=speed, change=change)
+        return False
+
     def drive(self, speed=0.5, hold_time=0, change=0):
         """
         Drives the vehicle forward for a specific amount of time
@@ -145,6 +224,13 @@ class Car:
             l_coefficient = 1 # + (change/2)
             r_coefficient = 1 - (change/2)
 
+        if self.scheduler is not None:
+            # The Scheduler ramps up, holds and ramps down, the Controller does not wait for it
+            self.scheduler.post((speed * l_coefficient) + self.calibration_left_wheel,
+                                (speed * r_coefficient) + self.calibration_right_wheel,
+                                hold_time=hold_time)
+            return
+
         for speed_tmp in [x * 0.1 for x in range(0, int(speed*10))]:
             base.set_speed((speed_tmp * l_coefficient) + self.calibration_left_wheel,
                            (speed_tmp * r_coefficient) + self.calibration_right_wheel)
@@ -182,7 +268,10 @@ class Car:
             l_coefficient = 1 # + (change/2)
             r_coefficient = 1 - (change/2)
 
-        if (self.speed < speed):
+        if self.scheduler is not None:
+            self.scheduler.post((speed * l_coefficient) + self.calibration_left_wheel,
+                                (speed * r_coefficient) + self.calibration_right_wheel)
+        elif (self.speed < speed):
             # increse the current speed to match goal speed
             '''
             for speed_tmp in [x * 0.1 for x in range(self.speed, int(speed*10))]:
@@ -210,28 +299,40 @@ class Car:
         """
         Returns the unit vector of the vector.  
         :param vector:
+        :return: the unit vector, the zero vector if vector has no length
         """
-        return vector / np.linalg.norm(vector)
+        vector = np.asarray(vector, dtype=np.float64)
+        norm = np.linalg.norm(vector)
+        if norm == 0.0:
+            return np.zeros_like(vector)
+        return vector / norm
 
     def angle_between(self, v1, v2):
         """
         Returns the angle in radians between vectors 'v1' and 'v2'
         :param v1:
         :param v2:
+        :return: the angle, 0.0 if one of the vectors has no length, e.g. the Car did not move since the last Fix
         """
         v1_u = self.unit_vector(v1)
         v2_u = self.unit_vector(v2)
+        if not v1_u.any() or not v2_u.any():
+            return 0.0
         return np.arccos(np.clip(np.dot(v1_u, v2_u), -1.0, 1.0))
 
 
 
-    def __init__(self, goal_x, goal_y, calibration_left_wheel, calibration_right_wheel, drive_mode):
+    def __init__(self, goal_x, goal_y, calibration_left_wheel, calibration_right_wheel, drive_mode, scheduler=None,
+                 heading_controller=None):
         """
         :param goal_x:
         :param goal_y:
         :param calibration_left_wheel:
         :param calibration_right_wheel:
         :param drive_mode:
+        :param scheduler: running MotorScheduler, drive and drive_continuous post to it and return at once.
+            None to set the Motors directly and sleep during the ramps
+        :param heading_controller: HeadingController used by steer, one with the default gains if None
         """
         self.goal_pos_x = goal_x
         self.goal_pos_y = goal_y
@@ -240,13 +341,15 @@ class Car:
         self.is_reached_destination = False
         self.mode = 0 #0 for stationary or 1 for moving
         self.continous_drive_mode = drive_mode
-        self.current_estimation_x = 0
-        self.current_estimation_y = 0
+        self.scheduler = scheduler
+        self.heading_controller = heading_controller if heading_controller is not None else heading_control.HeadingController()
+        self.pose = INITIAL_POSE
         self.previous_pos_x = 0
         self.previous_pos_y = 0
         self.previous_direction_x = 0
         self.previous_direction_y = 0
         self.speed = 0
-        self.number_of_estimations = 0
         self.number_of_read_estimations = 0
         self.lock = Lock()
+        # Wakes up the driving Thread when a new estimation is published, shares the Lock of the getters
+        self.estimation_changed = Condition(self.lock)
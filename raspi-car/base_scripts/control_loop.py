@@ -0,0 +1,192 @@
+"""
+Periodic Control Loop with absolute deadlines.
+Every cycle is scheduled at start + n * period on time.monotonic_ns(), a slow cycle does not shift the following ones.
+The Loop records overruns, a histogram of the wake-up jitter and of the sense-to-actuate latency.
+"""
+
+import math
+import time
+from array import array
+
+from base_scripts import logs
+
+
+log = logs.get_logger('driving')
+
+
+class Histogram:
+    """
+    Histogram with fixed bins, preallocated so recording in the Loop does not allocate
+    """
+
+    __slots__ = ('bin_width', 'counts', 'count', 'total', 'minimum', 'maximum')
+
+    def __init__(self, bin_width, number_of_bins):
+        """
+        :param bin_width: width of a bin, e.g. in microseconds
+        :param number_of_bins: values above the last bin are counted in the last bin
+        """
+        self.bin_width = bin_width
+        self.counts = array('L', bytes(array('L').itemsize * number_of_bins))
+        self.count = 0
+        self.total = 0
+        self.minimum = float('inf')
+        self.maximum = 0
+
+    def bin(self, value):
+        """
+        :return: index of the bin of value
+        """
+        return int(value // self.bin_width)
+
+    def edge(self, index):
+        """
+        :return: lower edge of the bin index
+        """
+        return index * self.bin_width
+
+    def record(self, value):
+        index = self.bin(value)
+        if index < 0:
+            index = 0
+        elif index >= len(self.counts):
+            index = len(self.counts) - 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        if value < self.minimum:
+            self.minimum = value
+        if value > self.maximum:
+            self.maximum = value
+
+    def percentile(self, percent):
+        """
+        Interpolates linearly inside the bin which contains the percentile, the edges of the bin are limited to the
+        minimum and the maximum, so Stages much faster than one bin do not all report the bin width
+        :param percent: e.g. 99 for the 99th percentile
+        :return: percentile, between the minimum and the maximum, 0 if empty
+        """
+        if self.count == 0:
+            return 0
+        limit = self.count * percent / 100.0
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= limit:
+                lower = max(self.edge(index), self.minimum)
+                upper = min(self.edge(index + 1), self.maximum)
+                return lower + (upper - lower) * max(limit - seen, 0) / count
+            seen += count
+        return self.maximum
+
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+
+class LogHistogram(Histogram):
+    """
+    Histogram with log-spaced bins, every bin is the same fraction wider than the previous one.
+    Keeps the relative resolution for Stages from below a microsecond up to many milliseconds.
+    """
+
+    __slots__ = ('lowest', 'ratio', 'scale')
+
+    def __init__(self, lowest, highest, bins_per_decade=20):
+        """
+        :param lowest: upper edge of the first bin, e.g. in microseconds, smaller values are counted in the first bin
+        :param highest: values above are counted in the last bin
+        :param bins_per_decade: number of bins from a value to ten times the value
+        """
+        self.lowest = lowest
+        self.ratio = 10 ** (1 / bins_per_decade)
+        self.scale = bins_per_decade / math.log(10)
+        super().__init__(lowest, math.ceil(math.log10(highest / lowest) * bins_per_decade) + 1)
+
+    def bin(self, value):
+        if value < self.lowest:
+            return 0
+        return int(math.log(value / self.lowest) * self.scale) + 1
+
+    def edge(self, index):
+        if index == 0:
+            return 0
+        return self.lowest * self.ratio ** (index - 1)
+
+
+class PeriodicLoop:
+    """
+    Calls step(now_ns) at a fixed rate until should_stop() returns True.
+    step may return the monotonic_ns timestamp of the Measurement it acted on, the Loop records the
+    time from that Measurement to the end of the step as sense-to-actuate latency.
+    """
+
+    def __init__(self, rate, step, name='Control Loop'):
+        """
+        :param rate: cycles per second, e.g. 20 to 50
+        :param step: function (now_ns) -> monotonic_ns of the used Measurement or None
+        :param name: name in the log
+        """
+        self.period_ns = int(1e9 / rate)
+        self.step = step
+        self.name = name
+        self.number_of_cycles = 0
+        self.number_of_overruns = 0
+        self.number_of_skipped_cycles = 0
+        # Microseconds, jitter up to 10 ms, duration up to 100 ms and latency up to 2 s
+        self.jitter = Histogram(50, 200)
+        self.latency = Histogram(1000, 2000)
+        self.duration = Histogram(100, 1000)
+
+    def run(self, should_stop, log_every=None):
+        """
+        :param should_stop: function returning True to leave the Loop
+        :param log_every: log the timing every log_every cycles, None to only log it at the end
+        :return:
+        """
+        period = self.period_ns
+        deadline = time.monotonic_ns()
+        while not should_stop():
+            start = time.monotonic_ns()
+            self.jitter.record((start - deadline) / 1000)
+
+            measurement_ns = self.step(start)
+            end = time.monotonic_ns()
+            self.duration.record((end - start) / 1000)
+            if measurement_ns is not None:
+                self.latency.record((end - measurement_ns) / 1000)
+            self.number_of_cycles += 1
+
+            deadline += period
+            if end > deadline:
+                # Overrun, continue with the next deadline in the future instead of catching up
+                self.number_of_overruns += 1
+                missed = (end - deadline) // period + 1
+                self.number_of_skipped_cycles += missed
+                deadline += missed * period
+
+            if log_every is not None and self.number_of_cycles % log_every == 0:
+                self.log_statistics()
+
+            delay = deadline - time.monotonic_ns()
+            if delay > 0:
+                time.sleep(delay / 1e9)
+        self.log_statistics()
+
+    def statistics(self):
+        """
+        :return: dict of the timing of the Loop, times in microseconds
+        """
+        return {'cycles': self.number_of_cycles,
+                'overruns': self.number_of_overruns,
+                'skipped_cycles': self.number_of_skipped_cycles,
+                'jitter_p50_us': self.jitter.percentile(50),
+                'jitter_p99_us': self.jitter.percentile(99),
+                'jitter_max_us': self.jitter.maximum,
+                'duration_p99_us': self.duration.percentile(99),
+                'latency_p50_us': self.latency.percentile(50),
+                'latency_p99_us': self.latency.percentile(99)}
+
+    def log_statistics(self):
+        log.info('%s: %d cycles, %d overruns, jitter p50 %d us p99 %d us max %d us, latency p50 %d us p99 %d us',
+                 self.name, self.number_of_cycles, self.number_of_overruns,
+                 self.jitter.percentile(50), self.jitter.percentile(99), self.jitter.maximum,
+                 self.latency.percentile(50), self.latency.percentile(99))
@@ -1,4 +1,122 @@
+import time
+from array import array
+
+
+# Number of Ranges kept per Anchor, older Ranges are overwritten
+DEFAULT_WINDOW = 100
+
+
+class RangeBuffer:
+    """
+    Ring Buffer of a fixed number of Ranges with their timestamps.
+    Push is O(1) and the mean and variance of the window are kept as running sums, reading them is O(1) as well.
+    """
+
+    __slots__ = ('window', '_values', '_timestamps', '_head', '_count', '_sum', '_sum_of_squares', '_pushes')
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        """
+        :param window: number of Ranges kept, older Ranges are overwritten
+        """
+        if window < 1:
+            raise ValueError('window must be at least 1, not %d' % window)
+        self.window = window
+        self._values = array('d', bytes(8 * window))
+        self._timestamps = array('d', bytes(8 * window))
+        self.clear()
+
+    def clear(self):
+        self._head = 0
+        self._count = 0
+        self._sum = 0.0
+        self._sum_of_squares = 0.0
+        self._pushes = 0
+
+    def __len__(self):
+        return self._count
+
+    def push(self, value, timestamp=None):
+        """
+        Adds a Range, overwrites the oldest one if the buffer is full
+        :param value: the Range
+        :param timestamp: time.monotonic() of the Range, now if None
+        :return:
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        head = self._head
+        if self._count == self.window:
+            old = self._values[head]
+            self._sum -= old
+            self._sum_of_squares -= old * old
+        else:
+            self._count += 1
+        self._values[head] = value
+        self._timestamps[head] = timestamp
+        self._sum += value
+        self._sum_of_squares += value * value
+        self._head = head + 1 if head + 1 < self.window else 0
+
+        # Recalculate the running sums once per window, otherwise rounding errors add up over a long run
+        self._pushes += 1
+        if self._pushes >= self.window:
+            self._pushes = 0
+            self._sum = sum(self._values[:self._count])
+            self._sum_of_squares = sum(v * v for v in self._values[:self._count])
+
+    def mean(self):
+        """
+        :return: mean of the window, ZeroDivisionError if it is empty
+        """
+        return self._sum / self._count
+
+    def variance(self):
+        """
+        :return: variance of the window, 0 for less than 2 Ranges
+        """
+        if self._count < 2:
+            return 0.0
+        mean = self._sum / self._count
+        return max(self._sum_of_squares / self._count - mean * mean, 0.0)
+
+    def latest(self):
+        """
+        :return: (Range, timestamp) of the newest Range
+        """
+        index = self._head - 1 if self._head > 0 else self.window - 1
+        return self._values[index], self._timestamps[index]
+
+    def oldest(self):
+        """
+        :return: (Range, timestamp) of the oldest Range, the one the next push overwrites if the buffer is full
+        """
+        index = self._head if self._count == self.window else 0
+        return self._values[index], self._timestamps[index]
+
+    def _ordered(self, data):
+        if self._count < self.window:
+            return data[:self._count]
+        return data[self._head:] + data[:self._head]
+
+    def values(self):
+        """
+        :return: array of the Ranges in the window, oldest first
+        """
+        return self._ordered(self._values)
+
+    def timestamps(self):
+        """
+        :return: array of the timestamps in the window, oldest first
+        """
+        return self._ordered(self._timestamps)
+
+
 class distance_data_set:
+    """
+    Distances of one Anchor, keeps the last window Distances and Distances with Range Bias
+    """
+
+    __slots__ = ('dest_addr', 'source_addr', 'distance_numbers', 'distance_bias_numbers')
 
     def get_dest_addr(self):
         return self.dest_addr
@@ -6,33 +124,33 @@ class distance_data_set:
     def get_source_addr(self):
         return self.source_addr
 
-    def set_distance(self, distance):
-        self.distance_numbers.append(distance)
+    def set_distance(self, distance, timestamp=None):
+        self.distance_numbers.push(distance, timestamp)
 
     def get_distances(self):
-        return self.distance_numbers
+        return list(self.distance_numbers.values())
 
     def get_distance_size(self):
         return len(self.distance_numbers)
 
     def get_distance_norm(self):
-        return sum(self.distance_numbers) / len(self.distance_numbers)
+        return self.distance_numbers.mean()
 
-    def set_distance_bias(self, distance_bias):
-        self.distance_bias_numbers.append(distance_bias)
+    def set_distance_bias(self, distance_bias, timestamp=None):
+        self.distance_bias_numbers.push(distance_bias, timestamp)
 
     def get_distances_bias(self):
-        return self.distance_bias_numbers
+        return list(self.distance_bias_numbers.values())
 
     def get_distance_bias_size(self):
         return len(self.distance_bias_numbers)
 
     def get_distance_bias_norm(self):
-        return sum(self.distance_bias_numbers) / len(self.distance_bias_numbers)
+        return self.distance_bias_numbers.mean()
 
 
-    def __init__(self, dest_addr, source_addr):
+    def __init__(self, dest_addr, source_addr, window=DEFAULT_WINDOW):
         self.dest_addr = dest_addr
         self.source_addr = source_addr
-        self.distance_numbers = []
-        self.distance_bias_numbers = []
\ No newline at end of file
+        self.distance_numbers = RangeBuffer(window)
+        self.distance_bias_numbers = RangeBuffer(window)
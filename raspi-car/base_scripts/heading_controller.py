@@ -0,0 +1,125 @@
+"""
+Heading Controller, steers the Car to the Goal with a PID on the heading error.
+The heading comes from the velocity of the Kalman Filter instead of two consecutive Position Fixes.
+"""
+
+import math
+
+
+def wrap_angle(angle):
+    """
+    :param angle: angle in radians
+    :return: the same angle between -pi and pi
+    """
+    return (angle + math.pi) % (2 * math.pi) - math.pi
+
+
+class PID:
+    """
+    PID with integral anti-windup and a low-pass filtered derivative.
+    The integral is clamped and does not grow while the output is saturated.
+    """
+
+    def __init__(self, kp, ki=0.0, kd=0.0, output_limit=1.0, integral_limit=1.0, derivative_time_constant=0.1):
+        """
+        :param kp: proportional gain
+        :param ki: integral gain
+        :param kd: derivative gain
+        :param output_limit: the output is clamped to -output_limit .. output_limit
+        :param integral_limit: the integral term (ki * integral) is clamped to -integral_limit .. integral_limit
+        :param derivative_time_constant: time constant of the derivative low-pass in seconds, 0 for no filter
+        """
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.output_limit = output_limit
+        self.integral_limit = integral_limit
+        self.derivative_time_constant = derivative_time_constant
+        self.reset()
+
+    def reset(self):
+        self.integral = 0.0
+        self.derivative = 0.0
+        self.previous_error = None
+
+    def update(self, error, dt):
+        """
+        :param error: setpoint - measurement
+        :param dt: seconds since the last update
+        :return: clamped output
+        """
+        if dt <= 0:
+            dt = 1e-3
+
+        if self.previous_error is not None:
+            raw_derivative = (error - self.previous_error) / dt
+            alpha = dt / (self.derivative_time_constant + dt)
+            self.derivative += alpha * (raw_derivative - self.derivative)
+        self.previous_error = error
+
+        proportional = self.kp * error
+        derivative = self.kd * self.derivative
+        output = proportional + self.ki * self.integral + derivative
+
+        # Anti-windup: only integrate if it does not push a saturated output further
+        saturated = abs(output) >= self.output_limit and output * error > 0
+        if not saturated and self.ki != 0.0:
+            self.integral += error * dt
+            limit = self.integral_limit / abs(self.ki)
+            self.integral = max(-limit, min(limit, self.integral))
+            output = proportional + self.ki * self.integral + derivative
+
+        return max(-self.output_limit, min(self.output_limit, output))
+
+
+class HeadingController:
+    """
+    Computes speed and change for Car.drive_continuous: change turns towards the Goal, the speed is reduced
+    close to the Goal and while the heading error is large.
+    """
+
+    def __init__(self, kp=1.0, ki=0.02, kd=0.1, max_speed=0.3, min_speed=0.2, slow_down_distance=60.0,
+                 search_speed=0.2):
+        """
+        :param kp: proportional gain on the heading error in radians
+        :param ki: integral gain
+        :param kd: derivative gain
+        :param max_speed: speed far away from the Goal
+        :param min_speed: lowest speed before the Goal is reached
+        :param slow_down_distance: in CentiMeters, closer to the Goal the speed goes down to min_speed
+        :param search_speed: speed straight ahead while the heading is unknown
+        """
+        self.pid = PID(kp, ki, kd)
+        self.max_speed = max_speed
+        self.min_speed = min_speed
+        self.slow_down_distance = slow_down_distance
+        self.search_speed = search_speed
+
+    def reset(self):
+        self.pid.reset()
+
+    def update(self, x, y, heading, goal_x, goal_y, dt):
+        """
+        :param x: estimated x
+        :param y: estimated y
+        :param heading: heading in radians from the filter velocity, None if unknown
+        :param goal_x:
+        :param goal_y:
+        :param dt: seconds since the last update
+        :return: (speed, change, distance to the Goal)
+        """
+        goal_direction_x = goal_x - x
+        goal_direction_y = goal_y - y
+        distance = math.sqrt(goal_direction_x * goal_direction_x + goal_direction_y * goal_direction_y)
+        if heading is None:
+            # Drive straight until the filter knows the heading
+            return self.search_speed, 0.0, distance
+
+        # Positive error: the Goal is counterclockwise of the heading, turn left which is a negative change
+        error = wrap_angle(math.atan2(goal_direction_y, goal_direction_x) - heading)
+        change = -self.pid.update(error, dt)
+
+        speed = self.max_speed * min(1.0, distance / self.slow_down_distance)
+        speed *= max(0.0, math.cos(error))
+        speed = max(self.min_speed, speed)
+        return speed, change, distance
@@ -5,12 +5,15 @@ from time import sleep
 
 
 import struct
-import logging
-import pandas as pd
-import localization as lx
+import weakref
+import numpy as np
 
+from base_scripts import anchors
 from base_scripts import distance_data
-from base_scripts import min
+from base_scripts import logs
+from base_scripts import multilateration
+from base_scripts import ranging
+from base_scripts import tracing
 
 
 # Linux USB serial ports are of the form '/dev/ttyACM*'
@@ -21,40 +24,69 @@ MIN_PORT = '/dev/tty.usbmodem1421'
 MIN_PORT = '/dev/ttyACM0'
 #MIN_PORT = '/dev/tty.usbmodem0007601203521' #BLACK
 
+# Has to match MIN_BINARY_FRAMING in the Initiator firmware (ss_init_main.c)
+# True: raw MIN bytes, False: every byte as ASCII hex, one frame per line.
+# python3 -m benchmarks.bench_framing measures the CPU load of reading both
+MIN_BINARY_FRAMING = False
 
-def _get_coordinates_on_distance(responder_locations, distance, solver='LSE'):
+# Ranges kept per Anchor during one Fix of get_coordinates. Every Range an Anchor reports while the Fix waits for
+# the slower Anchors is averaged, get_coordinates gives up after 2 * number_of_nodes polls long before the window is full
+FIX_WINDOW = 100
+
+log = logs.get_logger('listen')
+
+# Session used by get_coordinates if the caller does not pass its own, it stays open between two calls
+_default_session = None
+
+# Multilaterator of every AnchorRegistry, keeps the precomputed Matrices and the last Position
+_multilaterators = weakref.WeakKeyDictionary()
+
+
+def _get_coordinates_on_distance(registry, slots, distances, solver='LSE'):
     """
 
-    :param responder_locations:
-    :param distance:
+    :param registry: AnchorRegistry
+    :param slots: array of the Anchor Slots
+    :param distances: array of the Distances in CentiMeters, same order as slots
     :param solver:
     :return:
     """
-    logging.info('Started: Calculate Position based on Coordinates using %s' % solver)
+    # Imported on first use, the NUMPY Solver and the Replay do not need the localization package
+    import localization as lx
+
+    log.info('Started: Calculate Position based on Coordinates using %s', solver)
     P = lx.Project(mode='3D', solver=solver)
 
-    for index, row in distance.iterrows():
-        for dict in responder_locations:
-            if index in dict.keys():
-                position = dict[index]
-                P.add_anchor(str(index), position)
+    for slot in slots:
+        P.add_anchor(registry.names[slot], registry.locations[slot])
 
     t, label = P.add_target()
 
-    for index, row in distance.iterrows():
-        for dict in responder_locations:
-            if index in dict.keys():
-                t.add_measure(str(index), row['Distance in CentiMeters'])
+    for slot, distance in zip(slots, distances):
+        t.add_measure(registry.names[slot], distance)
 
     P.solve()
     position = t.loc
-    logging.info('Finished: Calculate Position based on Coordinates')
-    logging.info('Position: %s' %position)
+    log.info('Finished: Calculate Position based on Coordinates')
+    log.info('Position: %s', position)
 
     return position
 
 
-def _wait_for_frames(min_handler: min.MINTransportSerial):
+def _get_multilaterator(registry):
+    """
+    Returns the Multilaterator of an AnchorRegistry, there is one per Registry
+    :param registry: AnchorRegistry
+    :return:
+    """
+    multilaterator = _multilaterators.get(registry)
+    if multilaterator is None:
+        multilaterator = multilateration.Multilaterator(registry)
+        _multilaterators[registry] = multilaterator
+    return multilaterator
+
+
+def _wait_for_frames(min_handler: ranging.MINSession):
     """
 
     :param min_handler:
@@ -69,24 +101,43 @@ def _wait_for_frames(min_handler: min.MINTransportSerial):
             return frames
 
 
-def get_coordinates(number_of_nodes, iter_counter=1, responder_locations=[]):
+def _get_default_session():
+    """
+    Returns the module wide Session on MIN_PORT, it is opened once and reused for every Position Fix
+    :return:
+    """
+    global _default_session
+    if _default_session is None:
+        _default_session = ranging.MINSession(port=MIN_PORT, binary=MIN_BINARY_FRAMING)
+    return _default_session
+
+
+def get_coordinates(number_of_nodes, iter_counter=1, responder_locations=[], session=None, solver='LSE'):
     """
 
     :param number_of_nodes:
-    :param responder_locations:
+    :param responder_locations: AnchorRegistry or list of dicts {short address: (x, y, z)}
+    :param session: open MINSession to read the Ranges from, the module wide Session on MIN_PORT if None
+    :param solver: 'LSE' for the localization package, 'NUMPY' for the Multilaterator
     :return:
     """
-    logging.info('Started: Request Data from Serial Port')
+    log.info('Started: Request Data from Serial Port')
+
+    if session is None:
+        session = _get_default_session()
 
-    min_handler = min.MINTransportSerial(port=MIN_PORT, loglevel='INFO')
+    registry = anchors.as_registry(responder_locations)
 
-    buffer_source_data = []
+    # distance_data_set of every Anchor Slot and the Slots in the order of their first Range
+    buffer_source_data = [None] * len(registry)
+    used_slots = []
+    number_of_complete_anchors = 0
     counter = 0
-    done = False
     iter_done = False
     number_of_values = 0
     while True:
-        for frame in _wait_for_frames(min_handler):
+        frames = _wait_for_frames(session)
+        for position, frame in enumerate(frames):
             value = struct.unpack('HHHdd', frame.payload)
 
             id = value[0]
@@ -95,25 +146,32 @@ def get_coordinates(number_of_nodes, iter_counter=1, responder_locations=[]):
             distance = value[3]
             distance_bias = value[4]
 
-            if not any(source_data.source_addr == source_addr for source_data in buffer_source_data):
-                # Initialize list of distance_data_set for dest_addr and source_addr‚
-                if len(buffer_source_data) < number_of_nodes:
-                    buffer_source_data.append(distance_data.distance_data_set(dest_addr, source_addr))
-                    # Add distance to distance_data_set in source_data
-                    for source_data in buffer_source_data:
-                        if source_data.source_addr == source_addr:
-                            source_data.set_distance(distance)
-                            source_data.set_distance_bias(distance_bias)
-                            number_of_values += 1
-            else:
-                # Add distance to distance_data_set in source_data
-                for source_data in buffer_source_data:
-                    if source_data.source_addr == source_addr:
-                        source_data.set_distance(distance)
-                        source_data.set_distance_bias(distance_bias)
-                        number_of_values += 1
-
-            if all(source_data.get_distance_size() >= iter_counter for source_data in buffer_source_data) and len(buffer_source_data) >= number_of_nodes:
+            slot = registry.slot(source_addr)
+            if slot is None:
+                # Unknown Anchor, it has no Position for the Localization
+                continue
+
+            source_data = buffer_source_data[slot]
+            if source_data is None:
+                if len(used_slots) >= number_of_nodes:
+                    continue
+                # Initialize distance_data_set for dest_addr and source_addr
+                source_data = distance_data.distance_data_set(dest_addr, source_addr,
+                                                              window=max(iter_counter, FIX_WINDOW))
+                buffer_source_data[slot] = source_data
+                used_slots.append(slot)
+
+            # Count the Anchor once when it has iter_counter Distances
+            was_complete = source_data.get_distance_size() >= iter_counter
+            source_data.set_distance(distance)
+            source_data.set_distance_bias(distance_bias)
+            number_of_values += 1
+            if not was_complete and source_data.get_distance_size() >= iter_counter:
+                number_of_complete_anchors += 1
+
+            if number_of_complete_anchors >= number_of_nodes:
+                # Keep the remaining Frames for the next Position Fix
+                session.unread(frames[position + 1:])
                 iter_done = True
                 break
 
@@ -122,29 +180,96 @@ def get_coordinates(number_of_nodes, iter_counter=1, responder_locations=[]):
             break
         else:
             # sleep(0.5)
-            logging.info('No sensor data, currently sleeping!!!')
+            log.info('No sensor data, currently sleeping!!!')
             counter += 1
             if counter > (number_of_nodes * 2):
-                logging.error('Finished: Request Data from Serial Port, got zero Values!')
+                log.error('Finished: Request Data from Serial Port, got zero Values!')
                 return None
 
-    logging.info('Finished: Request Data from Serial Port, got %d Values' % number_of_values)
+    log.info('Finished: Request Data from Serial Port, got %d Values', number_of_values)
 
-    data = []
-    for object in buffer_source_data:
-        value = (object.get_source_addr(), object.get_distance_norm(), object.get_distance_bias_norm())
-        data.append(value)
+    distances = np.empty(len(used_slots), dtype=np.float64)
+    for index, slot in enumerate(used_slots):
+        distances[index] = buffer_source_data[slot].get_distance_bias_norm()
 
-    data_frame = pd.DataFrame(data, columns=['Source', 'Distance', 'Distance with Range Bias']).set_index('Source')
-    data_frame['Distance in CentiMeters'] = (data_frame['Distance with Range Bias'] * 100).to_list()
+    return _get_coordinates_on_slots(registry, np.array(used_slots, dtype=np.intp), distances, number_of_nodes, solver)
 
-    # print(data_frame)
-
-    if number_of_nodes >= 3:
-        return _get_coordinates_on_distance(responder_locations, data_frame[['Distance in CentiMeters']])
-    else:
-        return (0, 0, 0)
 
+def get_coordinates_from_table(table: ranging.RangeTable, number_of_nodes, responder_locations=[], max_age=None, solver='LSE',
+                               range_filter=None, now=None, newer_than=None, up_to=None):
+    """
+    Calculates the Position on the latest Range of every Anchor, does not wait for the Serial Port
+    :param table: RangeTable filled by a RangingReader
+    :param number_of_nodes:
+    :param responder_locations: AnchorRegistry or list of dicts {short address: (x, y, z)}
+    :param max_age: ignore Ranges older than max_age seconds
+    :param solver: 'LSE' for the localization package, 'NUMPY' for the Multilaterator
+    :param range_filter: RangeFilter, if given Anchors with a large residual after a trial solve are dropped
+    :param now: reference time for max_age, time.monotonic() if None
+    :param newer_than: only use Ranges with a larger sequence number, e.g. the table sequence of the last Fix,
+        so no Range is used in two Fixes
+    :param up_to: only use Ranges up to this sequence number
+    :return: Position, None if less than number_of_nodes Anchors have a Range
+    """
+    registry = anchors.as_registry(responder_locations)
+
+    records = table.snapshot(max_age=max_age, now=now, newer_than=newer_than, up_to=up_to)
+    slots = np.empty(len(records), dtype=np.intp)
+    distances = np.empty(len(records), dtype=np.float64)
+    number_of_anchors = 0
+    for record in records:
+        slot = registry.slot(record.source_addr)
+        if slot is not None:
+            slots[number_of_anchors] = slot
+            distances[number_of_anchors] = record.distance_bias
+            number_of_anchors += 1
+
+    if number_of_anchors < number_of_nodes:
+        log.debug('Not enough Ranges in the Table: %d of %d Anchors', number_of_anchors, number_of_nodes)
+        return None
+
+    slots = slots[:number_of_anchors]
+    distances = distances[:number_of_anchors]
+    if range_filter is not None:
+        slots, distances_cm = range_filter.reject_residuals(_get_multilaterator(registry), slots, distances * 100)
+        distances = distances_cm / 100
+        if len(slots) < number_of_anchors:
+            log.info('Dropped %d Anchors with a large residual', number_of_anchors - len(slots))
+
+    return _get_coordinates_on_slots(registry, slots, distances, number_of_nodes, solver)
+
+
+def get_coordinates_batch(distances, mask=None, responder_locations=[]):
+    """
+    Calculates the Positions of many Epochs at once with the Multilaterator of the live Solver
+    :param distances: (epochs x anchors) array of the Distances with Range Bias in Meters, columns in Slot order
+    :param mask: (epochs x anchors) bool array, True where a Distance is valid, all valid if None
+    :param responder_locations: AnchorRegistry or list of dicts {short address: (x, y, z)}
+    :return: (epochs x 3) array of the Positions in CentiMeters, NaN for Epochs with less than 3 Distances
+    """
+    registry = anchors.as_registry(responder_locations)
+    return _get_multilaterator(registry).solve_batch(np.asarray(distances, dtype=np.float64) * 100, mask)
 
 
+def _get_coordinates_on_slots(registry, slots, distances, number_of_nodes, solver='LSE'):
+    """
 
+    :param registry: AnchorRegistry
+    :param slots: array of the Anchor Slots
+    :param distances: array of the Distances with Range Bias in Meters, same order as slots
+    :param number_of_nodes:
+    :param solver: 'LSE' for the localization package, 'NUMPY' for the Multilaterator
+    :return:
+    """
+    if number_of_nodes >= 3:
+        # Distance with Range Bias in CentiMeters
+        start = tracing.begin()
+        if solver == 'NUMPY':
+            position = _get_multilaterator(registry).solve(slots, distances * 100)
+            log.info('Position: %s', position)
+        else:
+            position = _get_coordinates_on_distance(registry, slots, distances * 100, solver)
+        tracing.end(tracing.SOLVE, start)
+        return position
+    else:
+        return (0, 0, 0)
@@ -0,0 +1,84 @@
+"""
+Logging of the raspi-car, every Subsystem has its own Logger and Verbosity.
+The Level checks are cached, a disabled log call on a hot path costs one attribute lookup
+and the message is only formatted if it is really written.
+"""
+
+import logging
+
+# Verbosity of every Subsystem
+VERBOSE = {'min': 'DEBUG', 'ranging': 'DEBUG', 'listen': 'DEBUG', 'driving': 'DEBUG', 'car': 'DEBUG'}
+DEFAULT = {'min': 'WARNING', 'ranging': 'INFO', 'listen': 'INFO', 'driving': 'INFO', 'car': 'INFO'}
+QUIET = {'min': 'WARNING', 'ranging': 'WARNING', 'listen': 'WARNING', 'driving': 'WARNING', 'car': 'WARNING'}
+
+_loggers = {}
+
+
+class SubsystemLogger:
+    """
+    Wraps a logging.Logger and caches which Levels are enabled.
+    Use 'if log.debug_enabled:' in front of calls with expensive arguments.
+    """
+
+    __slots__ = ('logger', 'debug_enabled', 'info_enabled')
+
+    def __init__(self, name):
+        self.logger = logging.getLogger(name)
+        self.refresh()
+
+    def refresh(self):
+        """
+        Updates the cached Level checks, needed after the Level of the Logger was changed
+        :return:
+        """
+        self.debug_enabled = self.logger.isEnabledFor(logging.DEBUG)
+        self.info_enabled = self.logger.isEnabledFor(logging.INFO)
+
+    def debug(self, msg, *args):
+        if self.debug_enabled:
+            self.logger.debug(msg, *args)
+
+    def info(self, msg, *args):
+        if self.info_enabled:
+            self.logger.info(msg, *args)
+
+    def warning(self, msg, *args):
+        self.logger.warning(msg, *args)
+
+    def error(self, msg, *args):
+        self.logger.error(msg, *args)
+
+
+def get_logger(name):
+    """
+    Returns the SubsystemLogger of a Subsystem, there is one per name
+    :param name: name of the Subsystem, e.g. 'min' or 'driving'
+    :return:
+    """
+    logger = _loggers.get(name)
+    if logger is None:
+        logger = SubsystemLogger(name)
+        _loggers[name] = logger
+    return logger
+
+
+def refresh():
+    """
+    Updates the cached Level checks of all Subsystems
+    :return:
+    """
+    for logger in _loggers.values():
+        logger.refresh()
+
+
+def configure(levels=DEFAULT, format='%(levelname)s:%(name)s:%(message)s'):
+    """
+    Sets the Verbosity of every Subsystem
+    :param levels: dict of Subsystem name and Level, e.g. QUIET or {'min': 'DEBUG'}
+    :param format: format of the root handler, if there is none yet
+    :return:
+    """
+    logging.basicConfig(level='INFO', format=format)
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level)
+    refresh()
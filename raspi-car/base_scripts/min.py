@@ -16,6 +16,9 @@ import logging
 from logging import getLogger, ERROR, DEBUG
 import sys
 
+from base_scripts import logs
+from base_scripts import tracing
+
 
 randomizer = SystemRandom()
 
@@ -28,6 +31,9 @@ formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(messag
 handler.setFormatter(formatter)
 min_logger.addHandler(handler)
 
+# Cached level checks, debug messages are only formatted if they are written
+min_log = logs.get_logger('min')
+
 def int32_to_bytes(value: int) -> bytes:
         return pack('>I', value)
 
@@ -36,6 +42,91 @@ def bytes_to_hexstr(b: bytes) -> str:
     return "".join("{:02x}".format(byte) for byte in b)
 
 
+def crc32_self_test(number_of_frames=1000, max_length=258):
+    """
+    Offline verification of the checksum: compares MINTransport._crc32 with the bit by bit reference
+    on random data, from empty frames up to the largest frame (3 header bytes + 255 bytes payload)
+    :param number_of_frames: number of random frames to check
+    :param max_length: maximum length of the checksummed data
+    :return: number of checked frames
+    """
+    for i in range(number_of_frames):
+        data = bytes(randomizer.randrange(256) for _ in range(i % (max_length + 1)))
+        if MINTransport._crc32(data) != MINTransport._crc32_reference(data):
+            raise AssertionError("CRC algorithm mismatch for {}".format(bytes_to_hexstr(data)))
+    return number_of_frames
+
+
+def encoder_self_test(number_of_frames=1000):
+    """
+    Offline verification of the encoder: compares MINTransport._on_wire_bytes with the byte by byte reference
+    on random frames, payloads are biased towards runs of 0xaa to exercise the stuffing
+    :param number_of_frames: number of random frames to check
+    :return: number of checked frames
+    """
+    transport = MINTransport.__new__(MINTransport)
+    transport._tx_buffer = bytearray(MINTransport.MAX_FRAME_LENGTH)
+    for i in range(number_of_frames):
+        payload = bytes(randomizer.choice((0xaa, 0xaa, 0x55, randomizer.randrange(256))) for _ in range(i % 256))
+        frame = MINFrame(min_id=randomizer.randrange(256), payload=payload, seq=randomizer.randrange(256),
+                         transport=bool(i % 2), ack_or_reset=True)
+        if transport._on_wire_bytes(frame) != transport._on_wire_bytes_reference(frame):
+            raise AssertionError("Encoder mismatch for {}".format(bytes_to_hexstr(payload)))
+    return number_of_frames
+
+
+def rx_self_test(number_of_streams=1000, frames_per_stream=20):
+    """
+    Offline verification of the decoder: feeds the same random byte streams to MINTransport._rx_bytes and to the
+    byte by byte _rx_bytes_reference and compares the received frames. The streams mix transport and plain frames
+    with payloads biased towards 0xaa, corrupted bytes (CRC mismatch), lost bytes, broken stuffing and garbage
+    between the frames, they are fed in random chunks so headers and stuff bytes are split across reads.
+    :param number_of_streams: number of random streams to check
+    :param frames_per_stream: number of frames per stream
+    :return: number of checked streams
+    """
+    encoder = MINTransport.__new__(MINTransport)
+    encoder._tx_buffer = bytearray(MINTransport.MAX_FRAME_LENGTH)
+    disabled = min_logger.disabled
+    # Every corrupted frame is logged as a warning
+    min_logger.disabled = True
+    try:
+        for i in range(number_of_streams):
+            stream = bytearray()
+            for j in range(frames_per_stream):
+                payload = bytes(randomizer.choice((0xaa, 0xaa, 0x55, randomizer.randrange(256)))
+                                for _ in range(randomizer.randrange(32)))
+                frame = MINFrame(min_id=randomizer.randrange(64), payload=payload, seq=randomizer.randrange(256),
+                                 transport=randomizer.random() < 0.5)
+                on_wire_bytes = bytearray(encoder._on_wire_bytes_reference(frame))
+                error = randomizer.random()
+                if error < 0.1:
+                    on_wire_bytes[randomizer.randrange(3, len(on_wire_bytes))] ^= 1 << randomizer.randrange(8)
+                elif error < 0.15:
+                    del on_wire_bytes[randomizer.randrange(3, len(on_wire_bytes))]
+                elif error < 0.2:
+                    on_wire_bytes = on_wire_bytes[:randomizer.randrange(len(on_wire_bytes))]
+                elif error < 0.25:
+                    stream += bytes(randomizer.choice((0xaa, 0x55, randomizer.randrange(256)))
+                                    for _ in range(randomizer.randrange(8)))
+                stream += on_wire_bytes
+
+            received = []
+            for transport in (_RecordingTransport(), _RecordingTransport()):
+                decode = transport._rx_bytes if not received else transport._rx_bytes_reference
+                start = 0
+                while start < len(stream):
+                    end = start + randomizer.choice((1, 2, 3, randomizer.randrange(1, 64)))
+                    decode(bytes(stream[start:end]))
+                    start = end
+                received.append(transport.received)
+            if received[0] != received[1]:
+                raise AssertionError("Decoder mismatch for {}".format(bytes_to_hexstr(stream)))
+    finally:
+        min_logger.disabled = disabled
+    return number_of_streams
+
+
 class MINConnectionError(Exception):
     pass
 
@@ -74,12 +165,23 @@ class MINTransport:
     def _serial_close(self):
         raise NotImplementedError
 
+    def _serial_cancel_read(self):
+        # Nothing to cancel if _serial_read_all does not block
+        pass
+
     ACK = 0xff
     RESET = 0xfe
 
     HEADER_BYTE = 0xaa
     STUFF_BYTE = 0x55
     EOF_BYTE = 0x55
+    _HEADER_PAIR = bytes([HEADER_BYTE, HEADER_BYTE])
+    _STUFFED_PAIR = bytes([HEADER_BYTE, HEADER_BYTE, STUFF_BYTE])
+    _FRAME_HEADER = bytes([HEADER_BYTE, HEADER_BYTE, HEADER_BYTE])
+    _FRAME_EOF = bytes([EOF_BYTE])
+
+    # Largest frame before stuffing: id/control, seq, length, 255 bytes payload and checksum
+    MAX_FRAME_LENGTH = 3 + 255 + 4
 
     SEARCHING_FOR_SOF = 0
     RECEIVING_ID_CONTROL = 1
@@ -100,7 +202,7 @@ class MINTransport:
         :param idle_timeout_ms: Time before connection assumed to have been lost and retransmissions stopped
         :param ack_retransmit_timeout_ms: Time before ACK frames are resent
         :param frame_retransmit_timeout_ms: Time before frames are resent
-        :param loglevel: set the logging desired
+        :param loglevel: set the logging desired, None to keep the level set by logs.configure()
         """
         self.transport_fifo_size = transport_fifo_size
         self.ack_retransmit_timeout_ms = ack_retransmit_timeout_ms
@@ -109,7 +211,9 @@ class MINTransport:
         self.frame_retransmit_timeout_ms = frame_retransmit_timeout_ms
         self.rx_window_size = rx_window_size
 
-        min_logger.setLevel(level=loglevel)
+        if loglevel is not None:
+            min_logger.setLevel(level=loglevel)
+            min_log.refresh()
 
         # Stats about the link
         self._longest_transport_fifo = 0
@@ -142,6 +246,15 @@ class MINTransport:
         self._rx_list = []
         self._stashed_rx_dict = {}
 
+        # State for the buffer based decoder
+        self._rx_raw = bytearray()  # Received bytes not decoded yet, only trailing header bytes are kept
+        self._rx_in_frame = False
+
+        # State for the encoder, frames are assembled in the same buffer, ACKs are encoded once per sequence number
+        self._tx_buffer = bytearray(self.MAX_FRAME_LENGTH)
+        self._ack_frames = [None] * 256
+        self._reset_frame = None
+
         # Sequence numbers
         self._rn = 0  # Sequence number expected to be received next
         self._sn_min = 0  # Sequence number of first frame currently in the sending window
@@ -167,24 +280,32 @@ class MINTransport:
 
     def _send_ack(self):
         # For a regular ACK we request no additional retransmits
-        ack_frame = MINFrame(min_id=self.ACK, seq=self._rn, payload=bytes([self._rn]), transport=True, ack_or_reset=True)
-        on_wire_bytes = self._on_wire_bytes(frame=ack_frame)
+        rn = self._rn
+        on_wire_bytes = self._ack_frames[rn]
+        if on_wire_bytes is None:
+            ack_frame = MINFrame(min_id=self.ACK, seq=rn, payload=bytes([rn]), transport=True, ack_or_reset=True)
+            on_wire_bytes = self._on_wire_bytes(frame=ack_frame)
+            self._ack_frames[rn] = on_wire_bytes
         self._last_sent_ack_time_ms = self._now_ms()
-        min_logger.debug("Sending ACK, seq={}".format(ack_frame.seq))
+        if min_log.debug_enabled:
+            min_logger.debug("Sending ACK, seq={}".format(rn))
         self._serial_write(on_wire_bytes)
 
     def _send_nack(self, to: int):
         # For a NACK we send an ACK but also request some frame retransmits
         nack_frame = MINFrame(min_id=self.ACK, seq=self._rn, payload=bytes([to]), transport=True, ack_or_reset=True)
         on_wire_bytes = self._on_wire_bytes(frame=nack_frame)
-        min_logger.debug("Sending NACK, seq={}, to={}".format(nack_frame.seq, to))
+        if min_log.debug_enabled:
+            min_logger.debug("Sending NACK, seq={}, to={}".format(nack_frame.seq, to))
         self._serial_write(on_wire_bytes)
 
     def _send_reset(self):
-        min_logger.debug("Sending RESET")
-        reset_frame = MINFrame(min_id=self.RESET, seq=0, payload=bytes(), transport=True, ack_or_reset=True)
-        on_wire_bytes = self._on_wire_bytes(frame=reset_frame)
-        self._serial_write(on_wire_bytes)
+        if min_log.debug_enabled:
+            min_logger.debug("Sending RESET")
+        if self._reset_frame is None:
+            reset_frame = MINFrame(min_id=self.RESET, seq=0, payload=bytes(), transport=True, ack_or_reset=True)
+            self._reset_frame = self._on_wire_bytes(frame=reset_frame)
+        self._serial_write(self._reset_frame)
 
     def _transport_fifo_reset(self):
         self._transport_fifo = []
@@ -223,8 +344,10 @@ class MINTransport:
             raise ValueError("MIN ID out of range")
         frame = MINFrame(min_id=min_id, payload=payload, transport=False, seq=0)
         on_wire_bytes = self._on_wire_bytes(frame=frame)
-        min_logger.info("Sending MIN frame, min_id={}, payload={}".format(min_id, bytes_to_hexstr(payload)))
-        min_logger.debug("Sending MIN frame, on wire bytes={}".format(bytes_to_hexstr(on_wire_bytes)))
+        if min_log.info_enabled:
+            min_logger.info("Sending MIN frame, min_id={}, payload={}".format(min_id, bytes_to_hexstr(payload)))
+        if min_log.debug_enabled:
+            min_logger.debug("Sending MIN frame, on wire bytes={}".format(bytes_to_hexstr(on_wire_bytes)))
         self._serial_write(on_wire_bytes)
 
     def queue_frame(self, min_id: int, payload: bytes):
@@ -243,7 +366,8 @@ class MINTransport:
 
         if len(self._transport_fifo) < self.transport_fifo_size:
 
-            min_logger.debug("Queueing min_id={}".format(min_id))
+            if min_log.debug_enabled:
+                min_logger.debug("Queueing min_id={}".format(min_id))
 
             frame = MINFrame(min_id=min_id, payload=payload, seq=self._sn_max, transport=True)
             self._transport_fifo.append(frame)
@@ -263,19 +387,22 @@ class MINTransport:
         The embedded version of this code does not implement NACKs: generally the MCU will not have enough memory to stash out-of-order
         frames for later reassembly.
         """
-        min_logger.debug("MIN frame received @{}: min_id_control=0x{:02x}, min_seq={}".format(time(), min_id_control, min_seq))
+        if min_log.debug_enabled:
+            min_logger.debug("MIN frame received @{}: min_id_control=0x{:02x}, min_seq={}".format(time(), min_id_control, min_seq))
 
         self._last_received_anything_ms = self._now_ms()
         if min_id_control & 0x80:
             if min_id_control == self.ACK:
-                min_logger.debug("Received ACK")
+                if min_log.debug_enabled:
+                    min_logger.debug("Received ACK")
                 # The ACK number indicates the serial number of the next packet wanted, so any previous packets can be marked off
                 number_acked = (min_seq - self._sn_min) & 0xff
                 number_in_window = (self._sn_max - self._sn_min) & 0xff
                 # Need to guard against old ACKs from an old session still turning up.
                 # Number acked will be 1 if there are no frames in the window
                 if number_acked <= number_in_window:
-                    min_logger.debug("Number ACKed = {}".format(number_acked))
+                    if min_log.debug_enabled:
+                        min_logger.debug("Number ACKed = {}".format(number_acked))
                     self._sn_min = min_seq
 
                     assert len(self._transport_fifo) >= number_in_window
@@ -292,7 +419,8 @@ class MINTransport:
                         min_logger.warning("Spurious ACK: self._sn_min={}, self._sn_max={}, min_seq={}, payload[0]={}".format(self._sn_min, self._sn_max, min_seq, min_payload[0]))
                     self._spurious_acks += 1
             elif min_id_control == self.RESET:
-                min_logger.debug("RESET received".format(min_seq))
+                if min_log.debug_enabled:
+                    min_logger.debug("RESET received".format(min_seq))
                 self._resets_received += 1
                 self._transport_fifo_reset()
                 self._rx_reset()
@@ -302,14 +430,16 @@ class MINTransport:
 
                 self._last_received_frame_ms = self._now_ms()
                 if min_seq == self._rn:
-                    min_logger.debug("MIN application frame received @{} (min_id={} seq={})".format(time(), min_id_control & 0x3f, min_seq))
+                    if min_log.debug_enabled:
+                        min_logger.debug("MIN application frame received @{} (min_id={} seq={})".format(time(), min_id_control & 0x3f, min_seq))
                     self._rx_list.append(min_frame)
 
                     # We want this frame. Now see if there are stashed frames it joins up with and 'receive' those
                     self._rn = (self._rn + 1) & 0xff
                     while self._rn in self._stashed_rx_dict:
                         stashed_frame = self._stashed_rx_dict[self._rn]  # type: MINFrame
-                        min_logger.debug("MIN application stashed frame recovered @{} (self._rn={} min_id={} seq={})".format(time(), self._rn, stashed_frame.min_id, stashed_frame.seq))
+                        if min_log.debug_enabled:
+                            min_logger.debug("MIN application stashed frame recovered @{} (self._rn={} min_id={} seq={})".format(time(), self._rn, stashed_frame.min_id, stashed_frame.seq))
                         del self._stashed_rx_dict[self._rn]
                         self._rx_list.append(stashed_frame)
                         self._rn = (self._rn + 1) & 0xff
@@ -332,7 +462,8 @@ class MINTransport:
                             self._send_ack()
                     else:
                         self._send_ack()
-                    min_logger.debug("Sending ACK for min ID={} with self._rn={}".format(min_id_control & 0x3f, self._rn))
+                    if min_log.debug_enabled:
+                        min_logger.debug("Sending ACK for min ID={} with self._rn={}".format(min_id_control & 0x3f, self._rn))
                 else:
                     # If the frames come within the window size in the future sequence range then we accept them and assume some were missing
                     # (They may also be duplicates, in which case we store them over the top of the old ones)
@@ -340,15 +471,18 @@ class MINTransport:
                         # We want to only NACK a range of frames once, not each time otherwise we will overload with retransmissions
                         if self._nack_outstanding is None:
                             # If we are missing specific frames then send a NACK to specifically request them
-                            min_logger.debug("Sending NACK for min ID={} with seq={} to={}".format(min_id_control & 0x3f, self._rn, min_seq))
+                            if min_log.debug_enabled:
+                                min_logger.debug("Sending NACK for min ID={} with seq={} to={}".format(min_id_control & 0x3f, self._rn, min_seq))
                             self._send_nack(min_seq)
                             self._nack_outstanding = min_seq
                         else:
-                            min_logger.debug("(Outstanding NACK)")
+                            if min_log.debug_enabled:
+                                min_logger.debug("(Outstanding NACK)")
 
                         # Hang on to this frame because we will join it up later with the missing ones that are re-sent
                         self._stashed_rx_dict[min_seq] = min_frame
-                        min_logger.debug("MIN application frame stashed @{} (min_id={}, seq={})".format(time(), min_id_control & 0x3f, min_seq))
+                        if min_log.debug_enabled:
+                            min_logger.debug("MIN application frame stashed @{} (min_id={}, seq={})".format(time(), min_id_control & 0x3f, min_seq))
                     else:
                         min_logger.warning("Frame stale? Discarding @{} (min_id={}, seq={})".format(time(), min_id_control & 0x3f, min_seq))
                         if min_seq in self._stashed_rx_dict and min_payload != self._stashed_rx_dict[min_seq].payload:
@@ -361,17 +495,111 @@ class MINTransport:
 
     def _rx_bytes(self, data: bytes):
         """
-        Called by handler to pass over a sequence of bytes
+        Called by handler to pass over a sequence of bytes.
+        Decodes the whole buffer at once: 0xaa 0xaa pairs are found with bytearray.find and the byte after a pair
+        decides between header, stuff byte and broken frame. Everything in between is frame data and is copied in slices.
+        Gives the same calls of _min_frame_received as the byte by byte _rx_bytes_reference.
         :param data:
         """
-        min_logger.debug("Received bytes: {}".format(bytes_to_hexstr(data)))
+        if min_log.debug_enabled:
+            min_logger.debug("Received bytes: {}".format(bytes_to_hexstr(data)))
+
+        raw = self._rx_raw
+        raw.extend(data)
+        end = len(raw)
+        start = 0
+
+        with memoryview(raw) as view:
+            while True:
+                pair = raw.find(self._HEADER_PAIR, start)
+                if pair < 0 or pair + 2 >= end:
+                    break
+
+                # The pair itself is data too, only the byte after it is special
+                self._rx_frame_data(view[start:pair + 2])
+                marker = raw[pair + 2]
+                start = pair + 3
+
+                if marker == self.HEADER_BYTE:
+                    self._rx_frame_end()
+                    self._rx_in_frame = True
+                elif marker != self.STUFF_BYTE:
+                    # By here something must have gone wrong, give up on this frame and look for new header
+                    self._rx_frame_end()
+
+            # Header bytes at the end might be the start of a pair, keep them for the next call
+            if pair >= 0:
+                keep = pair
+            elif end > start and raw[end - 1] == self.HEADER_BYTE:
+                keep = end - 1
+            else:
+                keep = end
+            self._rx_frame_data(view[start:keep])
+
+        del raw[:keep]
+
+    def _rx_frame_end(self):
+        """
+        Stops receiving the current frame, the last seen sequence number is kept like in _rx_bytes_reference
+        """
+        frame = self._rx_frame_buf
+        if self._rx_in_frame and len(frame) >= 2 and frame[0] & 0x80:
+            self._rx_frame_seq = frame[1]
+        self._rx_in_frame = False
+        self._rx_frame_buf = bytearray()
+
+    def _rx_frame_data(self, data):
+        """
+        Appends de-stuffed bytes to the current frame and passes the frame up as soon as it is complete
+        :param data: bytes-like object, no header or stuff bytes
+        """
+        if not self._rx_in_frame or not data:
+            return
+
+        frame = self._rx_frame_buf
+        frame += data
+        if len(frame) < 2:
+            return
+
+        header_length = 3 if frame[0] & 0x80 else 2
+        if len(frame) < header_length:
+            return
+        checksum_start = header_length + frame[header_length - 1]
+        if len(frame) < checksum_start + 5:
+            return
+
+        id_control = frame[0]
+        checksum = int.from_bytes(frame[checksum_start:checksum_start + 4], 'big')
+        with memoryview(frame) as view:
+            # Through _crc32, so CRC_SELF_TEST cross-checks the live receive path as well
+            computed_checksum = self._crc32(view[:checksum_start])
+        eof = frame[checksum_start + 4]
+        payload = bytes(frame[header_length:checksum_start])
+        self._rx_frame_end()
+
+        if checksum != computed_checksum:
+            min_logger.warning("CRC mismatch (0x{:08x} vs 0x{:08x}), frame dropped".format(checksum, computed_checksum))
+        elif eof != self.EOF_BYTE:
+            min_logger.warning("No EOF received, dropping frame")
+        else:
+            self._min_frame_received(min_id_control=id_control, min_payload=payload, min_seq=self._rx_frame_seq)
+
+    def _rx_bytes_reference(self, data: bytes):
+        """
+        Byte by byte state machine, the original receive path. Kept as a reference for _rx_bytes
+        and as a guide to implementing this on microcontrollers.
+        :param data:
+        """
+        if min_log.debug_enabled:
+            min_logger.debug("Received bytes: {}".format(bytes_to_hexstr(data)))
 
         for byte in data:
 
             if self._rx_header_bytes_seen == 2:
                 self._rx_header_bytes_seen = 0
                 if byte == self.HEADER_BYTE:
-                    min_logger.debug("Byte Data - Header Byte: 0x" + format(byte, 'x'))
+                    if min_log.debug_enabled:
+                        min_logger.debug("Byte Data - Header Byte: 0x" + format(byte, 'x'))
                     self._rx_frame_state = self.RECEIVING_ID_CONTROL
                     continue
                 if byte == self.STUFF_BYTE:
@@ -382,7 +610,8 @@ class MINTransport:
                 continue
 
             if byte == self.HEADER_BYTE:
-                min_logger.debug("Byte Data - Header Byte: 0x" + format(byte, 'x'))
+                if min_log.debug_enabled:
+                    min_logger.debug("Byte Data - Header Byte: 0x" + format(byte, 'x'))
                 self._rx_header_bytes_seen += 1
             else:
                 self._rx_header_bytes_seen = 0
@@ -391,7 +620,8 @@ class MINTransport:
                 pass
             elif self._rx_frame_state == self.RECEIVING_ID_CONTROL:
                 self._rx_frame_id_control = byte
-                min_logger.debug("Byte Data - _rx_frame_id_control: 0x" + format(byte, 'x'))
+                if min_log.debug_enabled:
+                    min_logger.debug("Byte Data - _rx_frame_id_control: 0x" + format(byte, 'x'))
                 self._rx_payload_bytes = 0
                 if self._rx_frame_id_control & 0x80:
                     self._rx_frame_state = self.RECEIVING_SEQ
@@ -399,11 +629,13 @@ class MINTransport:
                     self._rx_frame_state = self.RECEIVING_LENGTH
             elif self._rx_frame_state == self.RECEIVING_SEQ:
                 self._rx_frame_seq = byte
-                min_logger.debug("Byte Data - _rx_frame_seq: 0x" + format(byte, 'x'))
+                if min_log.debug_enabled:
+                    min_logger.debug("Byte Data - _rx_frame_seq: 0x" + format(byte, 'x'))
                 self._rx_frame_state = self.RECEIVING_LENGTH
             elif self._rx_frame_state == self.RECEIVING_LENGTH:
                 self._rx_frame_length = byte
-                min_logger.debug("Byte Data - _rx_frame_length: 0x" + format(byte, 'x'))
+                if min_log.debug_enabled:
+                    min_logger.debug("Byte Data - _rx_frame_length: 0x" + format(byte, 'x'))
                 self._rx_control = byte
                 self._rx_frame_buf = bytearray()
                 #print(format(byte, 'x'))
@@ -413,25 +645,30 @@ class MINTransport:
                     self._rx_frame_state = self.RECEIVING_CHECKSUM_3
             elif self._rx_frame_state == self.RECEIVING_PAYLOAD:
                 self._rx_frame_buf.append(byte)
-                min_logger.debug("Byte Data - _rx_frame_buf (append): 0x" + format(byte, 'x'))
+                if min_log.debug_enabled:
+                    min_logger.debug("Byte Data - _rx_frame_buf (append): 0x" + format(byte, 'x'))
                 self._rx_frame_length -= 1
                 if self._rx_frame_length == 0:
                     self._rx_frame_state = self.RECEIVING_CHECKSUM_3
             elif self._rx_frame_state == self.RECEIVING_CHECKSUM_3:
                 self._rx_frame_checksum = byte << 24
-                min_logger.debug("Byte Data - _rx_frame_checksum (01): 0x" + format(byte, 'x'))
+                if min_log.debug_enabled:
+                    min_logger.debug("Byte Data - _rx_frame_checksum (01): 0x" + format(byte, 'x'))
                 self._rx_frame_state = self.RECEIVING_CHECKSUM_2
             elif self._rx_frame_state == self.RECEIVING_CHECKSUM_2:
                 self._rx_frame_checksum |= byte << 16
-                min_logger.debug("Byte Data - _rx_frame_checksum (02): 0x" + format(byte, 'x'))
+                if min_log.debug_enabled:
+                    min_logger.debug("Byte Data - _rx_frame_checksum (02): 0x" + format(byte, 'x'))
                 self._rx_frame_state = self.RECEIVING_CHECKSUM_1
             elif self._rx_frame_state == self.RECEIVING_CHECKSUM_1:
                 self._rx_frame_checksum |= byte << 8
-                min_logger.debug("Byte Data - _rx_frame_checksum (03): 0x" + format(byte, 'x'))
+                if min_log.debug_enabled:
+                    min_logger.debug("Byte Data - _rx_frame_checksum (03): 0x" + format(byte, 'x'))
                 self._rx_frame_state = self.RECEIVING_CHECKSUM_0
             elif self._rx_frame_state == self.RECEIVING_CHECKSUM_0:
                 self._rx_frame_checksum |= byte
-                min_logger.debug("Byte Data - _rx_frame_checksum (04): 0x" + format(byte, 'x'))
+                if min_log.debug_enabled:
+                    min_logger.debug("Byte Data - _rx_frame_checksum (04): 0x" + format(byte, 'x'))
                 if self._rx_frame_id_control & 0x80:
                     computed_checksum = self._crc32(bytearray([self._rx_frame_id_control, self._rx_frame_seq, self._rx_control]) + self._rx_frame_buf)
                 else:
@@ -446,7 +683,8 @@ class MINTransport:
                     self._rx_frame_state = self.RECEIVING_EOF
             elif self._rx_frame_state == self.RECEIVING_EOF:
                 if byte == self.EOF_BYTE:
-                    min_logger.debug("Byte Data - EOF: 0x" + format(byte, 'x'))
+                    if min_log.debug_enabled:
+                        min_logger.debug("Byte Data - EOF: 0x" + format(byte, 'x'))
                     # Frame received OK, pass up frame for handling")
                     self._min_frame_received(min_id_control=self._rx_frame_id_control, min_payload=bytes(self._rx_frame_buf), min_seq=self._rx_frame_seq)
                 else:
@@ -461,7 +699,35 @@ class MINTransport:
 
     def _on_wire_bytes(self, frame: MINFrame) -> bytes:
         """
-        Get the on-wire byte sequence for the frame, including stuff bytes after every 0xaa 0xaa pair
+        Get the on-wire byte sequence for the frame, including stuff bytes after every 0xaa 0xaa pair.
+        The frame is assembled in the reusable _tx_buffer and stuffed with one bytes.replace, which inserts the
+        stuff byte after every non-overlapping pair like the byte by byte _on_wire_bytes_reference.
+        """
+        buffer = self._tx_buffer
+        payload = frame.payload
+        if frame.is_transport:
+            buffer[0] = frame.min_id | 0x80
+            buffer[1] = frame.seq
+            buffer[2] = len(payload)
+            start = 3
+        else:
+            buffer[0] = frame.min_id
+            buffer[1] = len(payload)
+            start = 2
+        end = start + len(payload)
+        buffer[start:end] = payload
+
+        with memoryview(buffer) as view:
+            crc = crc32(view[:end], 0)
+            buffer[end:end + 4] = crc.to_bytes(4, 'big')
+            raw = view[:end + 4].tobytes()
+
+        # Without a 0xaa 0xaa pair replace returns raw itself
+        return b''.join((self._FRAME_HEADER, raw.replace(self._HEADER_PAIR, self._STUFFED_PAIR), self._FRAME_EOF))
+
+    def _on_wire_bytes_reference(self, frame: MINFrame) -> bytes:
+        """
+        Byte by byte encoder, the original transmit path. Kept as a reference for _on_wire_bytes.
         """
         if frame.is_transport:
             prolog = bytes([frame.min_id | 0x80, frame.seq, len(frame.payload)]) + frame.payload
@@ -489,11 +755,27 @@ class MINTransport:
 
         return bytes(stuffed)
 
+    # Cross-check every checksum with the bit by bit reference, only for verification, it is slow
+    CRC_SELF_TEST = False
+
+    @classmethod
+    def _crc32(cls, checksummed_data: bytearray, start=0xffffffff):
+        """
+        Computes the checksum with the C implementation of binascii. If CRC_SELF_TEST is set
+        it's cross-checked with the 'manual' implementation in _crc32_reference.
+        """
+        checksum = crc32(checksummed_data, ~start & 0xffffffff)
+
+        if cls.CRC_SELF_TEST and checksum != cls._crc32_reference(checksummed_data, start):
+            raise AssertionError("CRC algorithm mismatch")
+
+        return checksum
+
     @staticmethod
-    def _crc32(checksummed_data: bytearray, start=0xffffffff):
+    def _crc32_reference(checksummed_data: bytearray, start=0xffffffff):
         """
         The 'manual' implementation is left here as a guide to implementing this on
-        microcontrollers. It's cross-checked with the standard Python library version.
+        microcontrollers.
         """
         crc = start
         for byte in checksummed_data:
@@ -501,12 +783,7 @@ class MINTransport:
             for j in range(8):
                 mask = -(crc & 1)
                 crc = (crc >> 1) ^ (0xedb88320 & mask)
-        checksum = ~crc % (1 << 32)
-
-        if checksum != crc32(checksummed_data, 0):
-            raise AssertionError("CRC algorithm mismatch")
-
-        return checksum
+        return ~crc % (1 << 32)
 
     def transport_stats(self):
         """
@@ -547,10 +824,14 @@ class MINTransport:
         remote_active =   (self._now_ms() - self._last_received_frame_ms) < self.idle_timeout_ms
         self._rx_list = []
 
+        start = tracing.begin()
         data = self._serial_read_all()
+        tracing.end(tracing.SERIAL_READ, start)
 
         if data:
+            start = tracing.begin()
             self._rx_bytes(data=data)
+            tracing.end(tracing.DECODE, start)
 
 
 
@@ -562,7 +843,8 @@ class MINTransport:
             frame.seq = self._sn_max
             self._last_sent_frame_ms = self._now_ms()
             frame.last_sent_time = self._now_ms()
-            min_logger.debug("Sending new frame id={} seq={} len={} payload={}".format(frame.min_id, frame.seq, len(frame.payload), bytes_to_hexstr(frame.payload)))
+            if min_log.debug_enabled:
+                min_logger.debug("Sending new frame id={} seq={} len={} payload={}".format(frame.min_id, frame.seq, len(frame.payload), bytes_to_hexstr(frame.payload)))
             self._transport_fifo_send(frame=frame)
             self._sn_max = (self._sn_max + 1) & 0xff
         else:
@@ -570,13 +852,15 @@ class MINTransport:
             if window_size > 0 and remote_connected:
                 oldest_frame = self._find_oldest_frame()
                 if self._now_ms() - oldest_frame.last_sent_time > self.frame_retransmit_timeout_ms:
-                    min_logger.debug("Resending old frame id={} seq={}".format(oldest_frame.min_id, oldest_frame.seq))
+                    if min_log.debug_enabled:
+                        min_logger.debug("Resending old frame id={} seq={}".format(oldest_frame.min_id, oldest_frame.seq))
                     self._transport_fifo_send(frame=oldest_frame)
 
         # Periodically transmit ACK
         if self._now_ms() - self._last_sent_ack_time_ms > self.ack_retransmit_timeout_ms:
             if remote_active:
-                min_logger.debug("Periodic send of ACK")
+                if min_log.debug_enabled:
+                    min_logger.debug("Periodic send of ACK")
                 self._send_ack()
 
         if (self._sn_max - self._sn_max) & 0xff > window_size:
@@ -584,10 +868,35 @@ class MINTransport:
 
         return self._rx_list
 
+    def cancel_read(self):
+        """
+        Makes a read blocked in poll() return at once, e.g. to stop the Thread polling this Transport
+        """
+        self._serial_cancel_read()
+
     def close(self):
         self._serial_close()
 
 
+class _RecordingTransport(MINTransport):
+    """
+    MIN Transport without a Serial Port for rx_self_test, records the received frames instead of handling them
+    """
+
+    def __init__(self):
+        self.received = []
+        super().__init__(loglevel=None)
+
+    def _now_ms(self):
+        return 0
+
+    def _serial_write(self, data):
+        pass
+
+    def _min_frame_received(self, min_id_control: int, min_payload: bytes, min_seq: int):
+        self.received.append((min_id_control, min_payload, min_seq))
+
+
 class MINTransportSerial(MINTransport):
     """
     Bound to Pyserial driver. But not thread safe: must not call poll() and send() at the same time.
@@ -618,7 +927,8 @@ class MINTransportSerial(MINTransport):
         if self.fake_errors:
             data = self._corrupted_data(data)
 
-        min_logger.debug("_serial_write: {}".format(bytes_to_hexstr(data)))
+        if min_log.debug_enabled:
+            min_logger.debug("_serial_write: {}".format(bytes_to_hexstr(data)))
         self._serial.write(data)
 
     def _serial_any(self):
@@ -627,6 +937,10 @@ class MINTransportSerial(MINTransport):
     def _serial_read_all(self):
         #data = self._serial.read_all()
 
+        if self.binary:
+            # Raw MIN bytes, block for the first byte and take everything else which is already waiting
+            return self._serial.read(max(1, self._serial.in_waiting))
+
         data = self._serial.readline()
 
         try:
@@ -641,7 +955,8 @@ class MINTransportSerial(MINTransport):
                     buffer.append(int(bytes(x, 'ascii'), 16))
                 data = buffer
         except:
-            min_logger.info("No translatable Data: {}".format(data))
+            if min_log.info_enabled:
+                min_logger.info("No translatable Data: {}".format(data))
             return None
         #if self.fake_errors:
         #    data = self._corrupted_data(data)
@@ -651,13 +966,19 @@ class MINTransportSerial(MINTransport):
     def _serial_close(self):
         self._serial.close()
 
-    def __init__(self, port, loglevel='DEBUG'):
+    def _serial_cancel_read(self):
+        # The port has no timeout, pyserial aborts the blocked read through its abort pipe (POSIX) or event (Windows)
+        self._serial.cancel_read()
+
+    def __init__(self, port, loglevel='DEBUG', binary=False):
         """
         Open MIN connection on a given port.
         :param port: serial port
         :param debug:
+        :param binary: True if the target sends raw MIN bytes, False for the ASCII hex line protocol
         """
         self.fake_errors = False
+        self.binary = binary
         try:
             self._serial = Serial(port=port, timeout=None, writeTimeout=None, baudrate=115200)
             self._serial.reset_input_buffer()
@@ -673,8 +994,8 @@ class ThreadsafeTransportMINSerialHandler(MINTransportSerial):
     A typical usage is to create a simple thread that calls poll() in a loop which takes MIN frames received and puts them into a Python queue.
     The application can send directly and pick up incoming frames from the queue.
     """
-    def __init__(self, port, loglevel=ERROR):
-        super().__init__(port=port, loglevel=loglevel)
+    def __init__(self, port, loglevel=ERROR, binary=False):
+        super().__init__(port=port, loglevel=loglevel, binary=binary)
         self._thread_lock = Lock()
 
     def close(self):
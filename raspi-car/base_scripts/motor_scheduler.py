@@ -0,0 +1,157 @@
+"""
+Motor Command Scheduler, applies the Wheel Speeds in a Background Thread at a fixed tick.
+The Controller posts a target and returns at once, ramping up, holding and stopping is done by the Scheduler
+instead of time.sleep() in the Controller.
+"""
+
+import time
+from collections import namedtuple
+from threading import Event, Thread
+
+from base_scripts import logs
+
+
+log = logs.get_logger('car')
+
+# Change of the Wheel Speed per second while ramping, the old ramp of Car.drive was 0.1 every 10 ms
+DEFAULT_RAMP = 10.0
+
+# Target Wheel Speeds, ramp in speed per second (None to jump), hold_time in seconds after which
+# the Wheels ramp down to 0 (None to keep the target)
+MotorCommand = namedtuple('MotorCommand', ['left', 'right', 'ramp', 'hold_time'])
+
+STOP = MotorCommand(0.0, 0.0, None, None)
+
+
+def _ramp(current, target, max_change):
+    if abs(target - current) <= max_change:
+        return target
+    return current + max_change if target > current else current - max_change
+
+
+class MotorScheduler(Thread):
+    """
+    Only the newest Command counts, posting replaces the current one with a single reference swap,
+    so the Controller never waits for the Scheduler. Only post and post_stop write the Command,
+    the ramp down after the hold time is state of the Scheduler Thread.
+    """
+
+    def __init__(self, set_speed=None, tick=0.02):
+        """
+        :param set_speed: function (left, right) writing the Wheel Speeds, base.set_speed if None
+        :param tick: seconds between two updates of the Wheel Speeds
+        """
+        super().__init__(name='MotorScheduler', daemon=True)
+        if set_speed is None:
+            from base_scripts import base
+            set_speed = base.set_speed
+        self.set_speed = set_speed
+        self.tick = tick
+        self.left = 0.0
+        self.right = 0.0
+        self.number_of_ticks = 0
+        self._command = STOP
+        self._active_command = None
+        self._target = STOP
+        self._reached_time = None
+        self._last_step = None
+        self._output = None
+        self._stop_event = Event()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def post(self, left, right, ramp=DEFAULT_RAMP, hold_time=None):
+        """
+        Sets new target Wheel Speeds, returns at once.
+        Posting the same target again keeps the current Command, e.g. a Controller repeating its decision
+        every cycle does not restart the hold time.
+        :param left: target speed of the left Wheel, -1.0 to 1.0
+        :param right: target speed of the right Wheel, -1.0 to 1.0
+        :param ramp: change of the speed per second, None to jump to the target
+        :param hold_time: seconds to hold the target before ramping down to 0, None to keep it
+        :return: the posted MotorCommand
+        """
+        command = self._command
+        if command == (left, right, ramp, hold_time):
+            return command
+        command = MotorCommand(left, right, ramp, hold_time)
+        self._command = command
+        return command
+
+    def post_stop(self):
+        """
+        Stops both Wheels at the next tick
+        :return:
+        """
+        self._command = STOP
+
+    def step(self, now):
+        """
+        Moves the Wheel Speeds one tick towards the target of the current Command and writes them
+        :param now: time.monotonic() of the tick
+        :return: (left, right) written to the Motors
+        """
+        if self._command is not self._active_command:
+            self._active_command = self._command
+            self._target = self._active_command
+            self._reached_time = None
+        command = self._target
+
+        dt = now - self._last_step if self._last_step is not None else self.tick
+        self._last_step = now
+
+        if command.ramp is None:
+            self.left = command.left
+            self.right = command.right
+        else:
+            max_change = command.ramp * dt
+            self.left = _ramp(self.left, command.left, max_change)
+            self.right = _ramp(self.right, command.right, max_change)
+
+        if self.left == command.left and self.right == command.right and command.hold_time is not None:
+            if self._reached_time is None:
+                self._reached_time = now
+            elif now - self._reached_time >= command.hold_time:
+                # Hold time is over, ramp down with the same ramp until a new Command is posted
+                self._target = MotorCommand(0.0, 0.0, command.ramp, None)
+
+        output = (self.left, self.right)
+        if output != self._output:
+            self.set_speed(self.left, self.right)
+            self._output = output
+        self.number_of_ticks += 1
+        return output
+
+    def stop(self, timeout=1.0):
+        """
+        Stops the Thread and the Motors
+        :param timeout: seconds to wait for the Thread
+        :return:
+        """
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout=timeout)
+        self.set_speed(0.0, 0.0)
+        self.left = 0.0
+        self.right = 0.0
+        self._output = (0.0, 0.0)
+
+    def run(self):
+        log.info('Motor Scheduler: started with a tick of %f seconds', self.tick)
+        deadline = time.monotonic()
+        while not self._stop_event.is_set():
+            self.step(time.monotonic())
+            deadline += self.tick
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                self._stop_event.wait(delay)
+            else:
+                # Missed ticks are skipped instead of running them back to back
+                deadline = time.monotonic()
+        log.info('Motor Scheduler: stopped after %d ticks', self.number_of_ticks)
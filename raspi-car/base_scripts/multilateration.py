@@ -0,0 +1,204 @@
+"""
+Multilateration with NumPy, solves the Position of the Car from the Distances to the Anchors.
+The linearized Least Squares Solution is refined with Gauss-Newton, warm-started from the previous Position.
+"""
+
+import numpy as np
+
+
+class Position:
+    """
+    Result of the Multilateration, has x, y and z like the Points of the localization package
+    """
+
+    def __init__(self, x, y, z, covariance, residual):
+        """
+        :param x:
+        :param y:
+        :param z:
+        :param covariance: 3x3 covariance of (x, y, z) in CentiMeters^2
+        :param residual: root mean square of the Distance residuals in CentiMeters
+        """
+        self.x = x
+        self.y = y
+        self.z = z
+        self.covariance = covariance
+        self.residual = residual
+
+    def __repr__(self):
+        return 'p(%s,%s,%s)' % (self.x, self.y, self.z)
+
+
+class Multilaterator:
+    """
+    Solver for a fixed Anchor geometry. The Matrices of the linearized Problem and their Pseudo-Inverse
+    only depend on which Anchors are used, they are computed once per Set of Anchors.
+    """
+
+    def __init__(self, registry, iterations=5, tolerance=0.01, max_jump=100.0):
+        """
+        :param registry: AnchorRegistry with the Anchor Positions
+        :param iterations: maximum number of Gauss-Newton iterations
+        :param tolerance: stop iterating if the Position moves less than tolerance CentiMeters
+        :param max_jump: no warm start if the linearized Solution is further than max_jump CentiMeters away
+        """
+        self.registry = registry
+        self.positions = registry.positions
+        self.iterations = iterations
+        self.tolerance = tolerance
+        self.max_jump = max_jump
+        self.last_position = None
+        self._squared_norms = np.sum(self.positions * self.positions, axis=1)
+        self._linear_systems = {}
+
+    def reset(self):
+        """
+        Forgets the previous Position, the next solve starts from the linearized Solution
+        :return:
+        """
+        self.last_position = None
+
+    def linear_system(self, slots):
+        """
+        Linearized Problem for a Set of Anchors: subtracting the Equation of the first Anchor from the others gives
+        2 (p_i - p_0) x = r_0^2 - r_i^2 + |p_i|^2 - |p_0|^2
+        :param slots: array of the Anchor Slots
+        :return: (pseudo inverse of the left side, constant part of the right side)
+        """
+        key = slots.tobytes()
+        system = self._linear_systems.get(key)
+        if system is None:
+            reference = slots[0]
+            others = slots[1:]
+            matrix = 2.0 * (self.positions[others] - self.positions[reference])
+            constant = self._squared_norms[others] - self._squared_norms[reference]
+            system = (np.linalg.pinv(matrix), constant)
+            self._linear_systems[key] = system
+        return system
+
+    def solve_linear(self, slots, distances):
+        """
+        Solution of the linearized Problem, needs no start Position
+        :param slots: array of the Anchor Slots
+        :param distances: array of the Distances in CentiMeters, same order as slots
+        :return: (x, y, z) as array
+        """
+        pseudo_inverse, constant = self.linear_system(slots)
+        squared_distances = distances * distances
+        return pseudo_inverse @ (squared_distances[0] - squared_distances[1:] + constant)
+
+    def solve_fixed_height(self, slots, distances, height=0.0):
+        """
+        Gauss-Newton for x and y only, z is known, e.g. the height of the Tag on the Car.
+        With the Anchors close to one plane z of the 3D Solution swings by a meter, with a fixed height the
+        residuals of the Distances are reliable enough to find a bad Anchor.
+        Starts from the linearized Solution, does not change the warm start of solve.
+        :param slots: array of the Anchor Slots
+        :param distances: array of the Distances in CentiMeters, same order as slots
+        :param height: z of the Position in CentiMeters
+        :return: (x, y, z) as array
+        """
+        slots = np.asarray(slots, dtype=np.intp)
+        distances = np.asarray(distances, dtype=np.float64)
+        anchor_positions = self.positions[slots]
+
+        position = self.solve_linear(slots, distances)
+        position[2] = height
+        for i in range(self.iterations):
+            differences = position - anchor_positions
+            ranges = np.maximum(np.sqrt(np.sum(differences * differences, axis=1)), 1e-9)
+            jacobian = differences[:, :2] / ranges[:, None]
+            step = np.linalg.lstsq(jacobian, distances - ranges, rcond=None)[0]
+            position[:2] += step
+            if np.sqrt(step @ step) < self.tolerance:
+                break
+        return position
+
+    def solve(self, slots, distances, warm_start=True):
+        """
+        Calculates the Position from at least 4 Distances (3 if the Anchors are not in one plane)
+        :param slots: array of the Anchor Slots
+        :param distances: array of the Distances in CentiMeters, same order as slots
+        :param warm_start: start Gauss-Newton from the previous Position
+        :return: Position
+        """
+        slots = np.asarray(slots, dtype=np.intp)
+        distances = np.asarray(distances, dtype=np.float64)
+        anchor_positions = self.positions[slots]
+
+        position = self.solve_linear(slots, distances)
+        if warm_start and self.last_position is not None:
+            # Starting close to the Solution needs less iterations, but after a jump it might end in a wrong minimum
+            jump = position - self.last_position
+            if np.sqrt(jump @ jump) < self.max_jump:
+                position = self.last_position.copy()
+
+        for i in range(self.iterations):
+            differences = position - anchor_positions
+            ranges = np.sqrt(np.sum(differences * differences, axis=1))
+            ranges = np.maximum(ranges, 1e-9)
+            jacobian = differences / ranges[:, None]
+            step = np.linalg.lstsq(jacobian, distances - ranges, rcond=None)[0]
+            position += step
+            if np.sqrt(step @ step) < self.tolerance:
+                break
+
+        differences = position - anchor_positions
+        ranges = np.maximum(np.sqrt(np.sum(differences * differences, axis=1)), 1e-9)
+        residuals = distances - ranges
+        jacobian = differences / ranges[:, None]
+        degrees_of_freedom = len(slots) - 3
+        variance = (residuals @ residuals) / degrees_of_freedom if degrees_of_freedom > 0 else 1.0
+        covariance = variance * np.linalg.pinv(jacobian.T @ jacobian)
+
+        self.last_position = position
+        return Position(position[0], position[1], position[2], covariance, np.sqrt(np.mean(residuals * residuals)))
+
+    def solve_batch(self, distances, mask=None, iterations=None):
+        """
+        Calculates the Positions of many Epochs at once, e.g. to reprocess logged Ranges.
+        Epochs with the same Set of Anchors share one linearized System, Gauss-Newton runs on all Epochs together.
+        Does not change the warm start of solve.
+        :param distances: (epochs x anchors) array of the Distances in CentiMeters, columns in Slot order
+        :param mask: (epochs x anchors) bool array, True where a Distance is valid, all valid if None
+        :param iterations: number of Gauss-Newton iterations, self.iterations if None
+        :return: (epochs x 3) array of the Positions, NaN for Epochs with less than 3 Distances
+        """
+        distances = np.asarray(distances, dtype=np.float64)
+        if mask is None:
+            mask = np.ones(distances.shape, dtype=bool)
+        else:
+            mask = np.asarray(mask, dtype=bool)
+        if iterations is None:
+            iterations = self.iterations
+
+        positions = np.full((distances.shape[0], 3), np.nan)
+        solvable = np.count_nonzero(mask, axis=1) >= 3
+        if not solvable.any():
+            return positions
+
+        # Linearized Solution, once per Set of Anchors
+        patterns, inverse = np.unique(mask[solvable], axis=0, return_inverse=True)
+        epochs = np.flatnonzero(solvable)
+        for pattern_index, pattern in enumerate(patterns):
+            slots = np.flatnonzero(pattern)
+            pattern_epochs = epochs[inverse.reshape(-1) == pattern_index]
+            pseudo_inverse, constant = self.linear_system(slots)
+            squared_distances = distances[pattern_epochs][:, slots] ** 2
+            positions[pattern_epochs] = (squared_distances[:, :1] - squared_distances[:, 1:] + constant) @ pseudo_inverse.T
+
+        # Gauss-Newton on all Epochs, invalid Distances get a zero row in the Jacobian
+        weights = mask[epochs].astype(np.float64)
+        valid_distances = np.where(mask[epochs], distances[epochs], 0.0)
+        position = positions[epochs]
+        for i in range(iterations):
+            differences = position[:, None, :] - self.positions[None, :, :]
+            ranges = np.maximum(np.sqrt(np.sum(differences * differences, axis=2)), 1e-9)
+            jacobian = differences / ranges[:, :, None] * weights[:, :, None]
+            residuals = (valid_distances - ranges) * weights
+            normal_matrix = np.einsum('eai,eaj->eij', jacobian, jacobian)
+            gradient = np.einsum('eai,ea->ei', jacobian, residuals)
+            position = position + np.einsum('eij,ej->ei', np.linalg.pinv(normal_matrix), gradient)
+
+        positions[epochs] = position
+        return positions
@@ -0,0 +1,293 @@
+"""
+Pre-Filter for the Ranges between decoding the Frames and solving the Position.
+Every Range is corrected with the Calibration of its Anchor and checked against the median of the last Ranges
+of the same Anchor, NLOS spikes are dropped before they reach the Solver. After a trial solve Anchors with
+a large residual can be dropped as well.
+"""
+
+import os
+from bisect import bisect_left, insort
+
+import numpy as np
+
+from base_scripts import anchors
+from base_scripts import distance_data
+from base_scripts import multilateration
+
+
+# Correction true = scale * measured + offset per Anchor, in Meters.
+# Fitted with fit_calibration_from_files() from evaluation/calibrated_uwb_1m_distance.xlsx and
+# evaluation/calibrated_uwb_2m_distance.xlsx, Anchors without an entry are not corrected
+DEFAULT_CALIBRATION = {8192: (0.9317, 0.0603),
+                       8194: (0.9173, 0.0639),
+                       8195: (0.8826, 0.1092)}
+
+EVALUATION_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'evaluation')
+CALIBRATION_FILES = {1.0: os.path.join(EVALUATION_DIRECTORY, 'calibrated_uwb_1m_distance.xlsx'),
+                     2.0: os.path.join(EVALUATION_DIRECTORY, 'calibrated_uwb_2m_distance.xlsx')}
+
+# Scales the MAD to the standard deviation of a normal distribution
+MAD_TO_SIGMA = 1.4826
+
+
+def _sorted_median(values):
+    """
+    :param values: sorted list, not empty
+    :return: median
+    """
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+
+def _sorted_mad(values, median):
+    """
+    Median of the absolute deviations without sorting them: the deviations grow from the median to both ends
+    of the sorted list, so they are merged like two sorted lists up to the middle one.
+    :param values: sorted list, not empty
+    :param median: median of values
+    :return: median absolute deviation
+    """
+    number = len(values)
+    middle = number // 2
+    right = bisect_left(values, median)
+    left = right - 1
+    previous = current = 0.0
+    for i in range(middle + 1):
+        if left < 0:
+            deviation = values[right] - median
+            right += 1
+        elif right >= number or median - values[left] <= values[right] - median:
+            deviation = median - values[left]
+            left -= 1
+        else:
+            deviation = values[right] - median
+            right += 1
+        previous, current = current, deviation
+    if number % 2:
+        return current
+    return (previous + current) / 2
+
+
+def read_calibration_file(path):
+    """
+    Reads the Distances of an evaluation sheet, the sheet has blocks of (ID, Frame ID, Destination, Source, Distance).
+    Excel lost the decimal point of some Distances, e.g. 1088163 is 1.088163 Meters.
+    Needs openpyxl.
+    :param path: path of the xlsx file
+    :return: dict {source address: list of Distances in Meters}
+    """
+    import openpyxl
+
+    distances = {}
+    workbook = openpyxl.load_workbook(path, read_only=True)
+    for row in workbook.worksheets[0].iter_rows(values_only=True):
+        for column in range(0, len(row) - 4, 6):
+            frame_id, source, distance = row[column + 1], row[column + 3], row[column + 4]
+            # Only the rows of single Frames, not the header and the mean values
+            if not isinstance(frame_id, int) or distance is None:
+                continue
+            distance = float(str(distance).strip())
+            if distance > 1000:
+                distance /= 1e6
+            distances.setdefault(int(str(source).strip()), []).append(distance)
+    workbook.close()
+    return distances
+
+
+def fit_calibration(samples):
+    """
+    Least Squares fit of scale and offset per Anchor
+    :param samples: dict {source address: list of (true Distance, measured Distance)}
+    :return: dict {source address: (scale, offset)}
+    """
+    calibration = {}
+    for address, pairs in samples.items():
+        true, measured = np.array(pairs, dtype=np.float64).T
+        if len(np.unique(true)) < 2:
+            # One true Distance only gives an offset
+            calibration[address] = (1.0, float(np.mean(true - measured)))
+            continue
+        matrix = np.column_stack([measured, np.ones_like(measured)])
+        scale, offset = np.linalg.lstsq(matrix, true, rcond=None)[0]
+        calibration[address] = (float(scale), float(offset))
+    return calibration
+
+
+def fit_calibration_from_files(files=CALIBRATION_FILES):
+    """
+    :param files: dict {true Distance in Meters: path of the xlsx file}
+    :return: dict {source address: (scale, offset)}
+    """
+    samples = {}
+    for true_distance, path in files.items():
+        for address, distances in read_calibration_file(path).items():
+            samples.setdefault(address, []).extend((true_distance, distance) for distance in distances)
+    return fit_calibration(samples)
+
+
+class RangeFilter:
+    """
+    Keeps the last window Ranges of every Anchor. A new Range is rejected if it is further than
+    max_deviation standard deviations (estimated from the MAD) away from the median of its Anchor.
+    Besides the ring buffer every Anchor has a sorted copy of its window, a new Range moves one element
+    instead of sorting the window for every Range.
+    """
+
+    def __init__(self, registry, window=9, max_deviation=3.0, min_deviation=0.05, min_samples=3,
+                 calibration=None, max_residual=30.0, height=0.0):
+        """
+        :param registry: AnchorRegistry, the Filter keeps one buffer per Slot
+        :param window: number of Ranges per Anchor for the median
+        :param max_deviation: number of standard deviations a Range may be away from the median
+        :param min_deviation: lower limit of the standard deviation in Meters, the MAD of identical Ranges is 0
+        :param min_samples: Ranges are not checked until an Anchor has min_samples Ranges
+        :param calibration: dict {source address: (scale, offset)}, e.g. DEFAULT_CALIBRATION, None to not correct
+        :param max_residual: residual in CentiMeters above which an Anchor is dropped after the trial solve
+        :param height: z of the Tag on the Car in CentiMeters, the trial solve only solves x and y
+        """
+        self.registry = registry
+        self.window = window
+        self.max_deviation = max_deviation
+        self.min_deviation = min_deviation
+        self.min_samples = min_samples
+        self.max_residual = max_residual
+        self.height = height
+        self.number_of_rejected_ranges = 0
+        self.number_of_rejected_residuals = 0
+
+        # Calibration per Slot, identity for Anchors without an entry
+        self._scales = [1.0] * len(registry)
+        self._offsets = [0.0] * len(registry)
+        if calibration is not None:
+            for address, (scale, offset) in calibration.items():
+                slot = registry.slot(address)
+                if slot is not None:
+                    self._scales[slot] = scale
+                    self._offsets[slot] = offset
+
+        self._buffers = [distance_data.RangeBuffer(window) for i in range(len(registry))]
+        self._sorted = [[] for i in range(len(registry))]
+
+    def reset(self):
+        for buffer in self._buffers:
+            buffer.clear()
+        for ranges in self._sorted:
+            ranges.clear()
+
+    def accept(self, source_addr, distance, timestamp=None):
+        """
+        Calibrates a Range and checks it against the last Ranges of its Anchor.
+        Rejected Ranges are kept in the buffer as well, so the median follows a real jump of the Distance.
+        :param source_addr: short address of the Anchor
+        :param distance: Distance in Meters
+        :param timestamp: time.monotonic() of the Range, now if None
+        :return: the calibrated Distance, None if it was rejected or the Anchor is unknown
+        """
+        slot = self.registry.slot(source_addr)
+        if slot is None:
+            return None
+        distance = self._scales[slot] * distance + self._offsets[slot]
+
+        buffer = self._buffers[slot]
+        ranges = self._sorted[slot]
+        if len(buffer) == self.window:
+            # The push overwrites the oldest Range, take it out of the sorted window as well
+            del ranges[bisect_left(ranges, buffer.oldest()[0])]
+        buffer.push(distance, timestamp)
+        insort(ranges, distance)
+        if len(ranges) < self.min_samples:
+            return distance
+
+        median = _sorted_median(ranges)
+        deviation = max(MAD_TO_SIGMA * _sorted_mad(ranges, median), self.min_deviation)
+        if abs(distance - median) > self.max_deviation * deviation:
+            self.number_of_rejected_ranges += 1
+            return None
+        return distance
+
+    def _max_residual(self, multilaterator, slots, distances):
+        position = multilaterator.solve_fixed_height(slots, distances, self.height)
+        ranges = np.sqrt(np.sum((multilaterator.positions[slots] - position) ** 2, axis=1))
+        return np.max(np.abs(distances - ranges))
+
+    def reject_residuals(self, multilaterator, slots, distances, min_anchors=4):
+        """
+        Solves the Position and drops one Anchor while the largest residual is above max_residual.
+        The Least Squares Solution spreads the error of a bad Range over all residuals, so the largest residual
+        is not always the bad Anchor: the one is dropped whose removal leaves the smallest largest residual.
+        The trial solve keeps z at height: with the Anchors close to one plane the linearized Solution is
+        off by up to a meter in z, its residuals are large for clean Ranges as well.
+        :param multilaterator: Multilaterator of the registry
+        :param slots: array of the Anchor Slots
+        :param distances: array of the Distances in CentiMeters, same order as slots
+        :param min_anchors: never drop below min_anchors Anchors
+        :return: (slots, distances) without the rejected Anchors
+        """
+        slots = np.asarray(slots, dtype=np.intp)
+        distances = np.asarray(distances, dtype=np.float64)
+        while len(slots) > min_anchors and self._max_residual(multilaterator, slots, distances) > self.max_residual:
+            # Only solved again for every left out Anchor if a Range is bad
+            worst = min(range(len(slots)), key=lambda index: self._max_residual(
+                multilaterator, np.delete(slots, index), np.delete(distances, index)))
+            self.number_of_rejected_residuals += 1
+            slots = np.delete(slots, worst)
+            distances = np.delete(distances, worst)
+        return slots, distances
+
+
+def median_self_test(number_of_ranges=10000, window=9):
+    """
+    Offline verification of the running median and MAD of RangeFilter.accept against np.median over the window,
+    the Ranges have repeated values and jumps so ties and both ends of the sorted window are exercised
+    :param number_of_ranges: number of random Ranges to check
+    :param window: window of the Filter
+    :return: number of checked Ranges
+    """
+    range_filter = RangeFilter(anchors.AnchorRegistry([{0: (0, 0, 0)}]), window=window, min_samples=1)
+    randomizer = np.random.default_rng(0)
+    ranges = np.round(randomizer.normal(2.0, 0.1, number_of_ranges), 2)
+    ranges[randomizer.random(number_of_ranges) < 0.1] += 3.0
+    for i, distance in enumerate(ranges):
+        range_filter.accept(0, float(distance), float(i))
+        window_ranges = ranges[max(0, i + 1 - window):i + 1]
+        median = np.median(window_ranges)
+        sorted_ranges = range_filter._sorted[0]
+        if (sorted_ranges != sorted(window_ranges.tolist()) or _sorted_median(sorted_ranges) != median
+                or not np.isclose(_sorted_mad(sorted_ranges, median), np.median(np.abs(window_ranges - median)))):
+            raise AssertionError('Running median mismatch for %s' % window_ranges)
+    return number_of_ranges
+
+
+def residual_self_test(responder_locations, number_of_fixes=1000, noise=5.0, bias=100.0):
+    """
+    Offline verification of reject_residuals on random Positions in the area of the Anchors:
+    Ranges with normal noise keep every Anchor, one Range with a bias drops exactly that Anchor
+    :param responder_locations: AnchorRegistry or list of dicts {short address: (x, y, z)}, at least 5 Anchors
+    :param number_of_fixes: number of random Positions to check
+    :param noise: standard deviation of the Ranges in CentiMeters
+    :param bias: bias of the bad Anchor in CentiMeters, e.g. a NLOS Range
+    :return: number of checked Positions
+    """
+    registry = anchors.as_registry(responder_locations)
+    range_filter = RangeFilter(registry)
+    solver = multilateration.Multilaterator(registry)
+    randomizer = np.random.default_rng(0)
+    slots = np.arange(len(registry), dtype=np.intp)
+    low = registry.positions[:, :2].min(axis=0)
+    high = registry.positions[:, :2].max(axis=0)
+    for i in range(number_of_fixes):
+        position = np.append(randomizer.uniform(low, high), range_filter.height)
+        distances = np.linalg.norm(registry.positions - position, axis=1) + randomizer.normal(0.0, noise, len(slots))
+        kept_slots, kept_distances = range_filter.reject_residuals(solver, slots, distances)
+        if len(kept_slots) != len(slots):
+            raise AssertionError('Clean Ranges at %s dropped an Anchor' % position)
+
+        bad_slot = i % len(slots)
+        distances[bad_slot] += bias
+        kept_slots, kept_distances = range_filter.reject_residuals(solver, slots, distances)
+        if list(kept_slots) != [slot for slot in slots if slot != bad_slot]:
+            raise AssertionError('Biased Range of Slot %d at %s kept %s' % (bad_slot, position, kept_slots))
+    return number_of_fixes
+
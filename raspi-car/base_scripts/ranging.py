@@ -0,0 +1,383 @@
+"""
+Ranging Session, keeps the MIN Connection to the DWM1001 Initiator open for the whole run
+and decodes the Ranging Frames in a Background Thread
+"""
+
+import time
+import struct
+from collections import namedtuple
+from threading import Condition, Event, Lock, Thread
+
+from serial import SerialException
+
+from base_scripts import logs
+from base_scripts import min
+from base_scripts import tracing
+
+
+log = logs.get_logger('ranging')
+
+
+class MINSession:
+    """
+    Owns one MINTransportSerial for the whole run, instead of opening the Serial Port for every Position Fix.
+    Frames which were received but not consumed by the caller are kept for the next read.
+    Use it as a Context Manager, the Port is closed on exit. If the Serial Port fails the Session reconnects,
+    after close() it stays closed until open() is called again.
+    """
+
+    def __init__(self, port, loglevel=None, binary=False, reconnect_delay=1.0, max_reconnects=None):
+        """
+        :param port: serial port of the DWM1001 Initiator
+        :param loglevel: loglevel of the MIN Transport, None to keep the level set by logs.configure()
+        :param binary: True if the Initiator sends raw MIN bytes (MIN_BINARY_FRAMING in the firmware)
+        :param reconnect_delay: seconds to wait between two reconnect attempts
+        :param max_reconnects: number of failed reconnect attempts before giving up, None for no limit
+        """
+        self.port = port
+        self.loglevel = loglevel
+        self.binary = binary
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnects = max_reconnects
+        self.number_of_reconnects = 0
+        self._transport = None
+        self._pending_frames = []
+        self._closed = False
+        # Opening and closing may happen in different Threads, e.g. the Ranging Reader reconnects
+        # while the sensing Thread closes the Session
+        self._lock = Lock()
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _create_transport(self):
+        return min.MINTransportSerial(port=self.port, loglevel=self.loglevel, binary=self.binary)
+
+    def open(self):
+        """
+        Opens the MIN Transport, does nothing if it is already open
+        :return:
+        """
+        self._closed = False
+        self._open()
+
+    def _open(self):
+        """
+        :return: the open Transport, None if the Session was closed
+        """
+        with self._lock:
+            if self._transport is None and not self._closed:
+                log.info('Ranging: Open MIN Transport on %s', self.port)
+                self._transport = self._create_transport()
+            return self._transport
+
+    def _close_transport(self):
+        with self._lock:
+            transport = self._transport
+            self._transport = None
+        if transport is not None:
+            log.info('Ranging: Close MIN Transport on %s', self.port)
+            try:
+                # Wake up a Thread blocked in poll before the Port goes away under it
+                transport.cancel_read()
+                transport.close()
+            except (SerialException, OSError):
+                pass
+
+    def close(self):
+        """
+        Closes the MIN Transport and drops all pending Frames. A poll blocked on the Port returns at once,
+        the Session does not reconnect until open() is called again.
+        :return:
+        """
+        self._closed = True
+        self._pending_frames = []
+        self._close_transport()
+
+    def is_open(self):
+        return self._transport is not None
+
+    def is_closed(self):
+        """
+        :return: True after close() until the next open()
+        """
+        return self._closed
+
+    def cancel_read(self):
+        """
+        Makes a poll blocked on the Serial Port return at once, e.g. before stopping the Ranging Reader
+        :return:
+        """
+        transport = self._transport
+        if transport is not None:
+            try:
+                transport.cancel_read()
+            except (SerialException, OSError):
+                pass
+
+    def reconnect(self):
+        """
+        Closes and reopens the MIN Transport until it succeeds, max_reconnects is reached or the Session is closed
+        :return:
+        """
+        self._close_transport()
+        attempts = 0
+        while True:
+            time.sleep(self.reconnect_delay)
+            if self._closed:
+                return
+            try:
+                self._open()
+                self.number_of_reconnects += 1
+                log.info('Ranging: Reconnected to %s', self.port)
+                return
+            except min.MINConnectionError as e:
+                attempts += 1
+                log.warning('Ranging: Reconnect attempt %d failed: %s', attempts, e)
+                if self.max_reconnects is not None and attempts >= self.max_reconnects:
+                    raise
+
+    def unread(self, frames):
+        """
+        Hands back Frames the caller did not consume, they are returned first by the next poll
+        :param frames: list of MINFrames
+        :return:
+        """
+        if frames:
+            self._pending_frames = list(frames) + self._pending_frames
+
+    def poll(self):
+        """
+        Polls the MIN Transport once, reconnects if the Serial Port failed
+        :return: list of received MINFrames, might be empty, always empty after close()
+        """
+        if self._pending_frames:
+            frames = self._pending_frames
+            self._pending_frames = []
+            return frames
+
+        transport = self._open()
+        if transport is None:
+            return []
+        try:
+            return transport.poll()
+        except (SerialException, OSError) as e:
+            if self._closed:
+                # close() was called while the poll was blocked on the Port
+                return []
+            log.error('Ranging: Serial Port %s failed: %s', self.port, e)
+            self.reconnect()
+            return []
+        except Exception:
+            # pyserial can fail in other ways if the Port is closed in the middle of a read
+            if self._closed:
+                return []
+            raise
+
+    def wait_for_frames(self):
+        """
+        Blocks until at least one Frame was received
+        :return: list of received MINFrames
+        """
+        while True:
+            frames = self.poll()
+            if frames:
+                return frames
+
+
+# Layout of the Ranging Frame sent by the Initiator: id, destination, source, distance, distance with range bias
+RANGING_FRAME_FORMAT = 'HHHdd'
+
+RangeRecord = namedtuple('RangeRecord', ['source_addr', 'dest_addr', 'distance', 'distance_bias', 'timestamp', 'seq'])
+
+
+class RangeTable:
+    """
+    Fixed size Table holding the latest Range of every Anchor.
+    There is exactly one Writer (the RangingReader), every Slot is replaced by a new immutable RangeRecord,
+    therefore Readers can take a Snapshot at any time without a Lock.
+    """
+
+    def __init__(self, max_anchors=16, registry=None, range_filter=None):
+        """
+        :param max_anchors: number of Slots, Ranges of additional Anchors are dropped
+        :param registry: AnchorRegistry, if given the Table uses its Slots and drops Ranges of unknown Anchors
+        :param range_filter: RangeFilter, calibrates the Distance with Range Bias and drops outliers before storing
+        """
+        if registry is not None:
+            max_anchors = len(registry)
+        self.max_anchors = max_anchors
+        self.sequence = 0
+        self.dropped_ranges = 0
+        self.rejected_ranges = 0
+        self.range_filter = range_filter
+        self._slots = dict(registry.slots) if registry is not None else {}
+        self._fixed_slots = registry is not None
+        self._records = [None] * max_anchors
+        self._condition = Condition()
+
+    def update(self, source_addr, dest_addr, distance, distance_bias, timestamp=None):
+        """
+        Stores a new Range of an Anchor, must only be called by the single Writer
+        :return: the stored RangeRecord, None if the Table is full or the Range Filter rejected it
+        """
+        slot = self._slots.get(source_addr)
+        if slot is None:
+            if self._fixed_slots or len(self._slots) >= self.max_anchors:
+                self.dropped_ranges += 1
+                return None
+            slot = len(self._slots)
+            self._slots[source_addr] = slot
+
+        if timestamp is None:
+            timestamp = time.monotonic()
+
+        if self.range_filter is not None:
+            distance_bias = self.range_filter.accept(source_addr, distance_bias, timestamp)
+            if distance_bias is None:
+                self.rejected_ranges += 1
+                return None
+
+        record = RangeRecord(source_addr, dest_addr, distance, distance_bias, timestamp, self.sequence + 1)
+        self._records[slot] = record
+        self.sequence = record.seq
+
+        with self._condition:
+            self._condition.notify_all()
+        return record
+
+    def update_from_payload(self, payload, timestamp=None):
+        """
+        Decodes a Ranging Frame payload and stores its Range
+        :param payload: payload of the MIN Frame
+        :return: the stored RangeRecord, None if the Table is full
+        """
+        start = tracing.begin()
+        id, dest_addr, source_addr, distance, distance_bias = struct.unpack(RANGING_FRAME_FORMAT, payload)
+        record = self.update(source_addr, dest_addr, distance, distance_bias, timestamp)
+        tracing.end(tracing.AGGREGATE, start)
+        return record
+
+    def snapshot(self, max_age=None, now=None, newer_than=None, up_to=None):
+        """
+        Returns the latest Range of every Anchor without blocking the Writer
+        :param max_age: drop Ranges older than max_age seconds, None to keep all
+        :param now: reference time for max_age, time.monotonic() if None
+        :param newer_than: drop Ranges with a sequence number up to newer_than, e.g. the ones of the last Fix
+        :param up_to: drop Ranges with a sequence number above up_to, e.g. stored after wait_for_update returned
+        :return: list of RangeRecords
+        """
+        records = [record for record in list(self._records) if record is not None]
+        if newer_than is not None:
+            records = [record for record in records if record.seq > newer_than]
+        if up_to is not None:
+            records = [record for record in records if record.seq <= up_to]
+        if max_age is not None:
+            if now is None:
+                now = time.monotonic()
+            records = [record for record in records if now - record.timestamp <= max_age]
+        return records
+
+    def wait_for_update(self, sequence, timeout=None):
+        """
+        Blocks until a Range newer than sequence was stored
+        :param sequence: last sequence number the caller has seen
+        :param timeout: seconds to wait at most, None to wait forever
+        :return: the current sequence number
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self.sequence > sequence, timeout=timeout)
+        return self.sequence
+
+
+class RangingReader(Thread):
+    """
+    Background Thread which polls a MINSession and decodes every Ranging Frame into a RangeTable.
+    Sensing runs at the Ranging Rate of the Initiator, the Localization reads the Table whenever it needs a Position.
+    """
+
+    def __init__(self, session, table=None, clock=time.monotonic):
+        """
+        :param session: MINSession to read the Frames from, the Reader is the only one polling it
+        :param table: RangeTable to write to, a new one if None
+        :param clock: timestamps the Ranges, e.g. the Clock of a Replay
+        """
+        super().__init__(name='RangingReader', daemon=True)
+        self.session = session
+        self.table = table if table is not None else RangeTable()
+        self.clock = clock
+        self.number_of_frames = 0
+        self.number_of_invalid_frames = 0
+        self._listeners = []
+        self._stop_event = Event()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def add_listener(self, listener):
+        """
+        Registers a Callback which gets every stored RangeRecord as soon as its Frame is decoded.
+        It runs in the Reader Thread and should return quickly, the next Frame is decoded after it returned.
+        :param listener: callable taking one RangeRecord
+        :return:
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        """
+        Unregisters a Callback of add_listener, a Frame being decoded right now may still call it
+        :param listener: the registered callable
+        :return:
+        """
+        # A new list, the Reader Thread keeps iterating the old one
+        self._listeners = [registered for registered in self._listeners if registered is not listener]
+
+    def stop(self, timeout=1.0):
+        """
+        Stops the Thread, a poll blocked on the Serial Port is cancelled.
+        Close the Session after stop, a Reader still running then gets no Frames and exits.
+        :param timeout: seconds to wait for the Thread
+        :return:
+        """
+        self._stop_event.set()
+        # The Port has no read timeout, without a cancel the Reader only wakes up with the next Frame
+        self.session.cancel_read()
+        if self.is_alive():
+            self.join(timeout=timeout)
+
+    def read_frames(self):
+        """
+        Polls the Session once and stores the Range of every Ranging Frame, the Thread calls it in a loop.
+        A Replay calls it without starting the Thread whenever Frames are due on its Clock.
+        :return: number of stored Ranges
+        """
+        stored = 0
+        for frame in self.session.poll():
+            try:
+                record = self.table.update_from_payload(frame.payload, self.clock())
+                self.number_of_frames += 1
+            except struct.error:
+                self.number_of_invalid_frames += 1
+                log.warning('Ranging: Frame with %d bytes is no Ranging Frame', len(frame.payload))
+                continue
+            if record is not None:
+                stored += 1
+                for listener in self._listeners:
+                    listener(record)
+        return stored
+
+    def run(self):
+        log.info('Ranging: Reader started')
+        while not self._stop_event.is_set() and not self.session.is_closed():
+            self.read_frames()
+        log.info('Ranging: Reader stopped after %d Frames', self.number_of_frames)
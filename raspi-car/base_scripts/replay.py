@@ -0,0 +1,258 @@
+"""
+Replay of Ranging Frames on a virtual Clock, without the DWM1001 Initiator and without pigpio.
+The Frames come from a Recording or are synthesized, they are MIN encoded and handed to the MIN decoder by a
+ReplayTransport as if they were read from the Serial Port. Time only moves when the Replay advances the Clock,
+so a drive of minutes is replayed in seconds and every run of the same Frames gives the same result.
+"""
+
+import csv
+import math
+import struct
+from collections import deque, namedtuple
+
+import numpy as np
+
+from base_scripts import min as min_protocol
+from base_scripts import ranging
+
+
+# Short address of the Initiator, destination of every Range
+INITIATOR_ADDR = 0x1000
+
+# One Ranging Frame of a Recording: timestamp in seconds, then the fields of RANGING_FRAME_FORMAT
+RangeFrame = namedtuple('RangeFrame', ['timestamp', 'id', 'dest_addr', 'source_addr', 'distance', 'distance_bias'])
+
+
+class VirtualClock:
+    """
+    Clock of a Replay, replaces time.monotonic() and time.monotonic_ns()
+    """
+
+    __slots__ = ('now',)
+
+    def __init__(self, start=0.0):
+        """
+        :param start: time of the Clock in seconds
+        """
+        self.now = start
+
+    def monotonic(self):
+        return self.now
+
+    def monotonic_ns(self):
+        return int(self.now * 1e9)
+
+    def advance_to(self, timestamp):
+        """
+        :param timestamp: new time in seconds, the Clock never goes back
+        :return:
+        """
+        if timestamp > self.now:
+            self.now = timestamp
+
+
+class ReplayTransport(min_protocol.MINTransport):
+    """
+    MIN Transport which reads the bytes fed to it at their time on the virtual Clock instead of from the Serial Port.
+    Written bytes (ACKs) are counted and dropped.
+    """
+
+    def __init__(self, clock, loglevel=None):
+        """
+        :param clock: VirtualClock
+        :param loglevel: loglevel of the MIN Transport, None to keep the level set by logs.configure()
+        """
+        self.clock = clock
+        self.number_of_written_bytes = 0
+        self._pending = deque()
+        super().__init__(loglevel=loglevel)
+
+    def _now_ms(self):
+        return int(self.clock.now * 1000.0)
+
+    def _serial_write(self, data):
+        self.number_of_written_bytes += len(data)
+
+    def _serial_any(self):
+        return bool(self._pending) and self._pending[0][0] <= self.clock.now
+
+    def _serial_read_all(self):
+        pending = self._pending
+        now = self.clock.now
+        data = bytearray()
+        while pending and pending[0][0] <= now:
+            data += pending.popleft()[1]
+        return bytes(data)
+
+    def _serial_close(self):
+        self._pending.clear()
+
+    def feed(self, data, timestamp):
+        """
+        Adds bytes which arrive at timestamp, must be fed in the order of their timestamps
+        :param data: on wire bytes
+        :param timestamp: time on the virtual Clock in seconds
+        :return:
+        """
+        self._pending.append((timestamp, data))
+
+    def feed_frame(self, frame):
+        """
+        MIN encodes a RangeFrame like the Initiator (min_send_frame, no transport) and feeds it
+        :param frame: RangeFrame
+        :return:
+        """
+        payload = struct.pack(ranging.RANGING_FRAME_FORMAT, frame.id, frame.dest_addr, frame.source_addr,
+                              frame.distance, frame.distance_bias)
+        on_wire_bytes = self._on_wire_bytes(min_protocol.MINFrame(min_id=frame.id, payload=payload, seq=0, transport=False))
+        self.feed(on_wire_bytes, frame.timestamp)
+
+    def pending(self):
+        """
+        :return: number of fed chunks not read yet
+        """
+        return len(self._pending)
+
+    def next_timestamp(self):
+        """
+        :return: time of the next fed chunk, None if there is none
+        """
+        return self._pending[0][0] if self._pending else None
+
+
+class ReplaySession(ranging.MINSession):
+    """
+    MINSession on a ReplayTransport, the Ranging code reads it like the Session on the Serial Port
+    """
+
+    def __init__(self, clock, loglevel=None):
+        """
+        :param clock: VirtualClock
+        :param loglevel: loglevel of the MIN Transport, None to keep the level set by logs.configure()
+        """
+        super().__init__(port='replay', loglevel=loglevel)
+        self.clock = clock
+
+    def _create_transport(self):
+        return ReplayTransport(self.clock, loglevel=self.loglevel)
+
+    @property
+    def transport(self):
+        self.open()
+        return self._transport
+
+
+class ReplayRangeTable(ranging.RangeTable):
+    """
+    RangeTable of a Replay. Waiting for an update does not block, it runs the Replay on the virtual Clock until
+    a Range is stored or the timeout passed, like the Ranging Reader storing Ranges while the sensing Thread waits.
+    """
+
+    def __init__(self, run_until, max_anchors=16, registry=None, range_filter=None):
+        """
+        :param run_until: function (condition, timeout) running the Replay until condition() is True,
+            timeout seconds passed on the virtual Clock or the Replay ended
+        """
+        super().__init__(max_anchors=max_anchors, registry=registry, range_filter=range_filter)
+        self.run_until = run_until
+
+    def wait_for_update(self, sequence, timeout=None):
+        self.run_until(lambda: self.sequence > sequence, timeout)
+        return self.sequence
+
+
+class StubOutput:
+    """
+    Stand-in for base.MotorOutput, records the Wheel Speeds instead of writing the duty cycles.
+    Install it with base.set_output(StubOutput(clock)).
+    """
+
+    def __init__(self, clock=None):
+        """
+        :param clock: VirtualClock to timestamp the Wheel Speeds, no timestamps if None
+        """
+        self.clock = clock
+        self.left = 0.0
+        self.right = 0.0
+        self.number_of_writes = 0
+        self.commands = []
+
+    def set_speed(self, l, r):
+        self.left = l
+        self.right = r
+        self.number_of_writes += 1
+        self.commands.append((self.clock.now if self.clock is not None else None, l, r))
+        return True
+
+    def close(self):
+        pass
+
+
+def read_recording(path):
+    """
+    Reads a Recording, a CSV file with a header line and one RangeFrame per line
+    :param path: path of the CSV file
+    :return: list of RangeFrames sorted by timestamp
+    """
+    frames = []
+    with open(path, newline='') as file:
+        for row in csv.DictReader(file):
+            frames.append(RangeFrame(float(row['timestamp']), int(row['id']), int(row['dest_addr']),
+                                     int(row['source_addr']), float(row['distance']), float(row['distance_bias'])))
+    frames.sort(key=lambda frame: frame.timestamp)
+    return frames
+
+
+def write_recording(path, frames):
+    """
+    :param path: path of the CSV file
+    :param frames: iterable of RangeFrames
+    :return:
+    """
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(RangeFrame._fields)
+        for frame in frames:
+            writer.writerow(frame)
+
+
+def synthetic_recording(registry, trajectory, duration, interval=0.1, noise=0.05, seed=0, start=0.0):
+    """
+    Synthesizes the Ranges of a Car moving along a trajectory, one Anchor after the other like the Initiator
+    :param registry: AnchorRegistry with the Positions of the Anchors in CentiMeters
+    :param trajectory: function (seconds since start) -> (x, y, z) of the Car in CentiMeters
+    :param duration: length of the Recording in seconds
+    :param interval: seconds between two Ranges, RNG_DELAY_MS of the Initiator
+    :param noise: standard deviation of the Distances in Meters
+    :param seed: seed of the noise
+    :param start: timestamp of the first Range
+    :return: list of RangeFrames, Distances in Meters
+    """
+    rng = np.random.default_rng(seed)
+    frames = []
+    number_of_frames = int(duration / interval)
+    for index in range(number_of_frames):
+        t = index * interval
+        slot = index % len(registry)
+        x, y, z = trajectory(t)
+        ax, ay, az = registry.locations[slot]
+        distance = math.sqrt((x - ax) ** 2 + (y - ay) ** 2 + (z - az) ** 2) / 100 + rng.normal(0, noise)
+        frames.append(RangeFrame(start + t, index & 0x3f, INITIATOR_ADDR, registry.addresses[slot],
+                                 distance, distance))
+    return frames
+
+
+def line_trajectory(start, goal, speed):
+    """
+    :param start: (x, y) in CentiMeters
+    :param goal: (x, y) in CentiMeters
+    :param speed: CentiMeters per second
+    :return: trajectory function for synthetic_recording, straight from start to goal, then standing at goal
+    """
+    length = math.hypot(goal[0] - start[0], goal[1] - start[1])
+
+    def trajectory(t):
+        fraction = min(speed * t / length, 1.0) if length > 0 else 1.0
+        return (start[0] + fraction * (goal[0] - start[0]), start[1] + fraction * (goal[1] - start[1]), 0.0)
+
+    return trajectory
@@ -0,0 +1,195 @@
+"""
+Simulated World of the Car, stands in for the DWM1001 Initiator with its Anchors and for the differential drive.
+The Initiator ranges one Anchor every RNG_DELAY_MS with noise, NLOS bias and dropouts, the Ranges are MIN encoded
+like the Frames on the Serial Port. The Wheel Speeds written by base.set_speed move the Car, the Motors have the
+offsets which the Wheel Calibration in driving.py compensates.
+"""
+
+import math
+
+import numpy as np
+
+from base_scripts import replay
+
+
+# Delay between two Ranges of the Initiator in ss_init_main.c
+RNG_DELAY_MS = 100
+
+WHEEL_SPEED = 60.0          # CM per second at speed 1.0
+WHEEL_BASE = 15.0           # CM
+
+
+class UWBModel:
+    """
+    Error Model of the Ranges. Every Anchor may have a constant NLOS bias, additionally single Ranges get an NLOS spike
+    or are lost with a given probability.
+    """
+
+    def __init__(self, noise=0.05, nlos_probability=0.02, nlos_bias=(0.3, 1.5), anchor_bias=None, dropout=0.02,
+                 calibration=None, range_bias=0.0):
+        """
+        :param noise: standard deviation of the Distances in Meters
+        :param nlos_probability: probability of an NLOS spike on a single Range
+        :param nlos_bias: (low, high) in Meters, an NLOS spike adds a uniform bias in this interval
+        :param anchor_bias: dict {short address: bias in Meters} of Anchors without line of sight, None for none
+        :param dropout: probability that a Range is lost
+        :param calibration: dict {short address: (scale, offset)} like range_filter.DEFAULT_CALIBRATION, the measured
+            Distance is (true - offset) / scale, None for ideal Antennas
+        :param range_bias: in Meters, subtracted from the Distance for the Distance with Range Bias
+        """
+        self.noise = noise
+        self.nlos_probability = nlos_probability
+        self.nlos_bias = nlos_bias
+        self.anchor_bias = anchor_bias if anchor_bias is not None else {}
+        self.dropout = dropout
+        self.calibration = calibration if calibration is not None else {}
+        self.range_bias = range_bias
+
+    def measure(self, rng, address, true_distance):
+        """
+        :param rng: numpy Generator
+        :param address: short address of the Anchor
+        :param true_distance: in Meters
+        :return: (distance, distance with range bias) in Meters, None if the Range is lost
+        """
+        if self.dropout > 0 and rng.random() < self.dropout:
+            return None
+        distance = true_distance + self.anchor_bias.get(address, 0.0)
+        if self.nlos_probability > 0 and rng.random() < self.nlos_probability:
+            distance += rng.uniform(self.nlos_bias[0], self.nlos_bias[1])
+        if address in self.calibration:
+            scale, offset = self.calibration[address]
+            distance = (distance - offset) / scale
+        distance += rng.normal(0.0, self.noise)
+        return distance, distance - self.range_bias
+
+
+class SimulatedOutput:
+    """
+    Stand-in for base.MotorOutput, keeps the Wheel Speeds for the differential drive.
+    Install it with base.set_output(world.output).
+    """
+
+    def __init__(self):
+        self.left = 0.0
+        self.right = 0.0
+        self.number_of_writes = 0
+
+    def set_speed(self, l, r):
+        # Clamped like duty_cycle in base.py
+        self.left = max(-1.0, min(1.0, l))
+        self.right = max(-1.0, min(1.0, r))
+        self.number_of_writes += 1
+        return True
+
+    def close(self):
+        pass
+
+
+class World:
+    """
+    Car on a plane between the Anchors of an AnchorRegistry.
+    step(now, transport) moves the Car to now and feeds the Ranges measured until now to a ReplayTransport.
+    """
+
+    def __init__(self, registry, start, heading, seed=0, model=None, rng_delay_ms=RNG_DELAY_MS, jitter=0.005,
+                 wheel_offset=(0.0, 0.0), wheel_speed=WHEEL_SPEED, wheel_base=WHEEL_BASE, antenna_height=0.0,
+                 integration_step=0.01):
+        """
+        :param registry: AnchorRegistry with the Positions of the Anchors in CentiMeters
+        :param start: (x, y) of the Car in CentiMeters
+        :param heading: heading of the Car in radians
+        :param seed: seed of the Ranges and the Jitter
+        :param model: UWBModel, one with the default errors if None
+        :param rng_delay_ms: delay between two Ranges
+        :param jitter: standard deviation of the delay in seconds
+        :param wheel_offset: (left, right) added to the commanded Wheel Speeds, the negated Wheel Calibration
+            lets the Car drive straight
+        :param wheel_speed: CM per second at speed 1.0
+        :param wheel_base: distance of the Wheels in CM
+        :param antenna_height: z of the Initiator Antenna in CentiMeters
+        :param integration_step: longest step of the Car integration in seconds
+        """
+        self.registry = registry
+        self.x, self.y = start
+        self.heading = heading
+        self.rng = np.random.default_rng(seed)
+        self.model = model if model is not None else UWBModel()
+        self.interval = rng_delay_ms / 1000.0
+        self.jitter = jitter
+        self.wheel_offset = wheel_offset
+        self.wheel_speed = wheel_speed
+        self.wheel_base = wheel_base
+        self.antenna_height = antenna_height
+        self.integration_step = integration_step
+        self.output = SimulatedOutput()
+        self.path_length = 0.0
+        self.number_of_ranges = 0
+        self.number_of_lost_ranges = 0
+        self._time = None
+        self._next_range = None
+        self._next_slot = 0
+        self._frame_id = 0
+
+    def _move(self, dt):
+        output = self.output
+        left = output.left + self.wheel_offset[0] if output.left != 0.0 else 0.0
+        right = output.right + self.wheel_offset[1] if output.right != 0.0 else 0.0
+        speed = self.wheel_speed * (left + right) / 2
+        turn_rate = self.wheel_speed * (right - left) / self.wheel_base
+        self.x += speed * math.cos(self.heading) * dt
+        self.y += speed * math.sin(self.heading) * dt
+        self.heading += turn_rate * dt
+        self.path_length += abs(speed) * dt
+
+    def _advance(self, timestamp):
+        while self._time < timestamp:
+            dt = timestamp - self._time
+            if dt > self.integration_step:
+                dt = self.integration_step
+            self._move(dt)
+            self._time += dt
+
+    def _range(self, transport, timestamp):
+        slot = self._next_slot
+        self._next_slot = (slot + 1) % len(self.registry)
+        address = self.registry.addresses[slot]
+        ax, ay, az = self.registry.locations[slot]
+        true_distance = math.sqrt((self.x - ax) ** 2 + (self.y - ay) ** 2 + (self.antenna_height - az) ** 2) / 100
+        measured = self.model.measure(self.rng, address, true_distance)
+        if measured is None:
+            self.number_of_lost_ranges += 1
+            return
+        self.number_of_ranges += 1
+        transport.feed_frame(replay.RangeFrame(timestamp, self._frame_id, replay.INITIATOR_ADDR, address,
+                                               measured[0], measured[1]))
+        self._frame_id = (self._frame_id + 1) & 0x3f
+
+    def step(self, now, transport):
+        """
+        Moves the Car with the current Wheel Speeds and feeds the Ranges until now
+        :param now: time of the virtual Clock in seconds
+        :param transport: ReplayTransport of the Replay
+        :return:
+        """
+        if self._time is None:
+            self._time = now
+            self._next_range = now
+        while self._next_range <= now:
+            # The Car moves between two Ranges
+            self._advance(self._next_range)
+            self._range(transport, self._next_range)
+            self._next_range += max(0.001, self.interval + self.rng.normal(0.0, self.jitter))
+        self._advance(now)
+
+    def next_timestamp(self):
+        """
+        :return: time of the next Range, None before the first step
+        """
+        return self._next_range
+
+    def distance_to(self, x, y):
+        """
+        :return: true distance of the Car to (x, y) in CentiMeters
+        """
+        return math.hypot(self.x - x, self.y - y)
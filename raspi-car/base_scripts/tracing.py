@@ -0,0 +1,217 @@
+"""
+Tracing Spans of the Pipeline from the Serial Port to the Motors.
+Every Stage records its duration into a preallocated Histogram, optionally every Span is also kept in a preallocated
+ring buffer which can be exported as Chrome Trace (chrome://tracing or https://ui.perfetto.dev).
+Disabled Tracing costs two function calls per Span, no buffer grows while recording.
+
+    start = tracing.begin()
+    ...
+    tracing.end(tracing.SOLVE, start)
+"""
+
+import json
+import signal
+import threading
+import time
+from array import array
+
+from base_scripts import logs
+from base_scripts.control_loop import LogHistogram
+
+
+log = logs.get_logger('driving')
+
+# Stages, the index is the Span id
+SERIAL_READ = 0
+DECODE = 1
+AGGREGATE = 2
+SOLVE = 3
+KALMAN = 4
+CONTROL = 5
+PWM = 6
+
+# Name, upper edge of the first bin and upper edge of the last bin of the Histogram of every Stage in microseconds.
+# Reading blocks on the Serial Port and the LSE Solver takes milliseconds, the other Stages take microseconds,
+# the bins are log-spaced so a Stage much faster than a bin still gets its own percentiles
+SPANS = [('serial_read', 0.1, 1000000),
+         ('decode', 0.1, 100000),
+         ('aggregate', 0.1, 100000),
+         ('solve', 0.1, 1000000),
+         ('kalman', 0.1, 100000),
+         ('control', 0.1, 100000),
+         ('pwm', 0.1, 100000)]
+
+
+class Tracer:
+    """
+    Histograms of all Stages and the ring buffer of the latest Spans.
+    The Stages are recorded by different Threads, e.g. the Ranging Reader decodes and the Motor Scheduler writes the PWM,
+    the Span counter and the ring buffer are shared, so recording takes a Lock.
+    """
+
+    def __init__(self, enabled=True, trace_capacity=0):
+        """
+        :param enabled: record the Spans
+        :param trace_capacity: number of Spans kept for the Chrome Trace, 0 to only keep the Histograms
+        """
+        self.enabled = enabled
+        self.histograms = [LogHistogram(lowest, highest) for name, lowest, highest in SPANS]
+        self.trace_capacity = trace_capacity
+        self.number_of_spans = 0
+        self._starts = array('q', bytes(8 * trace_capacity))
+        self._durations = array('q', bytes(8 * trace_capacity))
+        self._span_ids = array('B', bytes(trace_capacity))
+        self._thread_ids = array('Q', bytes(8 * trace_capacity))
+        # Reentrant, the SIGUSR1 handler may interrupt the main Thread while it records a Span
+        self._lock = threading.RLock()
+
+    def record(self, span_id, start, end):
+        """
+        :param span_id: Stage, e.g. SOLVE
+        :param start: time.perf_counter_ns() at the begin of the Span
+        :param end: time.perf_counter_ns() at the end of the Span
+        :return:
+        """
+        duration = end - start
+        thread_id = threading.get_ident()
+        with self._lock:
+            self.histograms[span_id].record(duration / 1000)
+            if self.trace_capacity:
+                index = self.number_of_spans % self.trace_capacity
+                self._starts[index] = start
+                self._durations[index] = duration
+                self._span_ids[index] = span_id
+                self._thread_ids[index] = thread_id
+            self.number_of_spans += 1
+
+    def reset(self):
+        with self._lock:
+            self.histograms = [LogHistogram(lowest, highest) for name, lowest, highest in SPANS]
+            self.number_of_spans = 0
+
+    def statistics(self):
+        """
+        :return: dict {Stage name: dict of count, mean, p50, p95, p99 and max in microseconds}
+        """
+        result = {}
+        with self._lock:
+            for (name, lowest, highest), histogram in zip(SPANS, self.histograms):
+                result[name] = {'count': histogram.count,
+                                'mean_us': histogram.mean(),
+                                'p50_us': histogram.percentile(50),
+                                'p95_us': histogram.percentile(95),
+                                'p99_us': histogram.percentile(99),
+                                'max_us': histogram.maximum}
+        return result
+
+    def log_statistics(self):
+        for name, span in self.statistics().items():
+            if span['count']:
+                log.info('Trace %s: %d Spans, mean %d us, p50 %d us, p95 %d us, p99 %d us, max %d us', name,
+                         span['count'], span['mean_us'], span['p50_us'], span['p95_us'], span['p99_us'], span['max_us'])
+
+    def chrome_trace(self):
+        """
+        :return: the kept Spans in the Chrome Trace Event Format, oldest first
+        """
+        # Copy the ring buffer, the Threads keep recording while the Trace is built
+        with self._lock:
+            number_of_spans = self.number_of_spans
+            starts = array('q', self._starts)
+            durations = array('q', self._durations)
+            span_ids = array('B', self._span_ids)
+            all_thread_ids = array('Q', self._thread_ids)
+        number_of_events = min(number_of_spans, self.trace_capacity)
+        first = number_of_spans - number_of_events
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        events = []
+        thread_ids = set()
+        for position in range(first, first + number_of_events):
+            index = position % self.trace_capacity
+            thread_id = all_thread_ids[index]
+            thread_ids.add(thread_id)
+            events.append({'name': SPANS[span_ids[index]][0], 'ph': 'X', 'pid': 0, 'tid': thread_id,
+                           'ts': starts[index] / 1000, 'dur': durations[index] / 1000})
+        for thread_id in thread_ids:
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': 0, 'tid': thread_id,
+                           'args': {'name': thread_names.get(thread_id, str(thread_id))}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def export_chrome_trace(self, path):
+        """
+        :param path: path of the JSON file
+        :return: number of exported Spans
+        """
+        trace = self.chrome_trace()
+        with open(path, 'w') as file:
+            json.dump(trace, file)
+        number_of_events = sum(1 for event in trace['traceEvents'] if event['ph'] == 'X')
+        log.info('Trace: wrote %d Spans to %s', number_of_events, path)
+        return number_of_events
+
+
+# Tracer of the process, disabled until configure() is called
+_tracer = Tracer(enabled=False)
+
+
+def configure(enabled=True, trace_capacity=0):
+    """
+    Replaces the Tracer of the process
+    :param enabled: record the Spans
+    :param trace_capacity: number of Spans kept for the Chrome Trace, 0 to only keep the Histograms
+    :return: the new Tracer
+    """
+    global _tracer
+    _tracer = Tracer(enabled=enabled, trace_capacity=trace_capacity)
+    return _tracer
+
+
+def get_tracer():
+    return _tracer
+
+
+def set_tracer(tracer):
+    """
+    Replaces the Tracer of the process, e.g. to restore the one in use before a Replay
+    :param tracer: Tracer
+    :return:
+    """
+    global _tracer
+    _tracer = tracer
+
+
+def begin():
+    """
+    :return: start of a Span, 0 if Tracing is disabled
+    """
+    return time.perf_counter_ns() if _tracer.enabled else 0
+
+
+def end(span_id, start):
+    """
+    Records a Span started with begin()
+    :param span_id: Stage, e.g. SOLVE
+    :param start: return value of begin()
+    :return:
+    """
+    if start:
+        _tracer.record(span_id, start, time.perf_counter_ns())
+
+
+def install_signal_handler(path=None, signal_number=None):
+    """
+    Dumps the Statistics to the log (and the Chrome Trace to path) when the process gets the signal,
+    e.g. kill -USR1 <pid> while the Car is driving. Must be called from the main Thread.
+    :param path: path of the Chrome Trace, None to only log the Statistics
+    :param signal_number: signal.SIGUSR1 if None
+    :return:
+    """
+    if signal_number is None:
+        signal_number = signal.SIGUSR1
+
+    def dump(signum, frame):
+        _tracer.log_statistics()
+        if path is not None and _tracer.trace_capacity:
+            _tracer.export_chrome_trace(path)
+
+    signal.signal(signal_number, dump)
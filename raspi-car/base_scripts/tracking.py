@@ -0,0 +1,200 @@
+"""
+Tracking of the Car Position with a constant velocity Kalman Filter in NumPy.
+The time between two Position Fixes varies a lot, therefore F and Q are rebuilt from the real time difference
+of every Measurement, and the Position can be predicted forward to any time between the Fixes.
+"""
+
+import time
+from collections import deque, namedtuple
+
+import numpy as np
+
+from base_scripts import tracing
+
+
+# Filter State: [x, y, vx, vy], its 4x4 Covariance and the monotonic time it belongs to
+TrackState = namedtuple('TrackState', ['x', 'P', 'timestamp', 'number_of_updates'])
+
+# Measurement function, only (x, y) is measured
+H = np.array([[1., 0., 0., 0.],
+              [0., 1., 0., 0.]])
+
+
+def transition_matrix(dt):
+    """
+    :param dt: time difference in seconds
+    :return: 4x4 state transition matrix of the constant velocity model
+    """
+    return np.array([[1., 0., dt, 0.],
+                     [0., 1., 0., dt],
+                     [0., 0., 1., 0.],
+                     [0., 0., 0., 1.]])
+
+
+def process_noise(dt, variance):
+    """
+    Discrete white noise acceleration, independent for x and y
+    :param dt: time difference in seconds
+    :param variance: variance of the acceleration
+    :return: 4x4 process noise matrix
+    """
+    dt2 = dt * dt
+    position = dt2 * dt2 / 4. * variance
+    cross = dt2 * dt / 2. * variance
+    velocity = dt2 * variance
+    return np.array([[position, 0., cross, 0.],
+                     [0., position, 0., cross],
+                     [cross, 0., velocity, 0.],
+                     [0., cross, 0., velocity]])
+
+
+class Tracker:
+    """
+    Constant velocity Kalman Filter with the State (x, y, vx, vy).
+    There is one Writer (the sensing Thread) calling update, the State is replaced by a new TrackState,
+    therefore other Threads can read it or predict from it at any time without a Lock.
+    """
+
+    def __init__(self, process_variance=0.13, measurement_variance=5., initial_variance=1000., max_dt=5.):
+        """
+        :param process_variance: variance of the acceleration
+        :param measurement_variance: variance of a Position Fix in x and y
+        :param initial_variance: variance of the State before the first Fix
+        :param max_dt: longer time differences are clipped, the velocity is not trusted that long
+        """
+        self.process_variance = process_variance
+        self.measurement_variance = measurement_variance
+        self.initial_variance = initial_variance
+        self.max_dt = max_dt
+        self._R = np.eye(2) * measurement_variance
+        self.state = TrackState(np.zeros(4), np.eye(4) * initial_variance, None, 0)
+
+    def reset(self):
+        """
+        Forgets the State, the next update starts again from the initial variance
+        :return:
+        """
+        self.state = TrackState(np.zeros(4), np.eye(4) * self.initial_variance, None, 0)
+
+    def _predict(self, state, timestamp):
+        if state.timestamp is None:
+            return state.x, state.P
+        dt = min(max(timestamp - state.timestamp, 0.), self.max_dt)
+        F = transition_matrix(dt)
+        return F @ state.x, F @ state.P @ F.T + process_noise(dt, self.process_variance)
+
+    def update(self, x, y, timestamp=None):
+        """
+        Predicts the State to the time of the Fix and corrects it with the Fix
+        :param x: measured x
+        :param y: measured y
+        :param timestamp: time.monotonic() of the Fix, now if None
+        :return: the new TrackState
+        """
+        start = tracing.begin()
+        if timestamp is None:
+            timestamp = time.monotonic()
+        state = self.state
+        predicted_x, predicted_P = self._predict(state, timestamp)
+
+        residual = np.array([x - predicted_x[0], y - predicted_x[1]])
+        S = predicted_P[:2, :2] + self._R
+        K = predicted_P[:, :2] @ np.linalg.inv(S)
+        new_x = predicted_x + K @ residual
+        new_P = (np.eye(4) - K @ H) @ predicted_P
+
+        self.state = TrackState(new_x, new_P, timestamp, state.number_of_updates + 1)
+        tracing.end(tracing.KALMAN, start)
+        return self.state
+
+    def predict_to(self, timestamp=None):
+        """
+        Dead-reckons the latest State forward, does not change the State
+        :param timestamp: time.monotonic() to predict to, now if None
+        :return: (x, y, vx, vy)
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        state = self.state
+        x, y, vx, vy = state.x
+        if state.timestamp is not None:
+            dt = min(max(timestamp - state.timestamp, 0.), self.max_dt)
+            x += vx * dt
+            y += vy * dt
+        return x, y, vx, vy
+
+
+class RangeTracker(Tracker):
+    """
+    Tightly coupled Variant of the Tracker: besides Position Fixes it takes single Anchor Ranges.
+    The Measurement model of a Range is the distance between the Car and the Anchor, linearized at the predicted
+    State (extended Kalman Filter). Every Ranging Frame updates the State as soon as it is decoded,
+    there is no need to wait for a Range of every Anchor.
+    """
+
+    def __init__(self, process_variance=0.13, measurement_variance=5., initial_variance=1000., max_dt=5.,
+                 range_variance=100., height=0., gate=3., recent_window=14):
+        """
+        :param range_variance: variance of a single Range in CentiMeters^2
+        :param height: z of the Tag on the Car in CentiMeters, the State is only (x, y)
+        :param gate: Ranges with an innovation larger than gate standard deviations are rejected, None to use all
+        :param recent_window: number of the latest Ranges recent_rejected_ranges counts over
+        """
+        super().__init__(process_variance, measurement_variance, initial_variance, max_dt)
+        self.range_variance = range_variance
+        self.height = height
+        self.gate = gate
+        self.number_of_rejected_ranges = 0
+        # True for every rejected one of the latest Ranges
+        self._recent_rejections = deque(maxlen=recent_window)
+
+    def reset(self):
+        super().reset()
+        self._recent_rejections.clear()
+
+    def recent_rejected_ranges(self):
+        """
+        A drifted State rejects most Ranges, only the few Anchors in line with the error still pass the gate
+        :return: number of rejected Ranges among the latest recent_window Ranges
+        """
+        return sum(self._recent_rejections)
+
+    def update_range(self, anchor_position, distance, timestamp=None):
+        """
+        Predicts the State to the time of the Range and corrects it with the Range.
+        The State must be initialized by a Position Fix (update) first, a Range alone can not locate the Car.
+        :param anchor_position: (x, y, z) of the Anchor in CentiMeters
+        :param distance: measured Distance in CentiMeters
+        :param timestamp: time.monotonic() of the Range, now if None
+        :return: the new TrackState, None if the Range was rejected by the gate
+        """
+        start = tracing.begin()
+        if timestamp is None:
+            timestamp = time.monotonic()
+        state = self.state
+        predicted_x, predicted_P = self._predict(state, timestamp)
+
+        dx = predicted_x[0] - anchor_position[0]
+        dy = predicted_x[1] - anchor_position[1]
+        dz = self.height - anchor_position[2]
+        predicted_distance = max(np.sqrt(dx * dx + dy * dy + dz * dz), 1e-9)
+
+        # Jacobian of the Range, only x and y are not zero
+        h = np.array([dx / predicted_distance, dy / predicted_distance, 0., 0.])
+        Ph = predicted_P @ h
+        S = h @ Ph + self.range_variance
+        residual = distance - predicted_distance
+        if self.gate is not None and residual * residual > self.gate * self.gate * S:
+            self.number_of_rejected_ranges += 1
+            self._recent_rejections.append(True)
+            tracing.end(tracing.KALMAN, start)
+            return None
+
+        K = Ph / S
+        new_x = predicted_x + K * residual
+        new_P = predicted_P - np.outer(K, Ph)
+
+        self._recent_rejections.append(False)
+        self.state = TrackState(new_x, new_P, timestamp, state.number_of_updates + 1)
+        tracing.end(tracing.KALMAN, start)
+        return self.state
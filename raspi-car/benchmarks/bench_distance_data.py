@@ -0,0 +1,90 @@
+"""
+Memory and time of distance_data_set over a synthetic 1 hour Ranging stream,
+compared with the old list based implementation.
+Run from raspi-car/: python3 -m benchmarks.bench_distance_data
+"""
+
+import time
+import tracemalloc
+
+import numpy as np
+
+from base_scripts import distance_data
+
+
+RANGING_RATE = 10       # Ranges per second and Anchor
+NUMBER_OF_ANCHORS = 7
+DURATION = 3600         # Seconds
+
+
+class list_distance_data_set:
+    """
+    The old implementation, appends to a list and calculates the mean with sum()/len()
+    """
+
+    def __init__(self, dest_addr, source_addr):
+        self.dest_addr = dest_addr
+        self.source_addr = source_addr
+        self.distance_numbers = []
+        self.distance_bias_numbers = []
+
+    def set_distance(self, distance):
+        self.distance_numbers.append(distance)
+
+    def set_distance_bias(self, distance_bias):
+        self.distance_bias_numbers.append(distance_bias)
+
+    def get_distance_bias_norm(self):
+        return sum(self.distance_bias_numbers) / len(self.distance_bias_numbers)
+
+
+def run_stream(data_set_class, distances, read_every):
+    """
+    Pushes the stream into one data set per Anchor and reads the mean every read_every Ranges
+    :return: (seconds, peak bytes, microseconds of one mean read at the end of the stream)
+    """
+    # Tracing the allocations slows down the stream, the time is measured in a separate run
+    tracemalloc.start()
+    push_stream(data_set_class, distances, read_every)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    data_sets = push_stream(data_set_class, distances, read_every)
+    seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(100):
+        data_sets[0].get_distance_bias_norm()
+    return seconds, peak, (time.perf_counter() - start) / 100 * 1e6
+
+
+def push_stream(data_set_class, distances, read_every):
+    data_sets = [data_set_class(4096, 8192 + anchor) for anchor in range(NUMBER_OF_ANCHORS)]
+    for index, distance in enumerate(distances):
+        data_set = data_sets[index % NUMBER_OF_ANCHORS]
+        data_set.set_distance(distance)
+        data_set.set_distance_bias(distance)
+        if index % read_every == 0:
+            data_set.get_distance_bias_norm()
+    return data_sets
+
+
+def main(duration=DURATION, read_every=NUMBER_OF_ANCHORS):
+    number_of_ranges = duration * RANGING_RATE * NUMBER_OF_ANCHORS
+    distances = (np.random.default_rng(0).normal(2.0, 0.05, number_of_ranges)).tolist()
+    results = {}
+    # The list version reads in O(n), reading it every Range takes far too long for a full hour
+    for name, data_set_class, every in [('ring_buffer', distance_data.distance_data_set, read_every),
+                                        ('list', list_distance_data_set, read_every * 100)]:
+        seconds, peak, us_per_read = run_stream(data_set_class, distances, every)
+        results[name] = {'ranges': number_of_ranges, 'read_every': every, 'seconds': seconds,
+                         'us_per_range': seconds / number_of_ranges * 1e6, 'peak_kib': peak / 1024,
+                         'us_per_read_after_stream': us_per_read}
+        print('%-12s %d Ranges, mean read every %d: %.2f s, %.2f us/Range, peak %.0f KiB, %.1f us per read after 1 h'
+              % (name, number_of_ranges, every, seconds, seconds / number_of_ranges * 1e6, peak / 1024, us_per_read))
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+CPU time and wake-up latency of the driving Thread, polling the Car (the old busy loop)
+against blocking in Car.wait_for_estimation.
+A sensing Thread publishes estimations at RATE Hz, the driving Thread reads every new one.
+Run from raspi-car/ on the Pi: python3 -m benchmarks.bench_drive_wakeup
+"""
+
+import time
+from threading import Thread
+
+import numpy as np
+
+from base_scripts import car_controller
+
+
+RATE = 10           # Estimations per second
+DURATION = 5.0      # Seconds per mode
+
+
+def sense(car, published, number_of_estimations):
+    for i in range(number_of_estimations):
+        time.sleep(1.0 / RATE)
+        published.append(time.perf_counter_ns())
+        car.set_current_estimation_x_y(float(i), float(i))
+    car.set_is_reached_destination()
+
+
+def drive_polling(car, received):
+    local_number_of_estimations = 0
+    while not car.get_is_reached_destination():
+        if local_number_of_estimations < car.get_number_of_estimations():
+            received.append(time.perf_counter_ns())
+            local_number_of_estimations += 1
+            car.get_current_estimation_x()
+            car.get_current_estimation_y()
+
+
+def drive_waiting(car, received):
+    local_number_of_estimations = 0
+    while not car.get_is_reached_destination():
+        number_of_estimations = car.wait_for_estimation(local_number_of_estimations, timeout=1.0)
+        if local_number_of_estimations < number_of_estimations:
+            received.append(time.perf_counter_ns())
+            local_number_of_estimations += 1
+            car.get_current_estimation_x()
+            car.get_current_estimation_y()
+
+
+def run(drive, duration=DURATION):
+    """
+    :return: dict with CPU percent of the process and the wake-up latency in microseconds
+    """
+    car = car_controller.Car(0, 0, 0.0, 0.0, False)
+    published = []
+    received = []
+    number_of_estimations = int(duration * RATE)
+    driver = Thread(target=drive, args=(car, received))
+    sensor = Thread(target=sense, args=(car, published, number_of_estimations))
+
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    driver.start()
+    sensor.start()
+    sensor.join()
+    driver.join()
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+
+    count = min(len(published), len(received))
+    latencies = (np.array(received[:count]) - np.array(published[:count])) / 1000
+    return {'cpu_percent': cpu / wall * 100, 'wakeups': count,
+            'latency_p50_us': float(np.percentile(latencies, 50)),
+            'latency_p99_us': float(np.percentile(latencies, 99))}
+
+
+def main(duration=DURATION):
+    results = {}
+    for name, drive in [('polling', drive_polling), ('condition', drive_waiting)]:
+        result = run(drive, duration)
+        results[name] = result
+        print('%-10s CPU %5.1f %%, %d wake-ups, latency p50 %.0f us, p99 %.0f us'
+              % (name, result['cpu_percent'], result['wakeups'], result['latency_p50_us'], result['latency_p99_us']))
+    return results
+
+
+if __name__ == '__main__':
+    main()
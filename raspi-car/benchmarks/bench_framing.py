@@ -0,0 +1,99 @@
+"""
+CPU load of reading the Ranging Frames from the Serial Port, ASCII hex lines against raw MIN bytes (MIN_BINARY_FRAMING).
+A writer sends Ranging Frames into a pseudo terminal at a fixed rate, a reader Thread polls MINTransportSerial
+on the other end like the Ranging Reader. The CPU time of the reader Thread is measured with time.thread_time().
+Run from raspi-car/: python3 -m benchmarks.bench_framing
+"""
+
+import os
+import time
+from threading import Event, Thread
+
+from base_scripts import min
+from base_scripts import simulation
+from benchmarks import bench_hot_paths
+
+
+RATES = [1000 // simulation.RNG_DELAY_MS, 500]     # Frames per second, the Initiator rate and a stress rate
+DURATION = 5.0                                      # Seconds per framing and rate
+
+
+def _drain(master):
+    # Drop the ACKs of the host, the pty buffer must not fill up
+    try:
+        while os.read(master, 4096):
+            pass
+    except BlockingIOError:
+        pass
+
+
+def run(binary, rate, duration=DURATION):
+    """
+    :param binary: raw MIN bytes if True, ASCII hex lines if False
+    :param rate: Frames per second
+    :param duration: seconds of sending
+    :return: dict with the sent and received Frames, CPU percent of the reader Thread and CPU microseconds per Frame
+    """
+    import tty
+
+    master, slave = os.openpty()
+    tty.setraw(master)
+    os.set_blocking(master, False)
+    transport = min.MINTransportSerial(os.ttyname(slave), loglevel=None, binary=binary)
+    encoder = bench_hot_paths._transport()
+    chunks = []
+    for frame in bench_hot_paths._ranging_frames():
+        on_wire_bytes = encoder._on_wire_bytes(frame)
+        chunks.append(on_wire_bytes if binary else bench_hot_paths._hex_line(on_wire_bytes))
+
+    stop_event = Event()
+    received = [0]
+    cpu = [0.0]
+
+    def read():
+        start = time.thread_time()
+        while not stop_event.is_set():
+            received[0] += len(transport.poll() or ())
+        cpu[0] = time.thread_time() - start
+
+    reader = Thread(target=read, name='FramingReader')
+    number_of_frames = int(duration * rate)
+    wall_start = time.perf_counter()
+    reader.start()
+    deadline = time.perf_counter()
+    for index in range(number_of_frames):
+        os.write(master, chunks[index % len(chunks)])
+        _drain(master)
+        deadline += 1.0 / rate
+        delay = deadline - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    # Let the reader take the last Frames, then wake it up from the blocked read
+    time.sleep(0.1)
+    stop_event.set()
+    transport.cancel_read()
+    reader.join()
+    wall = time.perf_counter() - wall_start
+
+    transport.close()
+    os.close(master)
+    os.close(slave)
+    return {'sent': number_of_frames, 'received': received[0],
+            'cpu_percent': cpu[0] / wall * 100,
+            'cpu_us_per_frame': cpu[0] / received[0] * 1e6 if received[0] else None}
+
+
+def main(duration=DURATION, rates=RATES):
+    results = {}
+    for rate in rates:
+        for name, binary in [('hex', False), ('binary', True)]:
+            result = run(binary, rate, duration)
+            results['%s_%d_hz' % (name, rate)] = result
+            print('%-6s %4d Frames/s: %d of %d Frames, reader CPU %5.2f %%, %6.1f us CPU per Frame'
+                  % (name, rate, result['received'], result['sent'], result['cpu_percent'],
+                     result['cpu_us_per_frame'] or 0.0))
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,486 @@
+"""
+Micro Benchmarks of the hot paths from the Serial Port to the Motors, the hardware is stubbed out.
+Every Benchmark is a Context Manager yielding (function, items per call, item name), the Runner times the function
+and reports the time per item. Setup and teardown are not timed.
+Run all with the Runner from raspi-car/: python3 -m benchmarks.run
+"""
+
+import io
+import logging
+import math
+import os
+import struct
+import sys
+from contextlib import contextmanager
+
+import numpy as np
+
+import driving
+from base_scripts import car_controller
+from base_scripts import listen
+from base_scripts import logs
+from base_scripts import min
+from base_scripts import motor_scheduler
+from base_scripts import range_filter
+from base_scripts import ranging
+from base_scripts import replay
+from base_scripts import tracking
+
+
+NUMBER_OF_FRAMES = 100      # Frames per call of the MIN Benchmarks
+
+
+def _ranging_payload(index):
+    slot = index % len(driving.ANCHORS)
+    return struct.pack(ranging.RANGING_FRAME_FORMAT, index & 0x3f, replay.INITIATOR_ADDR,
+                       driving.ANCHORS.addresses[slot], 1.5 + 0.01 * index, 1.45 + 0.01 * index)
+
+
+def _ranging_frames(number_of_frames=NUMBER_OF_FRAMES):
+    return [min.MINFrame(min_id=index & 0x3f, payload=_ranging_payload(index), seq=0, transport=False)
+            for index in range(number_of_frames)]
+
+
+def _transport():
+    return replay.ReplayTransport(replay.VirtualClock())
+
+
+def _hex_line(on_wire_bytes):
+    # Like min_tx_byte and min_tx_finished of the Initiator without MIN_BINARY_FRAMING
+    return ''.join('%02X ' % byte for byte in on_wire_bytes).encode() + b'\n'
+
+
+class _StubSerial:
+    """
+    pyserial.Serial stand-in which returns the same line or the same bytes on every read
+    """
+
+    def __init__(self, line=b'', data=b''):
+        self.line = line
+        self.data = data
+        self.in_waiting = len(data)
+
+    def readline(self):
+        return self.line
+
+    def read(self, size=1):
+        return self.data
+
+    def write(self, data):
+        return len(data)
+
+    def close(self):
+        pass
+
+
+def _serial_transport(serial, binary):
+    transport = min.MINTransportSerial.__new__(min.MINTransportSerial)
+    transport.fake_errors = False
+    transport.binary = binary
+    transport._serial = serial
+    min.MINTransport.__init__(transport, loglevel=None)
+    return transport
+
+
+@contextmanager
+def rx_bytes():
+    """
+    MINTransport._rx_bytes, decoding a stream of Ranging Frames
+    """
+    transport = _transport()
+    data = b''.join(transport._on_wire_bytes(frame) for frame in _ranging_frames())
+
+    def run():
+        transport._rx_list = []
+        transport._rx_bytes(data)
+
+    yield run, NUMBER_OF_FRAMES, 'frame'
+
+
+@contextmanager
+def rx_bytes_reference():
+    """
+    MINTransport._rx_bytes_reference, the byte by byte state machine the decoder replaced
+    """
+    transport = _transport()
+    data = b''.join(transport._on_wire_bytes(frame) for frame in _ranging_frames())
+
+    def run():
+        transport._rx_list = []
+        transport._rx_bytes_reference(data)
+
+    yield run, NUMBER_OF_FRAMES, 'frame'
+
+
+@contextmanager
+def rx_bytes_crc_self_test():
+    """
+    MINTransport._rx_bytes with CRC_SELF_TEST, every checksum is cross-checked with the bit by bit reference
+    """
+    transport = _transport()
+    data = b''.join(transport._on_wire_bytes(frame) for frame in _ranging_frames())
+    min.MINTransport.CRC_SELF_TEST = True
+
+    def run():
+        transport._rx_list = []
+        transport._rx_bytes(data)
+
+    try:
+        yield run, NUMBER_OF_FRAMES, 'frame'
+    finally:
+        min.MINTransport.CRC_SELF_TEST = False
+
+
+@contextmanager
+def rx_bytes_verbose():
+    """
+    MINTransport._rx_bytes with the 'min' Logger on DEBUG, the records go to a NullHandler
+    """
+    transport = _transport()
+    data = b''.join(transport._on_wire_bytes(frame) for frame in _ranging_frames())
+    logger = logging.getLogger('min')
+    handlers, level, propagate = logger.handlers, logger.level, logger.propagate
+    logger.handlers = [logging.NullHandler()]
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logs.refresh()
+
+    def run():
+        transport._rx_list = []
+        transport._rx_bytes(data)
+
+    try:
+        yield run, NUMBER_OF_FRAMES, 'frame'
+    finally:
+        logger.handlers, logger.propagate = handlers, propagate
+        logger.setLevel(level)
+        logs.refresh()
+
+
+@contextmanager
+def on_wire_bytes():
+    """
+    MINTransport._on_wire_bytes, encoding with byte stuffing, every fourth payload needs stuff bytes
+    """
+    transport = _transport()
+    frames = _ranging_frames()
+    for frame in frames[::4]:
+        frame.payload = b'\xaa\xaa' + frame.payload[2:]
+
+    def run():
+        for frame in frames:
+            transport._on_wire_bytes(frame)
+
+    yield run, NUMBER_OF_FRAMES, 'frame'
+
+
+@contextmanager
+def on_wire_bytes_reference():
+    """
+    MINTransport._on_wire_bytes_reference, the byte by byte encoder _on_wire_bytes replaced
+    """
+    transport = _transport()
+    frames = _ranging_frames()
+    for frame in frames[::4]:
+        frame.payload = b'\xaa\xaa' + frame.payload[2:]
+
+    def run():
+        for frame in frames:
+            transport._on_wire_bytes_reference(frame)
+
+    yield run, NUMBER_OF_FRAMES, 'frame'
+
+
+@contextmanager
+def send_ack():
+    """
+    MINTransport._send_ack, the periodic ACK of poll, the sequence number changes every 10 ACKs
+    """
+    transport = _transport()
+
+    def run():
+        for i in range(NUMBER_OF_FRAMES):
+            transport._rn = (i // 10) & 0xff
+            transport._send_ack()
+
+    yield run, NUMBER_OF_FRAMES, 'ack'
+
+
+@contextmanager
+def crc32():
+    """
+    MINTransport._crc32 of a Ranging Frame (id, length and 24 bytes payload)
+    """
+    data = bytearray(b'\x05\x18' + _ranging_payload(5))
+    checksum = min.MINTransport._crc32
+
+    def run():
+        for i in range(NUMBER_OF_FRAMES):
+            checksum(data)
+
+    yield run, NUMBER_OF_FRAMES, 'frame'
+
+
+@contextmanager
+def crc32_self_test():
+    """
+    MINTransport._crc32 with CRC_SELF_TEST, cross-checked with the bit by bit reference
+    """
+    data = bytearray(b'\x05\x18' + _ranging_payload(5))
+    checksum = min.MINTransport._crc32
+    min.MINTransport.CRC_SELF_TEST = True
+
+    def run():
+        for i in range(NUMBER_OF_FRAMES):
+            checksum(data)
+
+    try:
+        yield run, NUMBER_OF_FRAMES, 'frame'
+    finally:
+        min.MINTransport.CRC_SELF_TEST = False
+
+
+@contextmanager
+def serial_read_all_hex():
+    """
+    MINTransportSerial._serial_read_all parsing one ASCII hex line of the Initiator
+    """
+    line = _hex_line(_transport()._on_wire_bytes(_ranging_frames(1)[0]))
+    transport = _serial_transport(_StubSerial(line=line), binary=False)
+
+    yield transport._serial_read_all, 1, 'frame'
+
+
+@contextmanager
+def serial_read_all_binary():
+    """
+    MINTransportSerial._serial_read_all reading one raw MIN Frame
+    """
+    data = _transport()._on_wire_bytes(_ranging_frames(1)[0])
+    transport = _serial_transport(_StubSerial(data=data), binary=True)
+
+    yield transport._serial_read_all, 1, 'frame'
+
+
+def _pty_loopback(binary):
+    import tty
+
+    master, slave = os.openpty()
+    tty.setraw(master)
+    transport = min.MINTransportSerial(os.ttyname(slave), loglevel=None, binary=binary)
+    os.set_blocking(master, False)
+    frame = _transport()._on_wire_bytes(_ranging_frames(1)[0])
+    data = frame if binary else _hex_line(frame)
+
+    def run():
+        os.write(master, data)
+        while not transport.poll():
+            pass
+        # Drop the ACKs, the pty buffer must not fill up
+        try:
+            while os.read(master, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close():
+        transport.close()
+        os.close(master)
+        os.close(slave)
+
+    return run, close
+
+
+@contextmanager
+def pty_hex():
+    """
+    One Frame through a pseudo terminal into MINTransportSerial.poll, ASCII hex line protocol
+    """
+    run, close = _pty_loopback(binary=False)
+    try:
+        yield run, 1, 'frame'
+    finally:
+        close()
+
+
+@contextmanager
+def pty_binary():
+    """
+    One Frame through a pseudo terminal into MINTransportSerial.poll, raw MIN bytes (MIN_BINARY_FRAMING)
+    """
+    run, close = _pty_loopback(binary=True)
+    try:
+        yield run, 1, 'frame'
+    finally:
+        close()
+
+
+def _fix():
+    slots = np.arange(len(driving.ANCHORS), dtype=np.intp)
+    position = np.array([80., 200., 0.])
+    distances = np.linalg.norm(driving.ANCHORS.positions - position, axis=1)
+    return slots, distances
+
+
+@contextmanager
+def solve_lse():
+    """
+    listen._get_coordinates_on_distance with the localization package, one Fix on 7 Anchors
+    """
+    slots, distances = _fix()
+    stdout = sys.stdout
+    # The localization package prints every solve
+    sys.stdout = io.StringIO()
+    logs.configure(logs.QUIET)
+
+    def run():
+        listen._get_coordinates_on_distance(driving.ANCHORS, slots, distances, 'LSE')
+        sys.stdout.seek(0)
+        sys.stdout.truncate()
+
+    try:
+        yield run, 1, 'fix'
+    finally:
+        sys.stdout = stdout
+
+
+@contextmanager
+def solve_numpy():
+    """
+    Multilaterator.solve, one Fix on 7 Anchors with warm start
+    """
+    slots, distances = _fix()
+    multilaterator = listen._get_multilaterator(driving.ANCHORS)
+
+    def run():
+        multilaterator.solve(slots, distances)
+
+    yield run, 1, 'fix'
+
+
+@contextmanager
+def range_filter_accept():
+    """
+    RangeFilter.accept with a full window, the Ranges of all Anchors round robin
+    """
+    outlier_filter = range_filter.RangeFilter(driving.ANCHORS)
+    payloads = [struct.unpack(ranging.RANGING_FRAME_FORMAT, _ranging_payload(index))
+                for index in range(NUMBER_OF_FRAMES)]
+    ranges = [(source_addr, distance) for _, _, source_addr, distance, _ in payloads]
+    for source_addr, distance in ranges:
+        outlier_filter.accept(source_addr, distance, 0.0)
+
+    def run():
+        for source_addr, distance in ranges:
+            outlier_filter.accept(source_addr, distance, 0.0)
+
+    yield run, len(ranges), 'range'
+
+
+@contextmanager
+def reject_residuals():
+    """
+    RangeFilter.reject_residuals on a clean Fix on 7 Anchors, one trial solve
+    """
+    slots, distances = _fix()
+    outlier_filter = range_filter.RangeFilter(driving.ANCHORS)
+    multilaterator = listen._get_multilaterator(driving.ANCHORS)
+
+    def run():
+        outlier_filter.reject_residuals(multilaterator, slots, distances)
+
+    yield run, 1, 'fix'
+
+
+@contextmanager
+def kalman_update():
+    """
+    One predict and update of the Tracker with a new Fix
+    """
+    tracker = tracking.Tracker(process_variance=driving.process_variance())
+    clock = [0.0]
+
+    def run():
+        clock[0] += 0.1
+        tracker.update(80.0 + math.sin(clock[0]), 200.0, clock[0])
+
+    yield run, 1, 'update'
+
+
+@contextmanager
+def kalman_predict_to():
+    """
+    Tracker.predict_to, the Controller dead-reckons to every cycle
+    """
+    tracker = tracking.Tracker(process_variance=driving.process_variance())
+    tracker.update(80.0, 200.0, 0.0)
+    tracker.update(81.0, 201.0, 0.1)
+
+    def run():
+        tracker.predict_to(0.15)
+
+    yield run, 1, 'prediction'
+
+
+def _car():
+    scheduler = motor_scheduler.MotorScheduler(set_speed=lambda l, r: None)
+    car = car_controller.Car(driving.FINAL_POSITION[0], driving.FINAL_POSITION[1],
+                             driving.lukas_calibration_left_wheel, driving.lukas_calibration_right_wheel, False,
+                             scheduler=scheduler)
+    car.previous_pos_x = 20
+    car.previous_pos_y = 20
+    return car
+
+
+@contextmanager
+def pid2():
+    """
+    Car.PID2 decision with a Motor Scheduler, the Car is far from the Goal
+    """
+    car = _car()
+    positions = [(20 + i, 25 + 2 * i) for i in range(10)]
+
+    def run():
+        for x, y in positions:
+            car.PID2(x, y, acceptable_error=driving.MAX_ERROR_VALUE)
+
+    yield run, len(positions), 'decision'
+
+
+@contextmanager
+def steer():
+    """
+    Car.steer (heading PID) decision with a Motor Scheduler
+    """
+    car = _car()
+    positions = [(20 + i, 25 + 2 * i) for i in range(10)]
+
+    def run():
+        for x, y in positions:
+            car.steer(x, y, 1.1, driving.MAX_ERROR_VALUE, 0.05)
+
+    yield run, len(positions), 'decision'
+
+
+# Name and Context Manager of every Benchmark, in the order of the pipeline
+BENCHMARKS = [('min_rx_bytes', rx_bytes),
+              ('min_rx_bytes_reference', rx_bytes_reference),
+              ('min_rx_bytes_crc_self_test', rx_bytes_crc_self_test),
+              ('min_rx_bytes_verbose', rx_bytes_verbose),
+              ('min_on_wire_bytes', on_wire_bytes),
+              ('min_on_wire_bytes_reference', on_wire_bytes_reference),
+              ('min_send_ack', send_ack),
+              ('min_crc32', crc32),
+              ('min_crc32_self_test', crc32_self_test),
+              ('serial_read_all_hex', serial_read_all_hex),
+              ('serial_read_all_binary', serial_read_all_binary),
+              ('pty_poll_hex', pty_hex),
+              ('pty_poll_binary', pty_binary),
+              ('range_filter_accept', range_filter_accept),
+              ('range_filter_reject_residuals', reject_residuals),
+              ('solve_lse', solve_lse),
+              ('solve_numpy', solve_numpy),
+              ('kalman_update', kalman_update),
+              ('kalman_predict_to', kalman_predict_to),
+              ('car_pid2', pid2),
+              ('car_steer', steer)]
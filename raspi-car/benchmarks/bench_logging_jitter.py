@@ -0,0 +1,96 @@
+"""
+Wake-up jitter and cycle time of the Control Loop with verbose (logs.VERBOSE) against quiet (logs.QUIET) logging.
+The PeriodicLoop runs driving.control_step with PID2 at CONTROL_RATE, a sensing Thread decodes a Ranging Frame
+and publishes a new estimation at the Ranging Rate like the Ranging Reader. The records are written to os.devnull,
+so the cost is formatting and handling, not the terminal.
+Run from raspi-car/: python3 -m benchmarks.bench_logging_jitter
+"""
+
+import logging
+import os
+import time
+from threading import Event, Thread
+
+import driving
+from base_scripts import control_loop
+from base_scripts import logs
+from base_scripts import min
+from base_scripts import tracking
+from benchmarks import bench_hot_paths
+
+
+RANGING_RATE = 10       # Estimations per second
+DURATION = 10.0         # Seconds per Verbosity
+
+
+def sense(car, tracker, stop_event):
+    transport = bench_hot_paths._transport()
+    frames = [transport._on_wire_bytes(frame) for frame in bench_hot_paths._ranging_frames()]
+    index = 0
+    while not stop_event.wait(1.0 / RANGING_RATE):
+        transport._rx_list = []
+        transport._rx_bytes(frames[index % len(frames)])
+        state = tracker.update(20.0 + index, 25.0 + 2 * index, time.monotonic())
+        driving.publish_state(car, state)
+        index += 1
+
+
+def run(levels, duration=DURATION):
+    """
+    :param levels: Verbosity of logs.configure, e.g. logs.VERBOSE
+    :param duration: seconds of the Control Loop
+    :return: statistics of the PeriodicLoop and the CPU percent of the process
+    """
+    logs.configure(levels)
+    car = bench_hot_paths._car()
+    car.mode = 1
+    tracker = tracking.Tracker(process_variance=driving.process_variance('PID2'))
+    driving.publish_state(car, tracker.update(20.0, 25.0, time.monotonic()))
+    initialization = {'started': True}
+
+    stop_event = Event()
+    sensor = Thread(target=sense, args=(car, tracker, stop_event), name='Sensing')
+    loop = control_loop.PeriodicLoop(driving.CONTROL_RATE,
+                                     lambda now_ns: driving.control_step(car, tracker, now_ns, initialization,
+                                                                         steering='PID2'))
+    end = time.monotonic() + duration
+    cpu_start = time.process_time()
+    sensor.start()
+    loop.run(lambda: time.monotonic() >= end)
+    stop_event.set()
+    sensor.join()
+    result = loop.statistics()
+    result['cpu_percent'] = (time.process_time() - cpu_start) / duration * 100
+    return result
+
+
+def main(duration=DURATION):
+    # Write every record to os.devnull instead of the terminal, the min Logger has its own stdout handler
+    null_handler = logging.FileHandler(os.devnull)
+    loggers = [logging.getLogger(), logging.getLogger('min')]
+    handlers = [logger.handlers for logger in loggers]
+    levels = {name: logging.getLogger(name).level for name in logs.VERBOSE}
+    for logger in loggers:
+        logger.handlers = [null_handler]
+
+    results = {}
+    try:
+        for name, verbosity in [('quiet', logs.QUIET), ('verbose', logs.VERBOSE)]:
+            results[name] = run(verbosity, duration)
+    finally:
+        for logger, old_handlers in zip(loggers, handlers):
+            logger.handlers = old_handlers
+        for name, level in levels.items():
+            logging.getLogger(name).setLevel(level)
+        logs.refresh()
+        null_handler.close()
+
+    for name, result in results.items():
+        print('%-8s %d cycles, %d overruns, jitter p50 %d us p99 %d us max %d us, cycle p99 %d us, CPU %.1f %%'
+              % (name, result['cycles'], result['overruns'], result['jitter_p50_us'], result['jitter_p99_us'],
+                 result['jitter_max_us'], result['duration_p99_us'], result['cpu_percent']))
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Round trips to the pigpio daemon and time of base.set_speed against a stub pigpio.pi.
+The trace is a ramp up, a hold and a ramp down updated every 10 ms, like the ramps of Car.drive,
+every command to the stub costs ROUND_TRIP seconds like a call over the pigpio socket.
+Run from raspi-car/: python3 -m benchmarks.bench_motor_output
+"""
+
+import time
+
+from base_scripts import base
+
+
+ROUND_TRIP = 100e-6     # Seconds per pigpio command
+
+
+class StubPi:
+    """
+    Records the pigpio commands, busy waits ROUND_TRIP per command
+    """
+
+    def __init__(self, round_trip=ROUND_TRIP):
+        self.round_trip = round_trip
+        self.number_of_commands = 0
+
+    def _command(self):
+        self.number_of_commands += 1
+        end = time.perf_counter() + self.round_trip
+        while time.perf_counter() < end:
+            pass
+        return 0
+
+    def hardware_PWM(self, gpio, frequency, duty):
+        return self._command()
+
+    def store_script(self, script):
+        self._command()
+        return 0
+
+    def script_status(self, script_id):
+        self._command()
+        return 1, ()
+
+    def run_script(self, script_id, params=None):
+        return self._command()
+
+    def delete_script(self, script_id):
+        return self._command()
+
+
+def legacy_set_speed(pi, l, r):
+    """
+    The old base.set_speed, recomputes the constants and always sends both duty cycles
+    """
+    hertz = 50
+    r *= -1
+    l = max(-1.0, min(1.0, l))
+    r = max(-1.0, min(1.0, r))
+    full_duty_length = (1000.0/hertz)
+    min_duty_ratio = 1.0 / full_duty_length
+    max_duty_ratio = 2.0 / full_duty_length
+    duty_ratio_l = min_duty_ratio + (max_duty_ratio-min_duty_ratio)*(0.5*(l+1.0))
+    duty_ratio_r = min_duty_ratio + (max_duty_ratio-min_duty_ratio)*(0.5*(r+1.0))
+    pi.hardware_PWM(base.MotLeft, hertz, (int)(duty_ratio_l*1000000.0))
+    pi.hardware_PWM(base.MotRight, hertz, (int)(duty_ratio_r*1000000.0))
+
+
+def speed_trace(speed=0.3, hold_time=1.0, tick=0.01, repeats=10):
+    """
+    :return: list of (left, right) commands, one per tick
+    """
+    ramp = [x * 0.1 for x in range(0, int(speed * 10))]
+    trace = []
+    for i in range(repeats):
+        trace += [(s - 0.022, s + 0.015) for s in ramp]
+        trace += [(speed - 0.022, speed + 0.015)] * int(hold_time / tick)
+        trace += [(speed - s - 0.022, speed - s + 0.015) for s in ramp]
+        trace += [(0.0, 0.0)] * 10
+    return trace
+
+
+def main():
+    trace = speed_trace()
+    results = {}
+
+    pi = StubPi()
+    start = time.perf_counter()
+    for l, r in trace:
+        legacy_set_speed(pi, l, r)
+    results['legacy'] = (time.perf_counter() - start, pi.number_of_commands)
+
+    for name, use_script in [('dedupe', False), ('dedupe_script', True)]:
+        pi = StubPi()
+        output = base.MotorOutput(pi=pi, use_script=use_script)
+        pi.number_of_commands = 0
+        start = time.perf_counter()
+        for l, r in trace:
+            output.set_speed(l, r)
+        results[name] = (time.perf_counter() - start, pi.number_of_commands)
+
+    summary = {}
+    for name, (seconds, commands) in results.items():
+        summary[name] = {'calls': len(trace), 'pigpio_commands': commands,
+                         'us_per_call': seconds / len(trace) * 1e6}
+        print('%-14s %d calls, %d pigpio commands, %.1f us per call'
+              % (name, len(trace), commands, seconds / len(trace) * 1e6))
+    return summary
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Startup time of driving.py and cost of the first Position Fix, every measurement runs in a fresh Python process.
+driving imports the localization package lazily on the first LSE Fix and no longer imports pandas, the eager
+variants import them up front like the old listen.py did.
+Run from raspi-car/: python3 -m benchmarks.bench_startup
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+
+RUNS = 10                   # Processes per variant, the median is reported
+RASPI_CAR_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Modules imported before driving, none for the current startup path
+VARIANTS = [('lazy', []),
+            ('eager_localization', ['localization']),
+            ('eager_localization_pandas', ['localization', 'pandas'])]
+
+CHILD = '''
+import io, json, sys, time
+start = time.perf_counter()
+for module in %r:
+    __import__(module)
+import driving
+imported = time.perf_counter()
+from benchmarks import bench_hot_paths
+from base_scripts import listen
+slots, distances = bench_hot_paths._fix()
+stdout = sys.stdout
+# The localization package prints every solve
+sys.stdout = io.StringIO()
+fix_start = time.perf_counter()
+listen._get_coordinates_on_distance(driving.ANCHORS, slots, distances, 'LSE')
+first_fix = time.perf_counter() - fix_start
+fix_start = time.perf_counter()
+listen._get_coordinates_on_distance(driving.ANCHORS, slots, distances, 'LSE')
+second_fix = time.perf_counter() - fix_start
+sys.stdout = stdout
+print(json.dumps({'import_s': imported - start, 'first_fix_s': first_fix, 'second_fix_s': second_fix}))
+'''
+
+
+def _available(module):
+    return subprocess.run([sys.executable, '-c', 'import ' + module], capture_output=True).returncode == 0
+
+
+def run(modules, runs=RUNS):
+    """
+    :param modules: modules imported before driving
+    :param runs: number of processes
+    :return: dict with the median import time, time of the first and the second LSE Fix in milliseconds
+    """
+    samples = []
+    for i in range(runs):
+        completed = subprocess.run([sys.executable, '-c', CHILD % (modules,)], cwd=RASPI_CAR_DIRECTORY,
+                                   capture_output=True, text=True, check=True)
+        samples.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    return {'runs': runs,
+            'import_ms': float(np.median([sample['import_s'] for sample in samples])) * 1000,
+            'first_fix_ms': float(np.median([sample['first_fix_s'] for sample in samples])) * 1000,
+            'second_fix_ms': float(np.median([sample['second_fix_s'] for sample in samples])) * 1000}
+
+
+def main(runs=RUNS):
+    results = {}
+    for name, modules in VARIANTS:
+        missing = [module for module in modules if not _available(module)]
+        if missing:
+            print('%-26s skipped, %s not installed' % (name, ', '.join(missing)))
+            continue
+        result = run(modules, runs)
+        results[name] = result
+        print('%-26s import driving %6.1f ms, first LSE Fix %6.1f ms, second LSE Fix %6.1f ms'
+              % (name, result['import_ms'], result['first_fix_ms'], result['second_fix_ms']))
+    return results
+
+
+if __name__ == '__main__':
+    main()
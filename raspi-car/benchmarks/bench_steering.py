@@ -0,0 +1,72 @@
+"""
+Simulated drive to the Goal with the heading PID (Car.steer) and the old direction heuristic (Car.PID2).
+The Car drives in a simulation.World between the Anchors of driving.py, its Ranges go through the MIN decoder,
+the Localization, the Kalman Filter and the Controller of replay_driving.run like on the Car.
+Every run starts at START with a random heading, both Steerings drive on the same Ranges seed.
+Reports time-to-goal and path length.
+Run from raspi-car/: python3 -m benchmarks.bench_steering
+"""
+
+import math
+
+import numpy as np
+
+import driving
+import replay_driving
+from base_scripts import logs
+from base_scripts import simulation
+
+
+START = (20.0, 20.0)
+TIMEOUT = 120.0             # Seconds of simulated time
+SOLVER = 'NUMPY'            # The LSE Solver takes about 40 times longer per Fix
+
+# Errors of the Ranges, as in simulate_driving.py
+UWB_NOISE = 0.05            # Standard deviation in Meters
+NLOS_PROBABILITY = 0.02
+DROPOUT = 0.02
+
+
+def simulate(steering, seed, start=START):
+    """
+    :param steering: 'PID' or 'PID2'
+    :param seed: seed of the Ranges and the start heading
+    :param start: (x, y) of the Car in CentiMeters
+    :return: dict with reached, time_to_goal, path_length and final_error
+    """
+    heading = np.random.default_rng(seed).uniform(-math.pi, math.pi)
+    calibration = (driving.lukas_calibration_left_wheel, driving.lukas_calibration_right_wheel)
+    model = simulation.UWBModel(noise=UWB_NOISE, nlos_probability=NLOS_PROBABILITY, dropout=DROPOUT)
+    # The Motors have the offsets the Wheel Calibration compensates
+    world = simulation.World(driving.ANCHORS, start, heading, seed=seed, model=model,
+                             wheel_offset=(-calibration[0], -calibration[1]))
+    result = replay_driving.run(world=world, duration=TIMEOUT, solver=SOLVER, steering=steering,
+                                goal=driving.FINAL_POSITION, calibration=calibration)
+    return {'reached': result['reached_goal'], 'time_to_goal': result['time_to_goal'],
+            'path_length': world.path_length, 'final_error': world.distance_to(*driving.FINAL_POSITION)}
+
+
+def main(number_of_runs=20):
+    logs.configure(logs.QUIET)
+    results = {}
+    for steering in ['PID', 'PID2']:
+        runs = [simulate(steering, seed) for seed in range(number_of_runs)]
+        reached = [run for run in runs if run['reached']]
+        results[steering] = {
+            'runs': number_of_runs,
+            'reached': len(reached),
+            'time_to_goal_mean': float(np.mean([run['time_to_goal'] for run in reached])) if reached else None,
+            'path_length_mean': float(np.mean([run['path_length'] for run in reached])) if reached else None,
+            'final_error_mean': float(np.mean([run['final_error'] for run in reached])) if reached else None}
+        result = results[steering]
+        if reached:
+            print('%-5s reached %d of %d, time to goal %.1f s, path length %.0f cm, final error %.1f cm'
+                  % (steering, len(reached), number_of_runs, result['time_to_goal_mean'],
+                     result['path_length_mean'], result['final_error_mean']))
+        else:
+            print('%-5s reached 0 of %d' % (steering, number_of_runs))
+    return results
+
+
+if __name__ == '__main__':
+    main()
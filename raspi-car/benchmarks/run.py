@@ -0,0 +1,149 @@
+"""
+Runner of the Benchmark Suite, times every Benchmark of bench_hot_paths and writes the results as JSON.
+With a baseline JSON of an earlier run every Benchmark which got slower than the threshold is reported
+and the exit status is 1, e.g. to check a branch before it is deployed to the Cars.
+The scenario Benchmarks (bench_*.py with a main()) take longer, they are only run with --scenarios.
+Run from raspi-car/: python3 -m benchmarks.run [--output results.json] [--baseline old.json] [--filter min_]
+"""
+
+import argparse
+import datetime
+import importlib
+import json
+import platform
+import subprocess
+import sys
+import timeit
+
+from benchmarks import bench_hot_paths
+
+
+SCENARIOS = ['bench_distance_data', 'bench_motor_output', 'bench_steering', 'bench_drive_wakeup', 'bench_framing',
+             'bench_logging_jitter', 'bench_startup']
+REPEATS = 5
+MIN_TIME = 0.2              # Seconds per repeat
+THRESHOLD = 0.25            # A Benchmark regressed if its median is 25 % slower than the baseline
+
+
+def measure(function, items, repeats=REPEATS, min_time=MIN_TIME):
+    """
+    :param function: function to time, called without arguments
+    :param items: number of items one call handles
+    :param repeats: number of timed repeats, the median and the minimum are reported
+    :param min_time: seconds per repeat, the number of calls is calibrated to it
+    :return: dict with the time per item in nanoseconds and the items per second
+    """
+    timer = timeit.Timer(function)
+    number, seconds = timer.autorange()
+    number = max(1, int(number * min_time / seconds)) if seconds > 0 else number
+    times = sorted(seconds / (number * items) for seconds in timer.repeat(repeats, number))
+    median = times[len(times) // 2]
+    return {'median_ns': median * 1e9,
+            'min_ns': times[0] * 1e9,
+            'max_ns': times[-1] * 1e9,
+            'items_per_second': 1.0 / median,
+            'calls_per_repeat': number,
+            'items_per_call': items,
+            'repeats': repeats}
+
+
+def run_benchmarks(name_filter=None, repeats=REPEATS, min_time=MIN_TIME):
+    """
+    :param name_filter: only run Benchmarks whose name contains this, all if None
+    :return: dict {name: result of measure}
+    """
+    results = {}
+    for name, benchmark in bench_hot_paths.BENCHMARKS:
+        if name_filter is not None and name_filter not in name:
+            continue
+        try:
+            with benchmark() as (function, items, unit):
+                result = measure(function, items, repeats, min_time)
+        except Exception as e:
+            # E.g. no pseudo terminals, the other Benchmarks still run
+            print('%-26s failed: %s' % (name, e))
+            results[name] = {'error': str(e)}
+            continue
+        result['unit'] = unit
+        results[name] = result
+        print('%-26s %12.2f us per %-10s %12.0f per second' % (name, result['median_ns'] / 1000, unit,
+                                                                result['items_per_second']))
+    return results
+
+
+def run_scenarios():
+    """
+    :return: dict {module name: return value of its main()}
+    """
+    results = {}
+    for name in SCENARIOS:
+        print('--- %s' % name)
+        module = importlib.import_module('benchmarks.' + name)
+        results[name] = module.main()
+    return results
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """
+    :param results: benchmarks of this run
+    :param baseline: benchmarks of the baseline run
+    :param threshold: relative slow down which counts as regression
+    :return: list of (name, baseline ns, current ns) of the regressed Benchmarks
+    """
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old is None or 'median_ns' not in old or 'median_ns' not in result:
+            continue
+        change = result['median_ns'] / old['median_ns'] - 1.0
+        print('%-26s %+7.1f %%' % (name, change * 100))
+        if change > threshold:
+            regressions.append((name, old['median_ns'], result['median_ns']))
+    return regressions
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of the raspi-car hot paths')
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON file for the results')
+    parser.add_argument('--baseline', help='JSON file of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help='relative slow down that fails')
+    parser.add_argument('--filter', help='only run Benchmarks whose name contains this')
+    parser.add_argument('--repeats', type=int, default=REPEATS)
+    parser.add_argument('--min-time', type=float, default=MIN_TIME, help='seconds per repeat')
+    parser.add_argument('--scenarios', action='store_true', help='also run the scenario Benchmarks')
+    args = parser.parse_args(argv)
+
+    report = {'date': datetime.datetime.now().isoformat(timespec='seconds'),
+              'commit': _git_commit(),
+              'python': platform.python_version(),
+              'machine': platform.machine(),
+              'platform': platform.platform(),
+              'benchmarks': run_benchmarks(args.filter, args.repeats, args.min_time)}
+    if args.scenarios:
+        report['scenarios'] = run_scenarios()
+
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2, default=float)
+    print('Wrote %s' % args.output)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = compare(report['benchmarks'], baseline['benchmarks'], args.threshold)
+        for name, old, new in regressions:
+            print('Regression: %s %.2f us -> %.2f us' % (name, old / 1000, new / 1000))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
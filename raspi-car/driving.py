@@ -1,12 +1,18 @@
+import math
 import numpy as np
-import logging
 import time
 from threading import Lock, Thread
-from filterpy.kalman import KalmanFilter
-from filterpy.common import Q_discrete_white_noise
 
+from base_scripts import anchors
 from base_scripts import car_controller
+from base_scripts import control_loop
 from base_scripts import listen
+from base_scripts import logs
+from base_scripts import motor_scheduler
+from base_scripts import range_filter
+from base_scripts import ranging
+from base_scripts import tracing
+from base_scripts import tracking
 
 
 
@@ -15,6 +21,29 @@ NUMBER_OF_DISTANCES_PER_ANCHOR = 1
 MAX_ERROR_VALUE = 20    # In CM total Distance
 READINGS_FOR_INITIALIZATION = 5
 USE_KALMAN_FILTER = True
+PROCESS_VARIANCE = 0.13     # Acceleration variance of the Kalman Filter
+PID_PROCESS_VARIANCE = 10.0 # Acceleration variance with STEERING 'PID', high enough for the filter heading to follow turns
+PREDICT_POSITION = True     # Drive with the Position predicted to now instead of the Position of the last Fix
+MIN_HEADING_SPEED = 2.0     # In CM per Second, below the heading from the filter velocity is unknown
+FUSE_SINGLE_RANGES = False  # After the first Fix the Kalman Filter is updated with every single Range (needs the Ranging Reader)
+MAX_GATED_RANGES = 7        # While fusing, if the gate rejected this many of the last 14 Ranges the Filter is re-seeded by a Fix
+SOLVER = 'LSE'              # 'LSE' for the localization package, 'NUMPY' for the built-in Gauss-Newton Solver
+LOG_LEVELS = logs.DEFAULT    # Verbosity per Subsystem, logs.QUIET for the least overhead, logs.VERBOSE for debugging
+USE_RANGING_READER = True   # Read the Ranges in a Background Thread
+MAX_RANGE_AGE = 1.0         # In Seconds, older Ranges are not used for a Position Fix
+
+FILTER_RANGES = True        # Drop NLOS spikes and Anchors with a large residual (needs the Ranging Reader)
+CALIBRATE_RANGES = False    # Correct the Ranges with range_filter.DEFAULT_CALIBRATION, fitted on the calibrated_uwb datasets
+
+USE_MOTOR_SCHEDULER = True  # Ramp the Motors in a Background Thread, the driving Thread does not sleep
+MOTOR_TICK = 0.02           # In Seconds, update interval of the Motor Scheduler
+USE_CONTROL_LOOP = True     # Steer at CONTROL_RATE on the predicted Pose instead of once per estimation (needs the Motor Scheduler)
+CONTROL_RATE = 20           # In Hz
+STEERING = 'PID'            # 'PID' for the heading PID on the filter heading, 'PID2' for the old direction heuristic
+
+TRACING = False             # Time every Stage from the Serial Port to the Motors, kill -USR1 <pid> logs p50/p95/p99
+TRACE_CAPACITY = 100000     # Number of Spans kept for the Chrome Trace, 0 to only keep the Histograms
+TRACE_FILE = 'driving_trace.json'  # Chrome Trace written at the end and on SIGUSR1, None for none
 
 FINAL_POSITION = (80, 200) # (X, Y)
 
@@ -28,109 +57,239 @@ lukas_responder_locations = [{8196: (-30, 20, 0)}, {8194: (340, 44, 0)},
                              {8193: (0, 0, 32)}, {8198: (102, 0, 19)},
                              {8199: (-18, 200, 18)}]
 
+# Slots and Positions of the Anchors in use, built once
+ANCHORS = anchors.AnchorRegistry(lukas_responder_locations)
+
 lukas_calibration_left_wheel = -0.022
 lukas_calibration_right_wheel = +0.015
 
 birkan_calibration_left_wheel = 0.0
 birkan_calibration_right_wheel = 0.02
 
-def main():
-    logging.basicConfig(level='DEBUG')
+log = logs.get_logger('driving')
 
-    rpi_car = car_controller.Car(FINAL_POSITION[0], FINAL_POSITION[1], lukas_calibration_left_wheel, lukas_calibration_right_wheel, False)
 
-    thread_sense = Thread(target=sense, args=(rpi_car,))
-    logging.info('Created a thread for location estimation')
-    thread_drive = Thread(target=drive, args=(rpi_car,))
-    logging.info('Created a thread for car movement')
+def main():
+    logs.configure(LOG_LEVELS)
+    if TRACING:
+        tracing.configure(trace_capacity=TRACE_CAPACITY)
+        tracing.install_signal_handler(TRACE_FILE)
+
+    scheduler = None
+    if USE_MOTOR_SCHEDULER:
+        scheduler = motor_scheduler.MotorScheduler(tick=MOTOR_TICK)
+        scheduler.start()
+        log.info('Started the motor scheduler')
+
+    rpi_car = car_controller.Car(FINAL_POSITION[0], FINAL_POSITION[1], lukas_calibration_left_wheel, lukas_calibration_right_wheel, False,
+                                 scheduler=scheduler)
+
+    # Constant velocity Kalman Filter, updated by sense and read by drive
+    if FUSE_SINGLE_RANGES:
+        tracker = tracking.RangeTracker(process_variance=process_variance(), measurement_variance=5., initial_variance=1000.)
+    else:
+        tracker = tracking.Tracker(process_variance=process_variance(), measurement_variance=5., initial_variance=1000.)
+
+    thread_sense = Thread(target=sense, args=(rpi_car, tracker))
+    log.info('Created a thread for location estimation')
+    if USE_CONTROL_LOOP and USE_MOTOR_SCHEDULER:
+        thread_drive = Thread(target=control, args=(rpi_car, tracker))
+    else:
+        thread_drive = Thread(target=drive, args=(rpi_car, tracker))
+    log.info('Created a thread for car movement')
     thread_sense.start()
-    logging.info('Started the thread for location estimation')
+    log.info('Started the thread for location estimation')
     thread_drive.start()
-    logging.info('Started the thread for car movement')
+    log.info('Started the thread for car movement')
+
+
+def process_variance(steering=None):
+    """
+    The heading PID steers on the heading of the filter velocity, PID2 on the positions and keeps the old tuning
+    :param steering: 'PID' or 'PID2', STEERING if None
+    :return: acceleration variance of the Kalman Filter
+    """
+    if steering is None:
+        steering = STEERING
+    return PID_PROCESS_VARIANCE if steering == 'PID' else PROCESS_VARIANCE
+
+
+def create_range_filter(registry=ANCHORS):
+    """
+    :param registry: AnchorRegistry of the Anchors in use
+    :return: RangeFilter as configured by FILTER_RANGES and CALIBRATE_RANGES, None if FILTER_RANGES is off
+    """
+    if not FILTER_RANGES:
+        return None
+    calibration = range_filter.DEFAULT_CALIBRATION if CALIBRATE_RANGES else None
+    return range_filter.RangeFilter(registry, calibration=calibration)
 
 
-def sense(rpi_car):
+def sense(rpi_car, tracker, session=None, reader=None, registry=ANCHORS, solver=None, clock=time.monotonic,
+          until=None):
     """
     Calculates the current position estimation by
         Reading sensor data, 
         Applying localisation,
         And then passing it through Kalman filter.
+    The Replay passes its own Session, Reader and Clock, see replay_driving.py.
+    :param rpi_car: Car
+    :param tracker: Tracker or RangeTracker
+    :param session: MINSession, the Serial Port listen.MIN_PORT is opened for the whole run if None
+    :param reader: RangingReader on the Session, the caller starts and stops it, one is created if None
+    :param registry: AnchorRegistry of the Anchors in use
+    :param solver: 'LSE' or 'NUMPY', SOLVER if None
+    :param clock: time.monotonic() or the Clock of a Replay, timestamps the Ranges and the Fixes
+    :param until: callable, sensing stops when it returns True, rpi_car.get_is_reached_destination if None
     """
-    
-    #  First construct the filter with the required dimensionality
-    # 2 dimensional position (x,y) and 2 dimensional velocity (vx, vy)
-    # Warning: dim_x cannot be bigger than 4 as Q_discrete_white_noise only works for dim_x values between 2-4
-    filter = KalmanFilter(dim_x=4, dim_z=2)
-
-    # Assign the initial value for the state (position and velocity)
-    filter.x = np.array([[0.],
-                         [0.],
-                         [0],
-                         [0]])
-
-    # Define the state transition matrix
-    filter.F = np.array([[1., 0., 1., 0.],
-                         [0., 1., 0., 1.],
-                         [0., 0., 1., 0.],
-                         [0., 0., 0., 1.]])
-
-    # Define the measurement function
-    filter.H = np.array([[1., 0., 0., 0.],
-                         [0., 1., 0., 0.]])
-
-    # Define the covariance matrix
-    filter.P *= 1000.
-    # filter.P = np.array([[1000.,    0.],
-    #                    [   0., 1000.] ])
-
-    # Assign the measurement noise. Here the dimension is 1x1, a scalar is used
-    # This must be a 2 dimensional array, as must all the matrices.
-    # state uncertainty
-    filter.R = 5
-    # filter.R = np.array([[5.]])
-
-    # Assign the process noise
-    # process uncertainty
-    filter.Q = Q_discrete_white_noise(dim=4, dt=0.1, var=0.13)
-
-    while not rpi_car.get_is_reached_destination():
+    if session is None:
+        # Keep the Serial Port open for the whole run
+        with ranging.MINSession(port=listen.MIN_PORT, binary=listen.MIN_BINARY_FRAMING) as session:
+            return sense(rpi_car, tracker, session, reader, registry, solver, clock, until)
+
+    if solver is None:
+        solver = SOLVER
+    if until is None:
+        until = rpi_car.get_is_reached_destination
+    own_reader = reader is None
+    if own_reader:
+        table = ranging.RangeTable(registry=registry, range_filter=create_range_filter(registry))
+        reader = ranging.RangingReader(session, table, clock=clock)
+        if USE_RANGING_READER:
+            reader.start()
+    outlier_filter = reader.table.range_filter
+    sequence = 0
+    fix_sequence = 0
+    fusing_ranges = False
+    fuse_listener = None
+    reseed = False
+
+    while not until():
         start = time.time_ns() 
 
-        target_position = listen.get_coordinates(number_of_nodes=NUMBER_OF_NODES,
-                                                 iter_counter=NUMBER_OF_DISTANCES_PER_ANCHOR,
-                                                 responder_locations=lukas_responder_locations)
-        print(target_position)
+        if fusing_ranges:
+            # The Reader Thread updates the Kalman Filter and publishes the estimation with every Range
+            sequence = reader.table.wait_for_update(sequence, timeout=1.0)
+            if tracker.recent_rejected_ranges() >= MAX_GATED_RANGES:
+                # The Filter drifted away and the gate rejects most Ranges, solve a Fix on the next Ranges
+                log.warning('Sensing: %d of the last Ranges rejected, re-seeding the Filter with a Position Fix',
+                            tracker.recent_rejected_ranges())
+                reader.remove_listener(fuse_listener)
+                fusing_ranges = False
+                fix_sequence = sequence
+                reseed = True
+            continue
+
+        if USE_RANGING_READER:
+            # Wait for the next Range, then solve once every Anchor has a Range newer than the last Fix.
+            # Every Range is used in one Fix only, the Kalman Filter gets independent Measurements
+            sequence = reader.table.wait_for_update(sequence, timeout=1.0)
+            target_position = listen.get_coordinates_from_table(reader.table,
+                                                                number_of_nodes=NUMBER_OF_NODES,
+                                                                responder_locations=registry,
+                                                                max_age=MAX_RANGE_AGE,
+                                                                solver=solver,
+                                                                range_filter=outlier_filter,
+                                                                now=clock(),
+                                                                newer_than=fix_sequence,
+                                                                up_to=sequence)
+            if target_position is not None:
+                fix_sequence = sequence
+        else:
+            target_position = listen.get_coordinates(number_of_nodes=NUMBER_OF_NODES,
+                                                     iter_counter=NUMBER_OF_DISTANCES_PER_ANCHOR,
+                                                     responder_locations=registry,
+                                                     session=session,
+                                                     solver=solver)
+        if target_position is None:
+            continue
+        timestamp = clock()
+        log.debug('Sensing: Position %s', target_position)
         coordinates = [target_position.__dict__['x'], target_position.__dict__['y']]
 
         if(USE_KALMAN_FILTER):
-            filter.predict()
-            filter.update(coordinates)
-
-            # filter.x includes (x,y,vx,vy) estimates
-            estimate_pos_x = filter.x.tolist()[0][0]
-            estimate_pos_y = filter.x.tolist()[1][0]
-
-            rpi_car.set_current_estimation_x_y(estimate_pos_x, estimate_pos_y)
-            logging.info('Sensing: New position estimation(x,y): (%d, %d)' % (estimate_pos_x, estimate_pos_y))
+            if reseed:
+                # Forget the drifted State, the Fix initializes the Filter again
+                tracker.reset()
+                reseed = False
+            # F and Q are built from the time since the last Fix
+            state = tracker.update(coordinates[0], coordinates[1], timestamp)
+
+            # state.x includes (x,y,vx,vy) estimates
+            estimate_pos_x = state.x[0]
+            estimate_pos_y = state.x[1]
+
+            publish_state(rpi_car, state)
+            log.info('Sensing: New position estimation(x,y): (%d, %d)', estimate_pos_x, estimate_pos_y)
+
+            if FUSE_SINGLE_RANGES and USE_RANGING_READER:
+                # The first Fix initialized the Filter, from now on every Range updates it
+                fuse_listener = lambda record: fuse_range(tracker, record, registry, rpi_car)
+                reader.add_listener(fuse_listener)
+                fusing_ranges = True
+                log.info('Sensing: Fusing single Ranges from now on')
         else:
             rpi_car.set_current_estimation_x_y(target_position.__dict__['x'], target_position.__dict__['y'])
-            logging.info('Sensing: New position estimation(x,y): (%d, %d)' % (target_position.__dict__['x'], target_position.__dict__['y']))
+            log.info('Sensing: New position estimation(x,y): (%d, %d)', target_position.__dict__['x'], target_position.__dict__['y'])
 
         end = time.time_ns() 
-        logging.info('Sensing: It took %d miliseconds for sensor sensing' % ((end - start)/1000000))
+        log.info('Sensing: It took %d miliseconds for sensor sensing', (end - start)/1000000)
+
+    if own_reader:
+        reader.stop()
+
+def publish_state(rpi_car, state):
+    """
+    Publishes the State of the Kalman Filter as Pose of the Car
+    :param rpi_car: Car
+    :param state: TrackState
+    """
+    x, y, vx, vy = state.x
+    heading = None
+    if vx * vx + vy * vy >= MIN_HEADING_SPEED * MIN_HEADING_SPEED:
+        heading = math.atan2(vy, vx)
+    rpi_car.publish_pose(x, y, heading=heading, covariance=state.P[:2, :2], velocity=(vx, vy), timestamp=state.timestamp)
 
-def drive(rpi_car):
+
+def fuse_range(tracker, record, registry=ANCHORS, rpi_car=None):
+    """
+    Updates the Kalman Filter with a single Range, called by the Ranging Reader for every Frame.
+    The estimation is published right here, the Table already woke up the sensing Thread before the listeners ran.
+    :param tracker: RangeTracker, initialized by a Position Fix
+    :param record: RangeRecord of an Anchor in registry
+    :param registry: AnchorRegistry of the Anchors in use
+    :param rpi_car: Car to publish the new estimation to, None to only update the Filter
+    """
+    slot = registry.slot(record.source_addr)
+    if slot is None:
+        return
+    state = tracker.update_range(registry.positions[slot], record.distance_bias * 100, record.timestamp)
+    if state is not None and rpi_car is not None:
+        publish_state(rpi_car, state)
+        log.debug('Sensing: New position estimation(x,y): (%d, %d)', state.x[0], state.x[1])
+
+
+def drive(rpi_car, tracker):
 
     local_number_of_estimations = 0
+    last_steering = None
 
     while not rpi_car.get_is_reached_destination():
 
-        if (local_number_of_estimations < rpi_car.get_number_of_estimations()):
-            logging.info('Driving: New data received!')
+        # Sleep until the sensing Thread publishes a new estimation
+        number_of_estimations = rpi_car.wait_for_estimation(local_number_of_estimations, timeout=1.0)
+
+        if (local_number_of_estimations < number_of_estimations):
+            log.info('Driving: New data received!')
 
             local_number_of_estimations += 1
-            local_estimation_x = rpi_car.get_current_estimation_x()
-            local_estimation_y = rpi_car.get_current_estimation_y()
+            # x and y of the same estimation, read without a Lock
+            pose = rpi_car.get_pose()
+            local_estimation_x = pose.x
+            local_estimation_y = pose.y
+            if USE_KALMAN_FILTER and PREDICT_POSITION:
+                # Dead-reckon from the last Fix to now
+                local_estimation_x, local_estimation_y, vx, vy = tracker.predict_to(time.monotonic())
 
             # stationary estimation mode
             if rpi_car.mode == 0:
@@ -139,27 +298,122 @@ def drive(rpi_car):
                 if local_number_of_estimations == READINGS_FOR_INITIALIZATION:
                     rpi_car.previous_pos_x = local_estimation_x
                     rpi_car.previous_pos_y = local_estimation_y
-                    logging.info('Driving: first_init_pos_estimation(x,y): (%d, %d)' % (local_estimation_x, local_estimation_y))
+                    log.info('Driving: first_init_pos_estimation(x,y): (%d, %d)', local_estimation_x, local_estimation_y)
                     rpi_car.drive(speed=0.3, hold_time=1, change=0)
 
                 # estimate new position after going forward with 10 new readings
                 #  and set continuous driving mode
                 elif local_number_of_estimations == READINGS_FOR_INITIALIZATION*2:
                     rpi_car.mode = 1
-                    logging.info('Driving: second_init_pos_estimation(x,y): (%d, %d)' % (local_estimation_x, local_estimation_y))
-                    logging.info('Driving: Initialization Done, turn into Drive Mode')
+                    log.info('Driving: second_init_pos_estimation(x,y): (%d, %d)', local_estimation_x, local_estimation_y)
+                    log.info('Driving: Initialization Done, turn into Drive Mode')
 
             # continous estimation and driving mode
             elif rpi_car.mode == 1:
-                logging.info('Driving: pos_estimation(x,y): (%d, %d)' %(local_estimation_x, local_estimation_y))
-                if rpi_car.PID2(local_estimation_x, local_estimation_y, acceptable_error=MAX_ERROR_VALUE):
-                    logging.info('Driving: Arrived at Final Possition!')
+                log.info('Driving: pos_estimation(x,y): (%d, %d)', local_estimation_x, local_estimation_y)
+                now = time.monotonic()
+                start = tracing.begin()
+                if STEERING == 'PID':
+                    reached = rpi_car.steer(local_estimation_x, local_estimation_y, pose.heading, MAX_ERROR_VALUE,
+                                            now - last_steering if last_steering is not None else 0.1)
+                else:
+                    reached = rpi_car.PID2(local_estimation_x, local_estimation_y, acceptable_error=MAX_ERROR_VALUE)
+                tracing.end(tracing.CONTROL, start)
+                last_steering = now
+                if reached:
+                    log.info('Driving: Arrived at Final Possition!')
                     rpi_car.set_is_reached_destination()
             
         #else:
         #    logging.info('Driving: No new data received!')
 
+    if rpi_car.scheduler is not None:
+        # Stops the Motors as well
+        rpi_car.scheduler.stop()
+    dump_trace()
+
+
+
+def control_step(rpi_car, tracker, now_ns, initialization, steering=None):
+    """
+    One cycle of control, steers on the Pose predicted to now_ns
+    :param rpi_car: Car with a Motor Scheduler
+    :param tracker: Tracker of the sensing
+    :param now_ns: time.monotonic_ns() of the start of the cycle
+    :param initialization: dict kept between the cycles, {'started': False} before the first one
+    :param steering: 'PID' or 'PID2', STEERING if None. PID2 takes its direction from two successive estimations
+        and holds every turn, it only steers once per new estimation instead of every cycle
+    :return: monotonic_ns of the estimation the cycle acted on, None if it did not steer
+    """
+    if steering is None:
+        steering = STEERING
+
+    pose = rpi_car.get_pose()
+    if pose.seq == 0:
+        return None
+
+    # stationary estimation mode, drive forward once to get a first direction
+    if rpi_car.mode == 0:
+        if not initialization['started'] and pose.seq >= READINGS_FOR_INITIALIZATION:
+            initialization['started'] = True
+            rpi_car.previous_pos_x = pose.x
+            rpi_car.previous_pos_y = pose.y
+            log.info('Control: first_init_pos_estimation(x,y): (%d, %d)', pose.x, pose.y)
+            rpi_car.drive(speed=0.3, hold_time=1, change=0)
+        elif pose.seq >= READINGS_FOR_INITIALIZATION*2:
+            rpi_car.mode = 1
+            log.info('Control: Initialization Done, turn into Drive Mode')
+        return None
+
+    if steering != 'PID':
+        if pose.seq == initialization.get('steered_seq'):
+            return None
+        initialization['steered_seq'] = pose.seq
+
+    estimation_x = pose.x
+    estimation_y = pose.y
+    if USE_KALMAN_FILTER and PREDICT_POSITION:
+        estimation_x, estimation_y, vx, vy = tracker.predict_to(now_ns / 1e9)
+    start = tracing.begin()
+    if steering == 'PID':
+        reached = rpi_car.steer(estimation_x, estimation_y, pose.heading, MAX_ERROR_VALUE, 1.0 / CONTROL_RATE)
+    else:
+        reached = rpi_car.PID2(estimation_x, estimation_y, acceptable_error=MAX_ERROR_VALUE)
+    tracing.end(tracing.CONTROL, start)
+    if reached:
+        log.info('Control: Arrived at Final Possition!')
+        rpi_car.set_is_reached_destination()
+    # Sense-to-actuate latency from the time of the estimation
+    return int(pose.timestamp * 1e9)
+
+
+def control(rpi_car, tracker):
+    """
+    Fixed rate alternative to drive, steers with STEERING ('PID' or 'PID2') every cycle on the Pose predicted to the
+    start of the cycle. The Motor Scheduler keeps the Controller from blocking, the timing of every cycle is recorded
+    by the PeriodicLoop.
+    """
+    initialization = {'started': False}
+
+    loop = control_loop.PeriodicLoop(CONTROL_RATE, lambda now_ns: control_step(rpi_car, tracker, now_ns, initialization))
+    loop.run(rpi_car.get_is_reached_destination, log_every=CONTROL_RATE * 10)
+
+    if rpi_car.scheduler is not None:
+        rpi_car.scheduler.stop()
+    dump_trace()
+
+
+def dump_trace():
+    """
+    Logs the time of every Stage and writes the Chrome Trace to TRACE_FILE
+    """
+    tracer = tracing.get_tracer()
+    if not tracer.enabled:
+        return
+    tracer.log_statistics()
+    if TRACE_FILE is not None and tracer.trace_capacity:
+        tracer.export_chrome_trace(TRACE_FILE)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
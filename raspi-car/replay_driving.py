@@ -0,0 +1,205 @@
+"""
+Replays a Recording through the Localization and the Controller of driving.py on a virtual Clock.
+driving.sense runs on a ReplaySession with a RangingReader like on the Car: the Frames are MIN decoded by a
+ReplayTransport, stored in a RangeTable, solved and filtered by the Kalman Filter. While sense waits for the next
+Range the Replay advances the Clock and runs driving.control_step and the Motor Scheduler at their rates,
+the Wheel Speeds go through base.set_speed to a StubOutput.
+Without a Recording a synthetic drive of 10 minutes from START to driving.FINAL_POSITION is replayed.
+Reports Fixes per second and the time of every Tracing Stage.
+Run from raspi-car/: python3 replay_driving.py [recording.csv [solver]]
+"""
+
+import sys
+import time
+
+import driving
+from base_scripts import base
+from base_scripts import car_controller
+from base_scripts import control_loop
+from base_scripts import logs
+from base_scripts import motor_scheduler
+from base_scripts import ranging
+from base_scripts import replay
+from base_scripts import tracing
+from base_scripts import tracking
+
+
+START = (20, 20)            # (X, Y) of the synthetic drive
+SYNTHETIC_DURATION = 600.0  # In Seconds
+SYNTHETIC_SPEED = 1.0       # In CM per Second
+SYNTHETIC_NOISE = 0.05      # Standard deviation of the Distances in Meters
+SOLVER = 'NUMPY'            # 'LSE' replays like driving.SOLVER but takes about 17 ms per Fix instead of 0.4 ms
+
+log = logs.get_logger('driving')
+
+
+def run(frames=(), solver=None, stop_at_goal=True, world=None, duration=None, steering=None, registry=None,
+        goal=None, calibration=None):
+    """
+    Replays the Frames through sense and control as driving.main wires them with the Ranging Reader and the Control Loop
+    :param frames: list of RangeFrames sorted by timestamp
+    :param solver: 'LSE' or 'NUMPY', driving.SOLVER if None
+    :param stop_at_goal: stop the Replay when the Controller reached the Goal, like driving.sense
+    :param world: simulation.World, its Ranges follow the Wheel Speeds instead of a Recording
+    :param duration: in Seconds, end of the Replay after the first Frame, the last Frame if None
+    :param steering: 'PID' or 'PID2', driving.STEERING if None
+    :param registry: AnchorRegistry, driving.ANCHORS if None
+    :param goal: (x, y) of the Goal, driving.FINAL_POSITION if None
+    :param calibration: (left, right) Wheel Calibration, the one of lukas if None
+    :return: dict with the Fixes, the virtual and the wall time and the time of every Tracing Stage in microseconds
+    """
+    if solver is None:
+        solver = driving.SOLVER
+    if registry is None:
+        registry = driving.ANCHORS
+    if goal is None:
+        goal = driving.FINAL_POSITION
+    if calibration is None:
+        calibration = (driving.lukas_calibration_left_wheel, driving.lukas_calibration_right_wheel)
+    if not frames and world is None:
+        raise ValueError('Nothing to replay')
+    if not driving.USE_RANGING_READER:
+        raise ValueError('The Replay feeds the Ranges through the Ranging Reader, set driving.USE_RANGING_READER')
+
+    clock = replay.VirtualClock(frames[0].timestamp if frames else 0.0)
+    start_time = clock.now
+    end = clock.now + duration if duration is not None else frames[-1].timestamp
+    output = world.output if world is not None else replay.StubOutput(clock)
+
+    session = replay.ReplaySession(clock)
+    transport = session.transport
+    for frame in frames:
+        transport.feed_frame(frame)
+
+    scheduler = motor_scheduler.MotorScheduler(tick=driving.MOTOR_TICK)
+    rpi_car = car_controller.Car(goal[0], goal[1], calibration[0], calibration[1], False, scheduler=scheduler)
+    if driving.FUSE_SINGLE_RANGES:
+        tracker = tracking.RangeTracker(process_variance=driving.process_variance(steering), measurement_variance=5.,
+                                        initial_variance=1000.)
+    else:
+        tracker = tracking.Tracker(process_variance=driving.process_variance(steering), measurement_variance=5.,
+                                   initial_variance=1000.)
+    initialization = {'started': False}
+
+    # Virtual sense-to-actuate latency, age of the estimation used by the Controller, up to 5 s
+    latency = control_loop.Histogram(1000, 5000)
+    control_period = 1.0 / driving.CONTROL_RATE
+    next_control = clock.now
+    next_tick = clock.now
+    reached_time = None
+
+    def finished():
+        return clock.now >= end or (stop_at_goal and reached_time is not None)
+
+    def run_until(condition, timeout):
+        """
+        Runs the Ranging Reader, the Control Loop and the Motor Scheduler on the virtual Clock while sense waits
+        :param condition: returns True when sense has a new Range
+        :param timeout: seconds on the virtual Clock, until the end of the Replay if None
+        """
+        nonlocal next_control, next_tick, reached_time
+        deadline = end if timeout is None else min(clock.now + timeout, end)
+        while True:
+            if world is not None:
+                world.step(clock.now, transport)
+
+            next_frame = transport.next_timestamp()
+            if next_frame is not None and next_frame <= clock.now:
+                reader.read_frames()
+                if condition():
+                    # sense solves on the new Ranges before the Controller runs at the same time
+                    return
+
+            if clock.now >= next_control:
+                now_ns = clock.monotonic_ns()
+                measurement_ns = driving.control_step(rpi_car, tracker, now_ns, initialization, steering=steering)
+                if measurement_ns is not None:
+                    latency.record((now_ns - measurement_ns) / 1000)
+                next_control += control_period
+
+            if clock.now >= next_tick:
+                scheduler.step(clock.now)
+                next_tick += scheduler.tick
+
+            if reached_time is None and rpi_car.get_is_reached_destination():
+                reached_time = clock.now
+            if condition() or finished() or clock.now >= deadline:
+                return
+
+            # Jump to the next event instead of sleeping
+            next_event = min(next_control, next_tick, deadline)
+            next_frame = transport.next_timestamp()
+            if next_frame is not None and next_frame < next_event:
+                next_event = next_frame
+            if world is not None and world.next_timestamp() < next_event:
+                next_event = world.next_timestamp()
+            clock.advance_to(next_event)
+
+    table = replay.ReplayRangeTable(run_until, registry=registry, range_filter=driving.create_range_filter(registry))
+    reader = ranging.RangingReader(session, table, clock=clock.monotonic)
+
+    previous_output = base.set_output(output)
+    previous_tracer = tracing.get_tracer()
+    tracer = tracing.configure()
+    try:
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        driving.sense(rpi_car, tracker, session=session, reader=reader, registry=registry, solver=solver,
+                      clock=clock.monotonic, until=finished)
+        wall_time = time.perf_counter() - wall_start
+        cpu_time = time.process_time() - cpu_start
+        scheduler.stop()
+    finally:
+        tracing.set_tracer(previous_tracer)
+        base.set_output(previous_output)
+
+    virtual_time = clock.now - start_time
+    number_of_fixes = rpi_car.get_pose().seq
+    result = {'frames': len(frames) if frames else world.number_of_ranges,
+              'ranges': table.sequence,
+              'rejected_ranges': table.rejected_ranges,
+              'fixes': number_of_fixes,
+              'virtual_seconds': virtual_time,
+              'wall_seconds': wall_time,
+              'cpu_seconds': cpu_time,
+              'speedup': virtual_time / wall_time if wall_time > 0 else None,
+              'fixes_per_second': number_of_fixes / wall_time if wall_time > 0 else None,
+              'reached_goal': reached_time is not None,
+              'time_to_goal': reached_time - start_time if reached_time is not None else None,
+              'motor_writes': output.number_of_writes,
+              'pose': (rpi_car.pose.x, rpi_car.pose.y),
+              'latency_p50_us': latency.percentile(50),
+              'latency_p99_us': latency.percentile(99)}
+    result.update(tracer.statistics())
+    return result
+
+
+def print_result(result):
+    print('Replayed %.0f s with %d Frames in %.2f s (%.0fx), %d Fixes, %.0f Fixes per second, reached goal: %s'
+          % (result['virtual_seconds'], result['frames'], result['wall_seconds'], result['speedup'],
+             result['fixes'], result['fixes_per_second'], result['reached_goal']))
+    for name, lowest, highest in tracing.SPANS:
+        timing = result[name]
+        print('%-12s %7d Spans, mean %8.1f us, p50 %8.1f us, p99 %8.1f us, max %8.1f us'
+              % (name, timing['count'], timing['mean_us'], timing['p50_us'], timing['p99_us'], timing['max_us']))
+
+
+def main():
+    logs.configure(logs.QUIET)
+    solver = sys.argv[2] if len(sys.argv) > 2 else SOLVER
+    if len(sys.argv) > 1:
+        frames = replay.read_recording(sys.argv[1])
+        stop_at_goal = True
+    else:
+        trajectory = replay.line_trajectory(START, driving.FINAL_POSITION, SYNTHETIC_SPEED)
+        frames = replay.synthetic_recording(driving.ANCHORS, trajectory, SYNTHETIC_DURATION,
+                                            interval=0.1, noise=SYNTHETIC_NOISE)
+        # The synthetic Car does not follow the Controller, replay all of it
+        stop_at_goal = False
+    result = run(frames, solver=solver, stop_at_goal=stop_at_goal)
+    print_result(result)
+    return result
+
+
+if __name__ == '__main__':
+    main()
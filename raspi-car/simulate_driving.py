@@ -0,0 +1,145 @@
+"""
+Closed loop Missions in the simulated World, without the Car and without the DWM1001 Tracker.
+Every Mission starts the Car at a random Position and heading between the Anchors of a map in driving.py
+and drives to a random Goal, each Mission is driven with every Steering on the same Ranges seed.
+The Missions run in parallel Processes, the summary reports time-to-goal, CPU load and latency per Steering.
+Run from raspi-car/: python3 simulate_driving.py [number_of_missions [processes]]
+"""
+
+import math
+import multiprocessing
+import sys
+
+import numpy as np
+
+import driving
+import replay_driving
+from base_scripts import anchors
+from base_scripts import logs
+from base_scripts import simulation
+
+
+NUMBER_OF_MISSIONS = 1000
+STEERINGS = ['PID', 'PID2']
+MISSION_TIMEOUT = 120.0     # In Seconds of simulated time
+MIN_MISSION_DISTANCE = 100  # In CM between Start and Goal
+MARGIN = 20                 # In CM, Start and Goal keep this distance to the border of the Anchors
+SOLVER = 'NUMPY'            # The LSE Solver takes about 40 times longer per Fix
+
+# Anchors and Wheel Calibration of every map
+MAPS = {'lukas': (driving.ANCHORS,
+                  (driving.lukas_calibration_left_wheel, driving.lukas_calibration_right_wheel)),
+        'birkan': (anchors.AnchorRegistry(driving.birkan_responder_locations),
+                   (driving.birkan_calibration_left_wheel, driving.birkan_calibration_right_wheel))}
+
+# Errors of the Ranges
+UWB_NOISE = 0.05            # Standard deviation in Meters
+NLOS_PROBABILITY = 0.02
+DROPOUT = 0.02
+
+
+def random_mission(seed):
+    """
+    :param seed: seed of the Mission, also used for the Ranges
+    :return: dict with seed, map, start, heading and goal
+    """
+    rng = np.random.default_rng(seed)
+    map_name = sorted(MAPS)[rng.integers(len(MAPS))]
+    registry = MAPS[map_name][0]
+    low = registry.positions[:, :2].min(axis=0) + MARGIN
+    high = registry.positions[:, :2].max(axis=0) - MARGIN
+    while True:
+        start = rng.uniform(low, high)
+        goal = rng.uniform(low, high)
+        if math.hypot(*(goal - start)) >= MIN_MISSION_DISTANCE:
+            break
+    return {'seed': seed, 'map': map_name, 'start': tuple(start), 'heading': rng.uniform(-math.pi, math.pi),
+            'goal': tuple(goal)}
+
+
+def run_mission(mission):
+    """
+    :param mission: dict of random_mission with the steering
+    :return: dict with the Mission and its result
+    """
+    registry, calibration = MAPS[mission['map']]
+    model = simulation.UWBModel(noise=UWB_NOISE, nlos_probability=NLOS_PROBABILITY, dropout=DROPOUT)
+    # The Motors have the offsets the Wheel Calibration compensates
+    world = simulation.World(registry, mission['start'], mission['heading'], seed=mission['seed'], model=model,
+                             wheel_offset=(-calibration[0], -calibration[1]))
+    result = replay_driving.run(world=world, duration=MISSION_TIMEOUT, solver=SOLVER, steering=mission['steering'],
+                                registry=registry, goal=mission['goal'], calibration=calibration)
+    return dict(mission,
+                reached_goal=result['reached_goal'],
+                time_to_goal=result['time_to_goal'],
+                final_error=world.distance_to(*mission['goal']),
+                path_length=world.path_length,
+                virtual_seconds=result['virtual_seconds'],
+                cpu_seconds=result['cpu_seconds'],
+                fixes=result['fixes'],
+                latency_p50_us=result['latency_p50_us'],
+                latency_p99_us=result['latency_p99_us'],
+                control_p99_us=result['control']['p99_us'],
+                solve_p99_us=result['solve']['p99_us'])
+
+
+def summarize(results):
+    """
+    :param results: list of the results of run_mission
+    :return: dict {steering: summary}
+    """
+    summary = {}
+    for steering in STEERINGS:
+        runs = [run for run in results if run['steering'] == steering]
+        reached = [run for run in runs if run['reached_goal']]
+        times = np.array([run['time_to_goal'] for run in reached])
+        virtual_seconds = sum(run['virtual_seconds'] for run in runs)
+        summary[steering] = {
+            'missions': len(runs),
+            'reached': len(reached),
+            'time_to_goal_mean': float(times.mean()) if reached else None,
+            'time_to_goal_p50': float(np.percentile(times, 50)) if reached else None,
+            'time_to_goal_p95': float(np.percentile(times, 95)) if reached else None,
+            'final_error_mean': float(np.mean([run['final_error'] for run in reached])) if reached else None,
+            'path_length_mean': float(np.mean([run['path_length'] for run in reached])) if reached else None,
+            # CPU seconds per second of driving, the load of the whole stack on this machine
+            'cpu_load': sum(run['cpu_seconds'] for run in runs) / virtual_seconds if virtual_seconds else None,
+            'latency_p50_us': float(np.median([run['latency_p50_us'] for run in runs])) if runs else None,
+            'latency_p99_us': float(np.median([run['latency_p99_us'] for run in runs])) if runs else None,
+            'control_p99_us': float(np.median([run['control_p99_us'] for run in runs])) if runs else None,
+            'solve_p99_us': float(np.median([run['solve_p99_us'] for run in runs])) if runs else None}
+    return summary
+
+
+def print_summary(summary):
+    for steering, result in summary.items():
+        if result['reached']:
+            print('%-5s reached %d of %d, time to goal mean %.1f s p50 %.1f s p95 %.1f s, final error %.1f cm, '
+                  'path %.0f cm' % (steering, result['reached'], result['missions'], result['time_to_goal_mean'],
+                                    result['time_to_goal_p50'], result['time_to_goal_p95'],
+                                    result['final_error_mean'], result['path_length_mean']))
+        else:
+            print('%-5s reached 0 of %d' % (steering, result['missions']))
+        print('      CPU %.2f %% of one core, estimation age p50 %d ms p99 %d ms, control p99 %d us, solve p99 %d us'
+              % (result['cpu_load'] * 100, result['latency_p50_us'] / 1000, result['latency_p99_us'] / 1000,
+                 result['control_p99_us'], result['solve_p99_us']))
+
+
+def main(number_of_missions=NUMBER_OF_MISSIONS, processes=None):
+    """
+    :param number_of_missions: number of random Missions, each is driven with every Steering
+    :param processes: number of Processes, one per CPU if None
+    :return: summary of summarize
+    """
+    missions = [dict(random_mission(seed), steering=steering)
+                for seed in range(number_of_missions) for steering in STEERINGS]
+    with multiprocessing.Pool(processes, initializer=logs.configure, initargs=(logs.QUIET,)) as pool:
+        results = pool.map(run_mission, missions, chunksize=4)
+    summary = summarize(results)
+    print_summary(summary)
+    return summary
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else NUMBER_OF_MISSIONS,
+         int(sys.argv[2]) if len(sys.argv) > 2 else None)